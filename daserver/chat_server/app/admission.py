@@ -0,0 +1,274 @@
+"""受け付け制御とクライアント単位のレート制限
+
+同時ストリーミングセッション数と実行中のLLM呼び出し数に上限を設け、
+クライアントごとにトークンバケットでリクエスト頻度を制限する。上限を超えた
+リクエストは待たせずに即座に拒否し、再試行までの目安の秒数を返す。
+
+レート制限のバケットは状態ストアに保存するため、共有ストアを使えば複数の
+ワーカーで同じクライアントの制限を共有できる。同時実行数の上限はワーカーごとに
+数える（プロセス全体の上限は ワーカー数 × 上限 になる）。
+
+リバースプロキシの背後では接続元がプロキシのアドレスになるため、信頼する
+プロキシからの接続に限り X-Forwarded-For / Forwarded ヘッダーからクライアントの
+アドレスを求める（ClientIdentifier）。
+"""
+import ipaddress
+import math
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from app import metrics
+from app import state_store
+from app.state_store import InProcessStore, StateStore
+
+# WebSocketを拒否する際のクローズコード（1013 = Try Again Later）
+WS_CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class AdmissionRejected(Exception):
+    """受け付け上限を超えたため拒否されたリクエスト"""
+
+    MESSAGES = {
+        "capacity": "サーバーが混雑しています",
+        "rate_limited": "リクエストが多すぎます",
+    }
+
+    def __init__(self, reason: str, retry_after: float):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(
+            f"{self.MESSAGES.get(reason, reason)}。"
+            f"{self.retry_after_seconds}秒後に再試行してください。"
+        )
+
+    @property
+    def retry_after_seconds(self) -> int:
+        """Retry-Afterヘッダー用の整数秒（最低1秒）"""
+        return max(1, math.ceil(self.retry_after))
+
+
+class TokenBucket:
+    """トークンバケット（rate: 1秒あたりの補充数、burst: 最大保持数）"""
+    __slots__ = ("rate", "burst", "tokens", "updated_at")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def try_acquire(self, now: Optional[float] = None) -> Tuple[bool, float]:
+        """トークンを1つ取得する
+
+        Returns:
+            Tuple[bool, float]: 取得できたか、取得できない場合は次に取得できるまでの秒数
+        """
+        now = time.monotonic() if now is None else now
+        elapsed = max(0.0, now - self.updated_at)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True, 0.0
+        if self.rate <= 0:
+            return False, 60.0
+        return False, (1.0 - self.tokens) / self.rate
+
+
+class Slot:
+    """取得した受け付け枠（with 文または release() で返却）"""
+    __slots__ = ("_controller", "_kind", "_released")
+
+    def __init__(self, controller: "AdmissionController", kind: str):
+        self._controller = controller
+        self._kind = kind
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release(self._kind)
+
+    def __enter__(self) -> "Slot":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class AdmissionController:
+    """同時実行数の上限とクライアント単位のレート制限
+
+    環境変数:
+        MAX_STREAMING_SESSIONS: 同時ストリーミングセッション数の上限（デフォルト100、0で無制限）
+        MAX_INFLIGHT_LLM_CALLS: 実行中のLLM呼び出し数の上限（デフォルト32、0で無制限）
+        CLIENT_RATE_LIMIT: クライアントごとの1秒あたりのリクエスト数（デフォルト2、0で無制限）
+        CLIENT_RATE_BURST: クライアントごとの連続リクエスト数（デフォルト10）
+    """
+
+    def __init__(self, max_sessions: Optional[int] = None,
+                 max_llm_calls: Optional[int] = None,
+                 client_rate: Optional[float] = None,
+                 client_burst: Optional[float] = None,
+                 max_clients: int = 10000,
+                 state: Optional[StateStore] = None):
+        self.max_sessions = max_sessions if max_sessions is not None else int(
+            os.getenv('MAX_STREAMING_SESSIONS', '100'))
+        self.max_llm_calls = max_llm_calls if max_llm_calls is not None else int(
+            os.getenv('MAX_INFLIGHT_LLM_CALLS', '32'))
+        self.client_rate = client_rate if client_rate is not None else float(
+            os.getenv('CLIENT_RATE_LIMIT', '2'))
+        self.client_burst = client_burst if client_burst is not None else float(
+            os.getenv('CLIENT_RATE_BURST', '10'))
+        self.max_clients = max_clients
+        self._active = {"session": 0, "llm": 0}
+        # バケットは満杯に戻るまでの時間が過ぎれば破棄しても同じ
+        refill = self.client_burst / self.client_rate if self.client_rate > 0 else None
+        self._buckets = (state or InProcessStore()).namespace(
+            "rate_limit", max_entries=max_clients, ttl=refill)
+        self._lock = threading.Lock()
+
+    def _limit(self, kind: str) -> int:
+        return self.max_sessions if kind == "session" else self.max_llm_calls
+
+    def active(self, kind: str) -> int:
+        return self._active[kind]
+
+    def check_rate(self, client_id: str, kind: str) -> None:
+        """クライアントのレート制限を確認する
+
+        Raises:
+            AdmissionRejected: レート制限を超えた場合
+        """
+        if self.client_rate <= 0:
+            return
+        # ワーカー間で共有するため、時刻は単調時計ではなく壁時計を使う
+        now = time.time()
+        result: List[Tuple[bool, float]] = []
+
+        def take(state):
+            bucket = TokenBucket(self.client_rate, self.client_burst)
+            if state is None:
+                bucket.updated_at = now
+            else:
+                bucket.tokens, bucket.updated_at = state
+            result.append(bucket.try_acquire(now))
+            return [bucket.tokens, bucket.updated_at]
+
+        self._buckets.update(client_id, take)
+        allowed, wait = result[-1]
+        if not allowed:
+            metrics.ADMISSION_REJECTED.inc(kind=kind, reason="rate_limited")
+            raise AdmissionRejected("rate_limited", wait)
+
+    def acquire(self, kind: str) -> Slot:
+        """同時実行枠を取得する（待たずに成否を判定）
+
+        Raises:
+            AdmissionRejected: 上限に達している場合
+        """
+        limit = self._limit(kind)
+        with self._lock:
+            if limit > 0 and self._active[kind] >= limit:
+                metrics.ADMISSION_REJECTED.inc(kind=kind, reason="capacity")
+                raise AdmissionRejected("capacity", 1.0)
+            self._active[kind] += 1
+        metrics.ADMISSION_ACTIVE.inc(kind=kind)
+        return Slot(self, kind)
+
+    def admit(self, client_id: str, kind: str) -> Slot:
+        """レート制限と同時実行数の両方を確認して枠を取得する"""
+        self.check_rate(client_id, kind)
+        return self.acquire(kind)
+
+    def _release(self, kind: str) -> None:
+        with self._lock:
+            self._active[kind] -= 1
+        metrics.ADMISSION_ACTIVE.dec(kind=kind)
+
+
+def _parse_network(value: str):
+    return ipaddress.ip_network(value.strip(), strict=False)
+
+
+def _strip_port(value: str) -> str:
+    """ヘッダー中のアドレスから引用符・角括弧・ポート番号を取り除く"""
+    value = value.strip().strip('"')
+    if value.startswith("["):
+        return value[1:].split("]", 1)[0]
+    if value.count(":") == 1:
+        return value.split(":", 1)[0]
+    return value
+
+
+class ClientIdentifier:
+    """レート制限に使うクライアントの識別子を接続元とプロキシヘッダーから求める
+
+    接続元が信頼するプロキシの場合のみヘッダーを参照し、右（サーバーに近い側）から
+    順に信頼するプロキシを読み飛ばして、最初に現れた信頼しないアドレスを
+    クライアントとみなす。信頼しない接続元からのヘッダーは偽装できるため無視する。
+
+    環境変数:
+        TRUSTED_PROXIES: 信頼するプロキシのアドレスまたはネットワーク（カンマ区切り、デフォルトは空）
+        CLIENT_IP_HEADER: 参照するヘッダー（x-forwarded-for または forwarded、デフォルト x-forwarded-for）
+    """
+
+    def __init__(self, trusted_proxies: Optional[str] = None,
+                 header: Optional[str] = None):
+        if trusted_proxies is None:
+            trusted_proxies = os.getenv('TRUSTED_PROXIES', '')
+        self.trusted = [_parse_network(item) for item in trusted_proxies.split(",")
+                        if item.strip()]
+        self.header = (header or os.getenv('CLIENT_IP_HEADER', 'x-forwarded-for')).lower()
+        if self.header not in ("x-forwarded-for", "forwarded"):
+            raise ValueError(f"CLIENT_IP_HEADER に指定できないヘッダーです: {self.header}")
+
+    def is_trusted(self, address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.trusted)
+
+    def _forwarded_chain(self, headers) -> List[str]:
+        """ヘッダーに記録された経路（クライアント側から順）"""
+        chain: List[str] = []
+        # 複数行に分かれたヘッダーは順に連結したものと同じ
+        for value in headers.getlist(self.header):
+            for element in value.split(","):
+                if self.header == "x-forwarded-for":
+                    address = element
+                else:
+                    address = ""
+                    for pair in element.split(";"):
+                        name, _, param = pair.partition("=")
+                        if name.strip().lower() == "for":
+                            address = param
+                if address.strip():
+                    chain.append(_strip_port(address))
+        return chain
+
+    def identify(self, peer: Optional[str], headers) -> str:
+        """クライアントの識別子（状態ストアのキーにするため必ず文字列）
+
+        Args:
+            peer: 接続元のアドレス
+            headers: リクエストヘッダー（getlist() を持つもの）
+        """
+        if not peer:
+            return "unknown"
+        peer = str(peer)
+        if not self.trusted or not self.is_trusted(peer):
+            return peer
+        chain = self._forwarded_chain(headers)
+        for address in reversed(chain):
+            if not self.is_trusted(address):
+                return address
+        # すべて信頼するプロキシの場合は最もクライアント側のアドレスを使う
+        return chain[0] if chain else peer
+
+
+admission = AdmissionController(state=state_store.store)
+client_identifier = ClientIdentifier()
@@ -0,0 +1,265 @@
+"""LLMを呼ばずに定型の問い合わせへ応答するインテントマッチャー
+
+挨拶・時刻・日付・ウィンドウ操作などの定型の入力を、Aho-Corasick法で
+コンパイルした複数パターンの索引で照合し、一致した場合はその場で応答する。
+照合前に NFKC 正規化（全角・半角の統一）、カタカナからひらがなへの変換、
+小文字化、空白と句読点の除去を行うため、表記ゆれを吸収できる。
+
+誤検出を防ぐため、一致したパターンが入力全体の一定割合（INTENT_MIN_COVERAGE）
+以上を占める場合のみ応答する。「こんにちは、量子力学を説明して」のような
+入力はLLMに渡される。英数字だけのパターンは単語の途中（"chi" の中の "hi" など）
+には一致させない。
+
+インテントの追加・上書き（INTENTS_PATH のJSON）:
+    [
+      {"name": "weather", "patterns": ["天気は", "天気を教えて"],
+       "reply": "天気の情報には対応していません。"}
+    ]
+
+応答文では {time}・{date}・{weekday} を現在の時刻・日付・曜日に置き換える
+（サーバーの地域ではなく ASSISTANT_TZ のタイムゾーンで答える）。それ以外の
+波括弧はそのまま応答する。
+"""
+import json
+import logging
+import os
+import re
+import unicodedata
+from collections import deque
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from app import metrics
+
+# 照合時に取り除く文字（空白と句読点・記号）
+_STRIP_CHARS = set(" \t\r\n、。，．,.!！?？・「」『』（）()〜~…")
+# 小書きの母音は通常の母音として扱う（「ウィンドウ」と「ウインドウ」を同一視）
+_SMALL_VOWELS = str.maketrans("ぁぃぅぇぉ", "あいうえお")
+WEEKDAYS = "月火水木金土日"
+# 応答文で置き換えるプレースホルダー
+PLACEHOLDERS = ("time", "date", "weekday")
+_PLACEHOLDER_RE = re.compile(r"\{(\w+)\}")
+
+
+def normalize(text: str) -> str:
+    """照合用に正規化する（NFKC、カタカナ→ひらがな、小書きの母音、小文字化、句読点の除去）"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    chars = []
+    for ch in text:
+        if ch in _STRIP_CHARS:
+            continue
+        code = ord(ch)
+        if 0x30A1 <= code <= 0x30F6:
+            ch = chr(code - 0x60)
+        chars.append(ch)
+    return "".join(chars).translate(_SMALL_VOWELS)
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isascii() and ch.isalnum()
+
+
+class AhoCorasick:
+    """Aho-Corasick法による複数パターンの同時照合"""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[int, object]]] = [[]]
+        self._built = False
+
+    def add(self, pattern: str, value: object) -> None:
+        """パターン（正規化済み）と一致時に返す値を登録する"""
+        if not pattern:
+            return
+        node = 0
+        for ch in pattern:
+            next_node = self._goto[node].get(ch)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][ch] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append((len(pattern), value))
+        self._built = False
+
+    def build(self) -> None:
+        """失敗関数を構築する（幅優先）"""
+        queue = deque(self._goto[0].values())
+        for node in queue:
+            self._fail[node] = 0
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(ch, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+        self._built = True
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, object]]:
+        """(開始位置, 長さ, 値) を出現順に返す"""
+        if not self._built:
+            self.build()
+        node = 0
+        for index, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for length, value in self._output[node]:
+                yield index - length + 1, length, value
+
+
+class Intent:
+    """インテントの定義（パターン、応答文、クライアントに依頼する操作）"""
+    __slots__ = ("name", "patterns", "reply", "action")
+
+    def __init__(self, name: str, patterns: List[str], reply: str,
+                 action: Optional[str] = None):
+        self.name = name
+        self.patterns = list(patterns)
+        self.reply = reply
+        self.action = action
+
+
+class IntentMatch:
+    """照合結果（応答文は時刻などを埋め込み済み）"""
+    __slots__ = ("intent", "reply", "action")
+
+    def __init__(self, intent: str, reply: str, action: Optional[str] = None):
+        self.intent = intent
+        self.reply = reply
+        self.action = action
+
+
+DEFAULT_INTENTS = [
+    Intent("greeting", ["こんにちは", "こんばんは", "おはよう", "おはようございます",
+                        "はじめまして", "hello", "hi"],
+           "こんにちは！何かお手伝いできることはありますか？"),
+    Intent("thanks", ["ありがとう", "ありがとうございます", "ありがとうございました", "助かりました", "thanks"],
+           "どういたしまして。"),
+    # 「何時ですか」「日付を教えて」のように対象を含まないパターンは
+    # 「会議は何時ですか」「締切の日付を教えて」にも一致するので入れない
+    Intent("time", ["今何時", "いま何時", "今何時ですか", "いま何時ですか", "現在時刻",
+                    "今の時刻", "今の時間を教えて"],
+           "現在の時刻は{time}です。"),
+    Intent("date", ["今日は何日", "今日は何日ですか", "今日何日", "今日の日付",
+                    "今日の日付を教えて", "今日は何曜日", "今日は何曜日ですか"],
+           "今日は{date}（{weekday}曜日）です。"),
+    Intent("open_window", ["ウィンドウを開いて", "チャットを開いて", "画面を開いて"],
+           "チャットウィンドウは開いています。", action="open_window"),
+    # 「閉じて」だけのパターンは「目を閉じて」「ファイルを閉じて」にも一致するので入れない
+    Intent("close_window", ["ウィンドウを閉じて", "チャットを閉じて", "画面を閉じて"],
+           "ウィンドウを閉じます。", action="close_window"),
+]
+
+
+def load_intents(path: str) -> List[Intent]:
+    """INTENTS_PATH のJSONからインテントを読み込む
+
+    Raises:
+        ValueError: 名前・パターン・応答文の形式が不正な場合
+    """
+    with open(path, encoding="utf-8") as f:
+        items = json.load(f)
+    intents = []
+    for item in items:
+        name, patterns, reply = item["name"], item["patterns"], item["reply"]
+        if not isinstance(name, str) or not isinstance(reply, str) or not reply.strip():
+            raise ValueError(f"インテント {name!r} の名前または応答文が不正です")
+        if not isinstance(patterns, list) or not all(
+                isinstance(p, str) and normalize(p) for p in patterns):
+            raise ValueError(f"インテント {name!r} のパターンが不正です")
+        unknown = set(_PLACEHOLDER_RE.findall(reply)) - set(PLACEHOLDERS)
+        if unknown:
+            logging.warning("インテント %s の応答文の {%s} は置き換えられません",
+                            name, ", ".join(sorted(unknown)))
+        intents.append(Intent(name, patterns, reply, item.get("action")))
+    return intents
+
+
+def render_reply(reply: str, now: datetime) -> str:
+    """応答文の既知のプレースホルダーだけを置き換える（それ以外の波括弧はそのまま）"""
+    values = {
+        "time": f"{now.hour}時{now.minute}分",
+        "date": f"{now.year}年{now.month}月{now.day}日",
+        "weekday": WEEKDAYS[now.weekday()],
+    }
+    return _PLACEHOLDER_RE.sub(lambda m: values.get(m.group(1), m.group(0)), reply)
+
+
+class IntentMatcher:
+    """正規化した入力をインテントの索引と照合する
+
+    環境変数:
+        INTENTS_ENABLED: 1で有効（デフォルト1）
+        INTENTS_PATH: 追加・上書きするインテントのJSONファイル
+        INTENT_MIN_COVERAGE: 一致とみなすパターンの文字数の割合（デフォルト0.6）
+        ASSISTANT_TZ: 時刻・日付を答えるタイムゾーン（デフォルト Asia/Tokyo）
+    """
+
+    def __init__(self, intents: Optional[List[Intent]] = None,
+                 min_coverage: Optional[float] = None, enabled: Optional[bool] = None,
+                 tz: Optional[str] = None):
+        self.min_coverage = min_coverage if min_coverage is not None else float(
+            os.getenv('INTENT_MIN_COVERAGE', '0.6'))
+        self.enabled = enabled if enabled is not None else os.getenv('INTENTS_ENABLED', '1') == '1'
+        self.tz = ZoneInfo(tz or os.getenv('ASSISTANT_TZ', 'Asia/Tokyo'))
+        self.intents: Dict[str, Intent] = {}
+        self._index = AhoCorasick()
+        for intent in intents if intents is not None else DEFAULT_INTENTS:
+            self.intents[intent.name] = intent
+        for intent in self.intents.values():
+            for pattern in intent.patterns:
+                self._index.add(normalize(pattern), intent)
+        self._index.build()
+
+    @classmethod
+    def from_env(cls) -> "IntentMatcher":
+        """組み込みのインテントに INTENTS_PATH のインテントを追加して作成する"""
+        intents = list(DEFAULT_INTENTS)
+        path = os.getenv('INTENTS_PATH')
+        if path:
+            try:
+                custom = load_intents(path)
+            except (OSError, ValueError, KeyError) as e:
+                logging.error("インテントの読み込みに失敗しました（%s）: %s", path, e)
+            else:
+                names = {intent.name for intent in custom}
+                intents = [i for i in intents if i.name not in names] + custom
+        return cls(intents)
+
+    def match(self, text: str, path: str = "chat",
+              now: Optional[datetime] = None) -> Optional[IntentMatch]:
+        """一致したインテントの応答を返す（一致しない場合は None）"""
+        if not self.enabled:
+            return None
+        normalized = normalize(text)
+        if not normalized:
+            return None
+        best: Optional[Tuple[int, Intent]] = None
+        for start, length, intent in self._index.iter_matches(normalized):
+            # 英数字のパターンは前後が英数字の場合（単語の途中）は数えない
+            if _is_word_char(normalized[start]) and (
+                    (start > 0 and _is_word_char(normalized[start - 1]))
+                    or (start + length < len(normalized)
+                        and _is_word_char(normalized[start + length]))):
+                continue
+            if best is None or length > best[0]:
+                best = (length, intent)
+        if best is None or best[0] < self.min_coverage * len(normalized):
+            return None
+
+        intent = best[1]
+        now = now or datetime.now(self.tz)
+        reply = render_reply(intent.reply, now)
+        metrics.INTENT_MATCHES.inc(intent=intent.name, path=path)
+        return IntentMatch(intent.name, reply, intent.action)
+
+
+matcher = IntentMatcher.from_env()
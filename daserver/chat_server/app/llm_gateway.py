@@ -0,0 +1,249 @@
+"""音声・テキスト共通のLLMゲートウェイ
+
+すべてのLLM呼び出しを1つのキューで管理し、同時実行数を制限して実行する。
+- 優先度クラス: 音声（対話的）をテキストより常に先に実行する
+- クラス内ではクライアントごとの重み付き公平キューイング（WFQ）で順序を決める
+- 実行前に期限切れ・呼び出し元が離脱したリクエストは破棄する（待機中もタイマーで確認し、
+  実行枠が空くのを待たずにすぐ失敗させる）
+- キュー待ち時間を優先度クラスごとに記録する
+- 応答が遅い呼び出しはヘッジ（2本目の発行）で打ち切る
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from enum import IntEnum
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app import metrics
+from app.resilience import Hedger, llm_hedger
+
+
+class Priority(IntEnum):
+    """優先度クラス（値が小さいほど優先）"""
+    VOICE = 0
+    TEXT = 1
+
+
+class RequestDropped(Exception):
+    """実行前に破棄されたリクエスト"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"LLMリクエストを破棄しました（{reason}）")
+        self.reason = reason
+
+
+class _Job:
+    __slots__ = ("llm", "messages", "priority", "client_id", "deadline",
+                 "alive", "future", "enqueued_at", "timer", "queued")
+
+    def __init__(self, llm, messages, priority: Priority, client_id: str,
+                 deadline: Optional[float], alive: Optional[Callable[[], bool]],
+                 future: asyncio.Future):
+        self.llm = llm
+        self.messages = messages
+        self.priority = priority
+        self.client_id = client_id
+        self.deadline = deadline
+        self.alive = alive
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        # 待機中の期限・離脱を確認するタイマー
+        self.timer: Optional[asyncio.TimerHandle] = None
+        # キューで待機中か（破棄・取り出し済みなら False）
+        self.queued = True
+
+
+class _FairQueue:
+    """1つの優先度クラス内の重み付き公平キュー
+
+    各ジョブに仮想終了時刻（max(仮想時刻, クライアントの直前の終了時刻) + 1/重み）を
+    付け、最小のものから取り出す。特定のクライアントが大量に投入しても、
+    他のクライアントのリクエストが後回しにされ続けることはない。
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, _Job]] = []
+        self._finish: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        # 破棄済みでヒープに残っているジョブの数（取り出すときに読み飛ばす）
+        self._stale = 0
+
+    def __len__(self) -> int:
+        return len(self._heap) - self._stale
+
+    def push(self, job: _Job, weight: float) -> None:
+        start = max(self._virtual_time, self._finish.get(job.client_id, 0.0))
+        finish = start + 1.0 / weight
+        self._finish[job.client_id] = finish
+        heapq.heappush(self._heap, (finish, next(self._seq), job))
+
+    def pop(self) -> _Job:
+        while True:
+            finish, _, job = heapq.heappop(self._heap)
+            if job.queued:
+                break
+            self._stale -= 1
+        job.queued = False
+        self._virtual_time = finish
+        if not self:
+            self._reset()
+        return job
+
+    def discard(self, job: _Job) -> None:
+        """待機中のジョブを破棄する（ヒープからは取り出すときに取り除く）"""
+        job.queued = False
+        self._stale += 1
+        if not self:
+            self._reset()
+
+    def _reset(self) -> None:
+        # キューが空になったら履歴を捨てて仮想時刻を0から数え直す
+        self._heap.clear()
+        self._stale = 0
+        self._finish.clear()
+        self._virtual_time = 0.0
+
+
+class LLMGateway:
+    """優先度付きでLLM呼び出しをスケジューリングするゲートウェイ"""
+
+    def __init__(self, concurrency: Optional[int] = None,
+                 client_weights: Optional[Dict[str, float]] = None,
+                 hedger: Optional[Hedger] = None,
+                 alive_interval: Optional[float] = None):
+        """
+        Args:
+            concurrency: 同時に実行するLLM呼び出し数（LLM_GATEWAY_CONCURRENCY、デフォルト8）
+            client_weights: クライアントごとの重み（未指定のクライアントは1）
+            hedger: 遅い呼び出しにヘッジリクエストを発行する場合に指定
+            alive_interval: 待機中に呼び出し元の離脱を確認する間隔
+                （LLM_GATEWAY_ALIVE_INTERVAL、デフォルト0.5秒）
+        """
+        self.concurrency = concurrency or int(os.getenv('LLM_GATEWAY_CONCURRENCY', '8'))
+        self.alive_interval = alive_interval if alive_interval is not None else float(
+            os.getenv('LLM_GATEWAY_ALIVE_INTERVAL', '0.5'))
+        self.client_weights = dict(client_weights or {})
+        self.hedger = hedger
+        self._queues = {priority: _FairQueue() for priority in Priority}
+        self._running = 0
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def queued(self, priority: Optional[Priority] = None) -> int:
+        if priority is not None:
+            return len(self._queues[priority])
+        return sum(len(q) for q in self._queues.values())
+
+    async def submit(self, llm, messages, priority: Priority = Priority.TEXT,
+                     client_id: str = "", timeout: Optional[float] = None,
+                     alive: Optional[Callable[[], bool]] = None) -> Any:
+        """LLM呼び出しをキューに入れ、結果を待つ
+
+        Args:
+            llm: invoke(messages) を持つLLMクライアント
+            messages: LLMに渡すメッセージ
+            priority: 優先度クラス
+            client_id: 公平キューイングに使うクライアントの識別子
+            timeout: この秒数以内に実行を開始できない場合は破棄する
+            alive: 呼び出し元がまだ応答を待っているかを返す関数
+
+        Raises:
+            RequestDropped: 実行前に期限切れ・呼び出し元の離脱で破棄された場合
+                （待機中に期限が来た場合は実行枠が空くのを待たずに送出する）
+        """
+        future = asyncio.get_running_loop().create_future()
+        deadline = time.monotonic() + timeout if timeout else None
+        job = _Job(llm, messages, priority, client_id, deadline, alive, future)
+        self._queues[priority].push(job, self.client_weights.get(client_id, 1.0))
+        metrics.LLM_GATEWAY_QUEUED.inc(priority=priority.name.lower())
+        self._dispatch()
+        if job.queued:
+            self._schedule_check(job)
+        return await future
+
+    def _schedule_check(self, job: _Job) -> None:
+        """待機中のジョブの期限・離脱を次に確認するタイマーを設定する"""
+        delays = []
+        if job.deadline is not None:
+            delays.append(max(0.0, job.deadline - time.monotonic()))
+        if job.alive is not None and self.alive_interval > 0:
+            delays.append(self.alive_interval)
+        if delays:
+            job.timer = job.future.get_loop().call_later(min(delays), self._check, job)
+
+    def _check(self, job: _Job) -> None:
+        """待機中のジョブを確認し、期限切れ・離脱していれば実行を待たずに破棄する"""
+        job.timer = None
+        if not job.queued:
+            return
+        reason = self._drop_reason(job)
+        if reason is None:
+            self._schedule_check(job)
+            return
+        self._queues[job.priority].discard(job)
+        metrics.LLM_GATEWAY_QUEUED.dec(priority=job.priority.name.lower())
+        self._drop(job, reason)
+
+    def _drop(self, job: _Job, reason: str) -> None:
+        metrics.LLM_GATEWAY_DROPPED.inc(priority=job.priority.name.lower(), reason=reason)
+        if not job.future.done():
+            job.future.set_exception(RequestDropped(reason))
+
+    def _next_job(self) -> Optional[_Job]:
+        for priority in Priority:
+            queue = self._queues[priority]
+            if queue:
+                job = queue.pop()
+                metrics.LLM_GATEWAY_QUEUED.dec(priority=priority.name.lower())
+                if job.timer is not None:
+                    job.timer.cancel()
+                    job.timer = None
+                return job
+        return None
+
+    def _drop_reason(self, job: _Job) -> Optional[str]:
+        if job.future.done():
+            return "caller_gone"
+        if job.alive is not None and not job.alive():
+            return "caller_gone"
+        if job.deadline is not None and time.monotonic() > job.deadline:
+            return "deadline"
+        return None
+
+    def _dispatch(self) -> None:
+        while self._running < self.concurrency:
+            job = self._next_job()
+            if job is None:
+                return
+            reason = self._drop_reason(job)
+            if reason is not None:
+                self._drop(job, reason)
+                continue
+            metrics.LLM_GATEWAY_QUEUE_TIME.observe(
+                time.monotonic() - job.enqueued_at, priority=job.priority.name.lower())
+            self._running += 1
+            job.future.get_loop().create_task(self._run(job))
+
+    async def _run(self, job: _Job) -> None:
+        try:
+            if self.hedger is not None:
+                result = await self.hedger.run(
+                    lambda: asyncio.to_thread(job.llm.invoke, job.messages))
+            else:
+                result = await asyncio.to_thread(job.llm.invoke, job.messages)
+            if not job.future.done():
+                job.future.set_result(result)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            self._running -= 1
+            self._dispatch()
+
+
+gateway = LLMGateway(hedger=llm_hedger)
@@ -0,0 +1,138 @@
+"""ノンブロッキングなログ出力
+
+イベントループからのログ出力はキューに積むだけにし、フォーマットと書き込みは
+QueueListener のバックグラウンドスレッドで行う。音声チャンク単位のような
+高頻度のログはレート制限し、セッション終了時のサマリーで置き換える。
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# チャンク単位の高頻度ログ用ロガー（レート制限付き）
+stream_logger = logging.getLogger("app.stream")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_lock = threading.Lock()
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """フォーマットを行わずにレコードをキューへ積むハンドラー
+
+    標準の QueueHandler.prepare() は呼び出し元スレッドでメッセージを
+    フォーマットするため、同一プロセス内のリスナーに渡す場合は省略して
+    フォーマットをリスナースレッドに任せる。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """メッセージテンプレートごとのトークンバケットでログを間引くフィルター
+
+    抑制した件数は次に出力されるレコードの末尾に付記する。
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 5):
+        """
+        Args:
+            rate: テンプレートごとの1秒あたりの出力件数
+            burst: 連続して出力できる最大件数
+        """
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        # (ロガー名, テンプレート) -> [トークン, 最終更新時刻, 抑制件数]
+        self._buckets: Dict[Tuple[str, str], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1.0:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1.0
+            suppressed, bucket[2] = bucket[2], 0
+
+        if suppressed and isinstance(record.args, tuple):
+            record.msg = f"{record.msg} (他 %d 件を省略)"
+            record.args = record.args + (suppressed,)
+        return True
+
+
+def setup_logging(level: Optional[str] = None) -> logging.handlers.QueueListener:
+    """ルートロガーをキュー経由の出力に設定する（複数回呼んでも1度だけ設定）
+
+    環境変数:
+        LOG_LEVEL: ログレベル（デフォルト: INFO）
+        LOG_STREAM_RATE: チャンク単位ログの1秒あたりの出力件数（デフォルト: 1）
+        LOG_STREAM_BURST: チャンク単位ログの連続出力件数（デフォルト: 5）
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return _listener
+
+        level = level or os.getenv("LOG_LEVEL", "INFO")
+        output = logging.StreamHandler()
+        output.setFormatter(logging.Formatter(LOG_FORMAT))
+
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(
+            records, output, respect_handler_level=True
+        )
+        _listener.start()
+        atexit.register(_listener.stop)
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(LazyQueueHandler(records))
+        root.setLevel(level)
+
+        stream_logger.addFilter(RateLimitFilter(
+            rate=float(os.getenv("LOG_STREAM_RATE", "1")),
+            burst=int(os.getenv("LOG_STREAM_BURST", "5")),
+        ))
+        return _listener
+
+
+class SessionLogSummary:
+    """セッション単位の集計値（チャンクごとのログの代わりに終了時に1行出力）"""
+    __slots__ = (
+        "session_id", "started_at", "messages_received", "bytes_received",
+        "chunks_sent", "bytes_sent", "transcripts", "errors",
+    )
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.started_at = time.monotonic()
+        self.messages_received = 0
+        self.bytes_received = 0
+        self.chunks_sent = 0
+        self.bytes_sent = 0
+        self.transcripts = 0
+        self.errors = 0
+
+    def log(self, logger: Optional[logging.Logger] = None) -> None:
+        (logger or logging.getLogger()).info(
+            "セッション %s を終了: 受信 %d メッセージ / %d バイト, "
+            "送信 %d チャンク / %d バイト, 認識 %d 件, エラー %d 件, 所要 %.1f 秒",
+            self.session_id, self.messages_received, self.bytes_received,
+            self.chunks_sent, self.bytes_sent, self.transcripts, self.errors,
+            time.monotonic() - self.started_at,
+        )
@@ -0,0 +1,165 @@
+"""イベントループの遅延とブロッキング呼び出しの検出
+
+ループ上の計測タスクが一定間隔で sleep し、予定より遅れて再開した時間を
+スケジューリング遅延として記録する。別スレッドのウォッチドッグは計測タスクが
+しきい値を超えて再開しない場合に、ループのスレッドのスタックを取得して
+ブロックしている箇所を記録する。
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Deque, List, Optional
+
+from app import metrics
+
+
+class BlockingCallError(AssertionError):
+    """テストでブロッキング呼び出しが検出された場合のエラー"""
+
+
+class BlockingEvent:
+    """検出されたブロッキング（継続時間とループスレッドのスタック）"""
+    __slots__ = ("detected_at", "duration", "stack")
+
+    def __init__(self, duration: float, stack: str):
+        self.detected_at = time.time()
+        self.duration = duration
+        self.stack = stack
+
+    def to_dict(self) -> dict:
+        return {
+            "detected_at": self.detected_at,
+            "duration_ms": round(self.duration * 1000.0, 1),
+            "stack": self.stack,
+        }
+
+
+class LoopMonitor:
+    """イベントループのスケジューリング遅延を計測するウォッチドッグ"""
+
+    def __init__(self, interval: Optional[float] = None,
+                 threshold: Optional[float] = None, max_events: int = 20):
+        """
+        Args:
+            interval: 計測間隔（秒、LOOP_MONITOR_INTERVAL）
+            threshold: ブロッキングとみなす遅延（秒、LOOP_MONITOR_THRESHOLD）
+            max_events: 保持するブロッキングイベント数
+        """
+        self.interval = interval if interval is not None else float(
+            os.getenv("LOOP_MONITOR_INTERVAL", "0.05"))
+        self.threshold = threshold if threshold is not None else float(
+            os.getenv("LOOP_MONITOR_THRESHOLD", "0.1"))
+        self.lags: Deque[float] = deque(maxlen=2048)
+        self.blocking_events: Deque[BlockingEvent] = deque(maxlen=max_events)
+        self._beat = time.perf_counter()
+        self._current: Optional[BlockingEvent] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """実行中のイベントループで監視を開始する"""
+        if self.running:
+            return
+        loop = self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.perf_counter()
+        self._stopped.clear()
+        self._task = loop.create_task(self._probe(), name="loop-monitor")
+        self._watchdog = threading.Thread(
+            target=self._watch, name="loop-monitor-watchdog", daemon=True
+        )
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1.0)
+            self._watchdog = None
+
+    async def _probe(self) -> None:
+        while True:
+            self._beat = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - self._beat - self.interval)
+            self.lags.append(lag)
+            metrics.EVENT_LOOP_LAG.observe(lag)
+            current = self._current
+            if current is not None:
+                # ブロッキングが終わったので実際の継続時間で更新する
+                current.duration = lag
+                self._current = None
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.interval / 2):
+            if self._loop is not None and not self._loop.is_running():
+                # ループが停止している間（テストの合間など）はブロッキングとみなさない
+                self._beat = time.perf_counter()
+                continue
+            overdue = time.perf_counter() - self._beat - self.interval
+            if overdue > self.threshold and self._current is None:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame else ""
+                self._current = event = BlockingEvent(overdue, stack)
+                self.blocking_events.append(event)
+                metrics.EVENT_LOOP_BLOCKED.inc()
+                logging.warning(
+                    "イベントループが %.0f ms 以上ブロックされています:\n%s",
+                    overdue * 1000.0, stack,
+                )
+
+    def percentiles(self) -> dict:
+        """遅延のパーセンタイル（ミリ秒）"""
+        lags: List[float] = sorted(self.lags)
+        if not lags:
+            return {"samples": 0}
+
+        def at(q: float) -> float:
+            return round(lags[min(len(lags) - 1, int(q * len(lags)))] * 1000.0, 3)
+
+        return {
+            "samples": len(lags),
+            "p50_ms": at(0.5),
+            "p90_ms": at(0.9),
+            "p99_ms": at(0.99),
+            "max_ms": round(lags[-1] * 1000.0, 3),
+        }
+
+    def report(self) -> dict:
+        return {
+            "running": self.running,
+            "interval_ms": self.interval * 1000.0,
+            "threshold_ms": self.threshold * 1000.0,
+            "lag": self.percentiles(),
+            "blocking_events": [e.to_dict() for e in self.blocking_events],
+        }
+
+    def assert_no_blocking(self) -> None:
+        """ブロッキングが検出されていればテストを失敗させる"""
+        if self.blocking_events:
+            event = self.blocking_events[0]
+            raise BlockingCallError(
+                f"イベントループが {event.duration * 1000.0:.0f} ms ブロックされました"
+                f"（{len(self.blocking_events)} 件）:\n{event.stack}"
+            )
+
+
+monitor = LoopMonitor()
@@ -1,21 +1,96 @@
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, SecretStr
 import os
 import asyncio
+import hmac
+import json
 import logging
+import time
+import uuid
+from contextlib import asynccontextmanager
 
-# ログレベルの設定
-logging.basicConfig(level=logging.INFO,
-                   format='%(asctime)s - %(levelname)s - %(message)s')
+# ログの設定（キュー経由でバックグラウンドスレッドから出力）
+from app.logging_setup import SessionLogSummary, setup_logging, stream_logger
+setup_logging()
 from langchain_aws import ChatBedrock
-from typing import List, Tuple
-from markdown import markdown
+from typing import List, Optional, Tuple
+from amazon_transcribe import AWSCRTEventLoop
+from amazon_transcribe.auth import CredentialResolver
 from amazon_transcribe.client import TranscribeStreamingClient
+from amazon_transcribe.exceptions import (InternalFailureException, LimitExceededException,
+                                          ServiceException, ServiceUnavailableException,
+                                          UnknownServiceException)
 from amazon_transcribe.handlers import TranscriptResultStreamHandler
 from amazon_transcribe.model import TranscriptEvent
+from awscrt.auth import AwsCredentialsProvider
+from awscrt.exceptions import AwsCrtError
+from botocore.exceptions import (ClientError, ConnectionClosedError, ConnectTimeoutError,
+                                 EndpointConnectionError, ReadTimeoutError)
 
-app = FastAPI()
+from app import metrics, state_store
+from app.admission import (WS_CLOSE_TRY_AGAIN_LATER, AdmissionRejected, admission,
+                           client_identifier)
+from app.intents import IntentMatcher, matcher as intent_matcher
+from app.llm_gateway import Priority, RequestDropped, gateway as llm_gateway
+from app.loop_monitor import monitor as loop_monitor
+from app.rendering import renderer as markdown_renderer
+from app.resilience import CircuitOpenError, bedrock_breaker, transcribe_breaker
+from app.routing import DEFAULT_TIERS, FAST, STANDARD, ModelRouter, ModelTier
+from app.sessions import SessionStore, format_turns
+from app.streaming import (DURATION_LIMIT, WS_CLOSE_POLICY_VIOLATION, StreamingSession,
+                           registry as streaming_sessions)
+from app.stubs import StubChatModel, StubTranscribeClient
+from app.timeline import UtteranceTimeline, recorder as timeline_recorder
+from app.warmup import warmup
+
+# 共有ストアでは各ワーカーのメトリクスを集めて /metrics で合算する
+METRICS_PUBLISH_INTERVAL = float(os.getenv('METRICS_PUBLISH_INTERVAL', '5'))
+worker_metrics = state_store.store.namespace(
+    "metrics", ttl=max(60.0, METRICS_PUBLISH_INTERVAL * 6))
+
+def publish_metrics():
+    """このワーカーのメトリクスを状態ストアに書き込む"""
+    worker_metrics.set(str(os.getpid()), metrics.REGISTRY.export())
+
+async def publish_metrics_periodically():
+    while True:
+        await asyncio.sleep(METRICS_PUBLISH_INTERVAL)
+        try:
+            await asyncio.to_thread(publish_metrics)
+        except Exception as e:
+            logging.warning("メトリクスの共有に失敗しました: %s", e)
+
+async def run_state(func, *args):
+    """状態ストアを読み書きする処理を実行する
+
+    共有ストアはファイルI/Oになるため、イベントループをブロックしないよう
+    ワーカースレッドで実行する。
+    """
+    if state_store.store.shared:
+        return await asyncio.to_thread(func, *args)
+    return func(*args)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """起動時にイベントループの監視とウォームアップを開始し、終了時に停止する"""
+    if os.getenv('LOOP_MONITOR_ENABLED', '1') == '1':
+        loop_monitor.start()
+    warmup.start()
+    publisher = None
+    if state_store.store.shared:
+        publisher = asyncio.create_task(publish_metrics_periodically())
+    yield
+    if publisher is not None:
+        publisher.cancel()
+        # 終了したワーカーの値は合算から外す
+        await asyncio.to_thread(worker_metrics.delete, str(os.getpid()))
+    await warmup.stop()
+    await loop_monitor.stop()
+    markdown_renderer.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 # Disable CORS. Do not remove this for full-stack development.
 app.add_middleware(
@@ -26,57 +101,389 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-# Initialize Bedrock client with AWS credentials from environment variables
-llm = ChatBedrock(
-    model="anthropic.claude-3-sonnet-20240229-v1:0",
-    region=os.getenv('AWS_REGION', 'us-east-1'),
-    aws_access_key_id=SecretStr(os.getenv('AWS_ACCESS_KEY_ID', '')),
-    aws_secret_access_key=SecretStr(os.getenv('AWS_SECRET_ACCESS_KEY', '')),
-    model_kwargs={"temperature": 0.7}
+def create_llm(tier: ModelTier = DEFAULT_TIERS[STANDARD]):
+    """ティアのLLMクライアントを作成する（LLM_BACKEND=stub でローカル検証用のスタブ）"""
+    if os.getenv('LLM_BACKEND', 'bedrock') == 'stub':
+        return StubChatModel.from_env()
+    model_kwargs = {"temperature": tier.temperature}
+    if tier.max_tokens:
+        model_kwargs["max_tokens"] = tier.max_tokens
+    # Initialize Bedrock client with AWS credentials from environment variables
+    return ChatBedrock(
+        model=tier.model_id,
+        region=os.getenv('AWS_REGION', 'us-east-1'),
+        aws_access_key_id=SecretStr(os.getenv('AWS_ACCESS_KEY_ID', '')),
+        aws_secret_access_key=SecretStr(os.getenv('AWS_SECRET_ACCESS_KEY', '')),
+        model_kwargs=model_kwargs
+    )
+
+class SharedCredentialResolver(CredentialResolver):
+    """セッション間で共有するTranscribeの認証情報の解決器
+
+    CRTのデフォルトチェーンは解決した認証情報をキャッシュするため、共有すると
+    セッションごとの認証情報の解決（インスタンスメタデータへの問い合わせなど）を省ける。
+    CRTは取り消された Future に結果を設定しようとして例外になるため、完了は
+    ワーカースレッドで待ち、イベントループ側の中断が解決に伝わらないようにする。
+    """
+
+    def __init__(self, timeout: float = 30.0):
+        self.timeout = timeout
+        self._provider = AwsCredentialsProvider.new_default_chain(AWSCRTEventLoop().bootstrap)
+
+    def resolve(self):
+        return self._provider.get_credentials().result(self.timeout)
+
+    async def get_credentials(self):
+        return await asyncio.to_thread(self.resolve)
+
+_transcribe_credentials: Optional[SharedCredentialResolver] = None
+
+def transcribe_credentials() -> SharedCredentialResolver:
+    global _transcribe_credentials
+    if _transcribe_credentials is None:
+        _transcribe_credentials = SharedCredentialResolver()
+    return _transcribe_credentials
+
+def create_transcribe_client():
+    """Transcribeのクライアントを作成する（TRANSCRIBE_BACKEND=stub でローカル検証用のスタブ）"""
+    if os.getenv('TRANSCRIBE_BACKEND', 'aws') == 'stub':
+        return StubTranscribeClient.from_env()
+    return TranscribeStreamingClient(region=os.getenv('AWS_REGION', 'us-east-1'),
+                                     credential_resolver=transcribe_credentials())
+
+# 音声ストリームの形式。クライアントには接続直後に「設定:」メッセージで通知し、
+# クライアントはこの形式に変換した小さなフレームをバイナリで送信する
+AUDIO_SAMPLE_RATE = int(os.getenv('AUDIO_SAMPLE_RATE', '8000'))
+AUDIO_FRAME_MS = int(os.getenv('AUDIO_FRAME_MS', '20'))
+# Transcribeに1回で送る音声の上限（溜まったフレームをまとめる上限、200ms分）
+AUDIO_MAX_SEND_BYTES = AUDIO_SAMPLE_RATE * 2 // 5
+# Transcribeに送れずに溜まった音声の上限（超えた分は古いものから捨てる）
+AUDIO_QUEUE_MAX_BYTES = int(AUDIO_SAMPLE_RATE * 2 * float(os.getenv('AUDIO_QUEUE_MAX_SECONDS', '5')))
+
+def audio_config_message(session_id: Optional[str] = None) -> str:
+    """クライアントに送る音声形式と会話セッションの通知"""
+    config = {
+        "sample_rate": AUDIO_SAMPLE_RATE,
+        "encoding": "pcm_s16le",
+        "channels": 1,
+        "frame_ms": AUDIO_FRAME_MS,
+    }
+    if session_id:
+        config["session_id"] = session_id
+    return "設定: " + json.dumps(config)
+
+llm = create_llm()
+# 短い問い合わせを高速なモデルに振り分ける（standard ティアは llm をそのまま使う）
+model_router = ModelRouter.from_env(create_llm)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """ルートごとのHTTPリクエスト処理時間を記録"""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=str(status),
+        )
+
+# パスごとの優先度クラスと、実行開始を待てる最大秒数
+LLM_PRIORITIES = {"voice": Priority.VOICE, "chat": Priority.TEXT}
+LLM_QUEUE_TIMEOUTS = {
+    "voice": float(os.getenv('LLM_VOICE_QUEUE_TIMEOUT', '10')),
+    "chat": float(os.getenv('LLM_TEXT_QUEUE_TIMEOUT', '30')),
+}
+
+# 4xxでもBedrock側の混雑・障害を表すエラーコード
+BEDROCK_OUTAGE_CODES = frozenset({
+    "ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException",
+    "InternalServerException", "ModelNotReadyException", "ModelTimeoutException",
+})
+
+def is_bedrock_outage(error: BaseException) -> bool:
+    """Bedrock側の障害（スロットリング・5xx・接続や読み込みのタイムアウト）とみなす例外か
+
+    プロンプトが長すぎるなどの ValidationException、AccessDenied、応答の解析エラーは
+    リクエスト固有の問題なので、サーキットブレーカーの失敗に数えない。
+    """
+    if isinstance(error, ClientError):
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        code = error.response.get("Error", {}).get("Code", "")
+        return status >= 500 or status == 429 or code in BEDROCK_OUTAGE_CODES
+    return isinstance(error, (ConnectTimeoutError, ReadTimeoutError, EndpointConnectionError,
+                              ConnectionClosedError, ConnectionError, TimeoutError))
+
+async def invoke_llm(llm: ChatBedrock, messages, path: str, client_id: str = "",
+                     alive=None, decision=None):
+    """LLMゲートウェイ経由でLLMを呼び出し、所要時間を記録する
+
+    呼び出しはゲートウェイのワーカースレッドで実行され、音声（path="voice"）は
+    テキストより優先される。実行中・待機中のLLM呼び出し数が上限に達している場合は
+    AdmissionRejected を、Bedrockのサーキットブレーカーが開いている場合は
+    CircuitOpenError を送出する。ストリーミングしない呼び出しでは最初のトークンは
+    応答全体と同時に届くため、time-to-first-tokenにも同じ値を記録する。
+    decision を指定した場合はティアごとの所要時間とコストも記録する。
+    """
+    async def submit():
+        with admission.acquire("llm"):
+            return await llm_gateway.submit(
+                llm, messages,
+                priority=LLM_PRIORITIES.get(path, Priority.TEXT),
+                client_id=client_id,
+                timeout=LLM_QUEUE_TIMEOUTS.get(path),
+                alive=alive,
+            )
+
+    started = time.perf_counter()
+    ai_msg = await bedrock_breaker.call(submit, ignore=(AdmissionRejected, RequestDropped),
+                                        is_failure=is_bedrock_outage)
+    elapsed = time.perf_counter() - started
+    metrics.LLM_TIME_TO_FIRST_TOKEN.observe(elapsed, path=path)
+    metrics.LLM_REQUEST_DURATION.observe(elapsed, path=path)
+    if decision is not None:
+        model_router.record(decision, elapsed, messages, ai_msg)
+    return ai_msg
+
+@asynccontextmanager
+async def watch_disconnect(http_request: Request):
+    """HTTPクライアントの切断を監視し、接続中かを返す関数を渡す（ゲートウェイの alive 用）
+
+    ゲートウェイの alive は同期関数のため、切断の確認はバックグラウンドのタスクで
+    llm_gateway.alive_interval ごとに行い、結果を返すだけにする。
+    """
+    connected = True
+
+    async def watch():
+        nonlocal connected
+        while True:
+            await asyncio.sleep(llm_gateway.alive_interval)
+            if await http_request.is_disconnected():
+                connected = False
+                return
+
+    task = asyncio.create_task(watch())
+    try:
+        yield lambda: connected
+    finally:
+        task.cancel()
+
+CHAT_SYSTEM_PROMPT = "あなたは親切なアシスタントです。ユーザーの質問に日本語で答えてください。"
+VOICE_SYSTEM_PROMPT = "あなたは親切なアシスタントです。ユーザーの音声入力に対して日本語で簡潔に答えてください。"
+SUMMARY_SYSTEM_PROMPT = (
+    "次の会話を、この後の質問に答えるために必要な事実を中心に、日本語で200文字以内に要約してください。"
+)
+
+async def summarize_conversation(previous_summary: str, turns) -> str:
+    """予算からあふれた古い発言を高速なモデルで要約する"""
+    text = format_turns(turns)
+    if previous_summary:
+        text = f"これまでの会話の要約:\n{previous_summary}\n\n{text}"
+    messages = [("system", SUMMARY_SYSTEM_PROMPT), ("human", text)]
+    ai_msg = await invoke_llm(model_router.llm_for(FAST, llm), messages, "summary")
+    return str(ai_msg.content) if hasattr(ai_msg, 'content') else str(ai_msg)
+
+# 会話セッション（SESSION_SUMMARIZE=0 で要約せずに古い発言を切り捨てる）
+conversations = SessionStore(
+    summarizer=summarize_conversation if os.getenv('SESSION_SUMMARIZE', '1') == '1' else None,
+    state=state_store.store,
 )
 
+async def render_markdown(text: str) -> str:
+    """マークダウンをHTMLに変換する（ワーカースレッドで実行し、結果をキャッシュ）"""
+    return await markdown_renderer.render(text)
+
+async def send_text(websocket: WebSocket, text: str, session: StreamingSession = None):
+    """WebSocketでテキストを送信し、送信時間（とセッションの送信バイト数）を記録する"""
+    with metrics.WEBSOCKET_SEND_DURATION.time():
+        await websocket.send_text(text)
+    if session is not None:
+        session.bytes_out += len(text.encode('utf-8'))
+
 class ChatRequest(BaseModel):
     message: str
+    # 会話を続ける場合は前回の応答の session_id を指定する
+    session_id: Optional[str] = None
 
 class ChatResponse(BaseModel):
     response: str
+    session_id: Optional[str] = None
+    # クライアントに依頼する操作（例: close_window）
+    action: Optional[str] = None
+
+# 起動時のウォームアップ（WARMUP_LLM_COMPLETION=1 で各ティアのLLMを実際に1回呼び出す）
+WARMUP_LLM_COMPLETION = os.getenv('WARMUP_LLM_COMPLETION', '0') == '1'
+WARMUP_PROMPT = "「はい」とだけ答えてください。"
+
+async def warm_up_llm():
+    """各ティアのLLMクライアントを作成し、指定があれば合成の呼び出しで接続を確立する"""
+    clients = {id(llm): llm}
+    for tier in model_router.tiers:
+        client = await asyncio.to_thread(model_router.llm_for, tier, llm)
+        clients[id(client)] = client
+    if WARMUP_LLM_COMPLETION:
+        await asyncio.gather(*(invoke_llm(client, [("human", WARMUP_PROMPT)], "warmup")
+                               for client in clients.values()))
+
+async def warm_up_transcribe():
+    """Transcribeのクライアントを作成し、共有の認証情報を解決しておく"""
+    await asyncio.to_thread(create_transcribe_client)
+    if os.getenv('TRANSCRIBE_BACKEND', 'aws') == 'stub':
+        return
+    if await transcribe_credentials().get_credentials() is None:
+        raise RuntimeError("Transcribeの認証情報が見つかりません")
+
+warmup.add("markdown", markdown_renderer.warm_up)
+warmup.add("llm", warm_up_llm)
+warmup.add("transcribe", warm_up_transcribe)
 
 @app.get("/healthz")
 async def healthz():
+    """プロセスが応答できるか（ウォームアップの完了は /readyz で確認する）"""
     return {"status": "ok"}
 
+@app.get("/readyz")
+async def readyz():
+    """ウォームアップが完了していれば200、未完了なら503とコンポーネントごとの状態"""
+    return JSONResponse(warmup.report(), status_code=200 if warmup.ready else 503)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus形式のメトリクス（共有ストアの場合は全ワーカーの合計）"""
+    if not state_store.store.shared:
+        return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+    def collect():
+        pid = str(os.getpid())
+        publish_metrics()
+        peers = [snapshot for key, snapshot in worker_metrics.items() if key != pid]
+        return metrics.REGISTRY.render(peers)
+
+    return Response(content=await asyncio.to_thread(collect), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/diagnostics")
+async def diagnostics():
+    """イベントループの遅延パーセンタイルと検出したブロッキング呼び出し"""
+    return {"event_loop": loop_monitor.report()}
+
+@app.get("/admin/sessions")
+async def admin_sessions(request: Request):
+    """このワーカーで実行中の音声セッションと資源使用量（推定メモリの大きい順）
+
+    クライアントのIPアドレスを含むため、ADMIN_TOKEN を設定していない場合は 404 を返し、
+    設定した場合は X-Admin-Token ヘッダーが一致する場合のみ返す。
+    """
+    token = os.getenv('ADMIN_TOKEN')
+    if not token:
+        raise HTTPException(status_code=404, detail="not found")
+    if not hmac.compare_digest(request.headers.get("x-admin-token", ""), token):
+        raise HTTPException(status_code=403, detail="forbidden")
+    return streaming_sessions.report()
+
+def client_id_of(connection) -> str:
+    """レート制限に使うクライアントの識別子（信頼するプロキシの背後では転送元のアドレス）"""
+    peer = connection.client.host if connection.client else None
+    return client_identifier.identify(peer, connection.headers)
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     try:
         # 空のメッセージの場合は特別な応答を返す
         if not request.message.strip():
             return ChatResponse(response="申し訳ありません。メッセージを入力してください。")
 
-        messages = [
-            (
-                "system",
-                "あなたは親切なアシスタントです。ユーザーの質問に日本語で答えてください。",
-            ),
-            ("human", request.message),
-        ]
+        client_id = client_id_of(http_request)
+        await run_state(admission.check_rate, client_id, "chat")
+
+        # 定型の問い合わせはLLMを呼ばずに応答する
+        match = intent_matcher.match(request.message, "chat")
+        if match is not None:
+            html_response = await render_markdown(match.reply)
+            return ChatResponse(response=html_response, action=match.action,
+                                session_id=request.session_id)
+
+        # トークン予算に収まる直近の会話と、それ以前の要約をコンテキストに含める
+        conversation = await run_state(conversations.get, request.session_id)
+        messages = conversations.build_messages(conversation, CHAT_SYSTEM_PROMPT, request.message)
         
-        ai_msg = llm.invoke(messages)
+        decision, target_llm = model_router.select(request.message, "chat", llm)
+        # 待機中にクライアントが切断したリクエストはLLMを呼ばずに破棄する
+        async with watch_disconnect(http_request) as alive:
+            ai_msg = await invoke_llm(target_llm, messages, "chat", client_id=client_id,
+                                      alive=alive, decision=decision)
         response_text = str(ai_msg.content) if hasattr(ai_msg, 'content') else str(ai_msg)
+        await run_state(conversations.record, conversation, request.message, response_text,
+                        asyncio.get_running_loop())
         # Convert markdown response to HTML
-        html_response = markdown(response_text, extensions=['extra'])
-        return ChatResponse(response=html_response)
+        html_response = await render_markdown(response_text)
+        return ChatResponse(response=html_response, session_id=conversation.session_id)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429 if e.reason == "rate_limited" else 503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after_seconds)},
+        )
+    except CircuitOpenError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after_seconds)},
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def is_transcribe_outage(error: BaseException) -> bool:
+    """Transcribe側の障害（5xx・スロットリング・接続エラー）とみなす例外か
+
+    無音が続いた場合の BadRequestException などクライアント起因の4xxや、
+    クライアントの切断はサーキットブレーカーの失敗に数えない。
+    """
+    if isinstance(error, (InternalFailureException, ServiceUnavailableException,
+                          LimitExceededException)):
+        return True
+    if isinstance(error, UnknownServiceException):
+        return error.status_code >= 500 or error.status_code == 429
+    if isinstance(error, ServiceException):
+        return False
+    return isinstance(error, (AwsCrtError, ConnectionError, TimeoutError))
+
 class TranscribeHandler(TranscriptResultStreamHandler):
     """Amazon Transcribeの結果を処理するハンドラー"""
-    def __init__(self, output_stream, websocket: WebSocket, llm: ChatBedrock):
+    def __init__(self, output_stream, websocket: WebSocket, llm: ChatBedrock,
+                 session_id: str = None, client_id: str = "",
+                 router: ModelRouter = None, intent_matcher: IntentMatcher = None,
+                 sessions: SessionStore = None, stream_session: StreamingSession = None):
         super().__init__(output_stream)
         self.websocket = websocket
-        self.final_transcript = ""
+        # 確定してまだ応答していない認識テキスト（応答済みのものは保持しない）
+        self.transcripts: List[str] = []
+        self.stream_session = stream_session
         self.websocket_open = True
         self.llm = llm
+        self.router = router
+        self.intent_matcher = intent_matcher
+        self.sessions = sessions
+        self.last_audio_sent_at = None
+        self.session_id = session_id or uuid.uuid4().hex[:12]
+        self.client_id = client_id or self.session_id
+        self.utterance_count = 0
+        self.timeline = self.new_timeline()
         logging.info("TranscribeHandlerが初期化されました")
+
+    @property
+    def final_transcript(self) -> str:
+        return " ".join(self.transcripts)
+
+    def new_timeline(self) -> UtteranceTimeline:
+        """次の発話のタイムラインを開始"""
+        self.utterance_count += 1
+        return UtteranceTimeline(self.session_id, self.utterance_count)
         
     async def handle_events(self):
         """イベントの処理を開始"""
@@ -84,33 +491,65 @@ class TranscribeHandler(TranscriptResultStreamHandler):
         try:
             await super().handle_events()
         except Exception as e:
-            logging.error(f"handle_eventsでエラーが発生: {e}")
+            logging.error("handle_eventsでエラーが発生: %s", e)
+            if is_transcribe_outage(e):
+                transcribe_breaker.record_failure()
             self.websocket_open = False
         finally:
             logging.info("handle_eventsが終了しました")
 
-    async def process_with_llm(self, text: str):
+    async def process_with_llm(self, text: str, timeline: UtteranceTimeline = None):
         """テキストをLLMで処理し、応答を返す"""
+        timeline = timeline or self.new_timeline()
         try:
-            messages = [
-                (
-                    "system",
-                    "あなたは親切なアシスタントです。ユーザーの音声入力に対して日本語で簡潔に答えてください。",
-                ),
-                ("human", text),
-            ]
+            # 定型の問い合わせはLLMを呼ばずに応答する
+            if self.intent_matcher is not None:
+                match = self.intent_matcher.match(text, "voice")
+                if match is not None:
+                    await self.send_reply(match.reply, timeline, match.action)
+                    return
+
+            conversation = None
+            if self.sessions is not None:
+                conversation = await run_state(self.sessions.get, self.session_id)
+                messages = self.sessions.build_messages(conversation, VOICE_SYSTEM_PROMPT, text)
+            else:
+                messages = [("system", VOICE_SYSTEM_PROMPT), ("human", text)]
             
-            ai_msg = self.llm.invoke(messages)
+            decision, target_llm = None, self.llm
+            if self.router is not None:
+                decision, target_llm = self.router.select(text, "voice", self.llm)
+            timeline.mark("llm_request")
+            ai_msg = await invoke_llm(
+                target_llm, messages, "voice", client_id=self.client_id,
+                alive=lambda: self.websocket_open, decision=decision,
+            )
+            # ストリーミングしない呼び出しでは最初のトークンと完了が同時に届く
+            timeline.mark("first_token")
+            timeline.mark("llm_complete")
             response_text = str(ai_msg.content) if hasattr(ai_msg, 'content') else str(ai_msg)
-            # マークダウンをHTMLに変換
-            html_response = markdown(response_text, extensions=['extra'])
-            
-            if self.websocket_open:
-                await self.websocket.send_text(f"応答: {html_response}")
+            if conversation is not None:
+                await run_state(self.sessions.record, conversation, text, response_text,
+                                asyncio.get_running_loop())
+            await self.send_reply(response_text, timeline)
         except Exception as e:
-            logging.error(f"Error processing LLM response: {e}")
+            logging.error("Error processing LLM response: %s", e)
             if self.websocket_open:
-                await self.websocket.send_text(f"LLM処理エラー: {str(e)}")
+                await send_text(self.websocket, f"LLM処理エラー: {str(e)}", self.stream_session)
+        finally:
+            timeline_recorder.record(timeline)
+
+    async def send_reply(self, response_text: str, timeline: UtteranceTimeline,
+                         action: str = None):
+        """応答をHTMLに変換して送信し、操作があればクライアントに伝える"""
+        # マークダウンをHTMLに変換
+        html_response = await render_markdown(response_text)
+
+        if self.websocket_open:
+            await send_text(self.websocket, f"応答: {html_response}", self.stream_session)
+            if action:
+                await send_text(self.websocket, f"操作: {action}", self.stream_session)
+            timeline.mark("reply_sent")
 
     async def handle_transcript_event(self, transcript_event: TranscriptEvent):
         """音声認識結果を処理し、WebSocketを通じてクライアントに送信"""
@@ -119,77 +558,141 @@ class TranscribeHandler(TranscriptResultStreamHandler):
 
         try:
             if not hasattr(transcript_event, 'transcript') or not transcript_event.transcript:
-                logging.debug("TranscriptEventにtranscriptプロパティがありません")
+                stream_logger.debug("TranscriptEventにtranscriptプロパティがありません")
                 return
 
             results = transcript_event.transcript.results
             if not results:
-                logging.debug("音声認識結果が空です")
+                stream_logger.debug("音声認識結果が空です")
                 return
 
             for result in results:
                 if not hasattr(result, 'alternatives') or not result.alternatives:
-                    logging.debug("代替テキストが見つかりません")
+                    stream_logger.debug("代替テキストが見つかりません")
                     continue
 
                 if hasattr(result, 'is_partial') and result.is_partial:
-                    logging.debug("部分的な結果をスキップします")
+                    stream_logger.debug("部分的な結果をスキップします")
                     continue
 
                 for alt in result.alternatives:
                     if not hasattr(alt, 'transcript'):
-                        logging.debug("代替テキストにtranscriptプロパティがありません")
+                        stream_logger.debug("代替テキストにtranscriptプロパティがありません")
                         continue
 
                     transcript = alt.transcript.strip()
                     if transcript:
-                        logging.info(f"認識されたテキスト: {transcript}")
-                        self.final_transcript += transcript + " "
+                        logging.info("認識されたテキスト: %s", transcript)
+                        if self.last_audio_sent_at is not None:
+                            metrics.TRANSCRIBE_EVENT_LATENCY.observe(
+                                time.perf_counter() - self.last_audio_sent_at
+                            )
+                        # この発話のタイムラインを確定し、次の発話用に新しく開始
+                        timeline, self.timeline = self.timeline, self.new_timeline()
+                        timeline.mark("final_transcript")
+                        self.transcripts.append(transcript)
+                        if self.stream_session is not None:
+                            self.stream_session.add_transcript(transcript)
                         if self.websocket_open:
-                            await self.websocket.send_text(f"認識テキスト: {transcript}")
-                            await self.process_with_llm(transcript)
+                            await send_text(self.websocket, f"認識テキスト: {transcript}",
+                                            self.stream_session)
+                            await self.process_with_llm(transcript, timeline)
+                            # 応答した発話は会話セッションに残るため、ここでは保持しない
+                            self.transcripts.remove(transcript)
+                            if self.stream_session is not None:
+                                self.stream_session.release_transcript(transcript)
 
         except Exception as e:
-            logging.error(f"TranscriptEvent処理中にエラーが発生しました: {e}")
+            logging.error("TranscriptEvent処理中にエラーが発生しました: %s", e)
             self.websocket_open = False
 
     async def send_final_transcript(self):
-        """最終的な認識テキストを送信"""
-        if self.websocket_open and self.final_transcript.strip():
+        """応答できなかった認識テキストを送信"""
+        if self.websocket_open and self.transcripts:
             try:
-                await self.websocket.send_text(f"最終認識テキスト: {self.final_transcript.strip()}")
+                await send_text(self.websocket, f"最終認識テキスト: {self.final_transcript}",
+                                self.stream_session)
             except Exception as e:
-                logging.error(f"最終テキスト送信中にエラーが発生しました: {e}")
+                logging.error("最終テキスト送信中にエラーが発生しました: %s", e)
                 self.websocket_open = False
 
 @app.websocket("/TranscribeStreaming")
 async def transcribe_streaming(websocket: WebSocket):
-    """WebSocketエンドポイント: 音声ストリーミングを受け取り、テキストに変換して返す"""
+    """WebSocketエンドポイント: 音声ストリーミングを受け取り、テキストに変換して返す
+
+    クエリパラメータ session_id で /chat や前回の録音と同じ会話を続ける。
+    使用する会話の session_id は「設定:」メッセージで通知する。会話は接続を
+    閉じても破棄せず、SESSION_IDLE_TIMEOUT のあいだ使われなければ破棄される。
+    """
     await websocket.accept()
+    try:
+        session_slot = await run_state(admission.admit, client_id_of(websocket), "session")
+    except AdmissionRejected as e:
+        # 上限を超えた場合は待たせずに再試行までの秒数を付けて閉じる
+        logging.warning("ストリーミングセッションを拒否しました: %s", e.reason)
+        await websocket.close(code=WS_CLOSE_TRY_AGAIN_LATER,
+                              reason=f"retry_after={e.retry_after_seconds}")
+        return
     websocket_open = True
     stop_audio_stream = False
+    # 終了シグナル（None）は必ず入れられるようキュー自体の件数は制限せず、
+    # 溜まった音声のバイト数を AUDIO_QUEUE_MAX_BYTES までに抑える
     audio_queue = asyncio.Queue()
-    
+    metrics.ACTIVE_SESSIONS.inc()
+    session = streaming_sessions.open(uuid.uuid4().hex[:12], client_id_of(websocket))
+    summary = SessionLogSummary(session.session_id)
+    duration_timer = None
+
+    async def close_for_limit(reason: str):
+        """上限を超えたセッションを理由を付けて閉じる"""
+        if session.close_reason is not None:
+            return
+        session.close_reason = reason
+        logging.warning("音声セッション %s を上限により終了します: %s（推定メモリ %d バイト, %.0f 秒）",
+                        session.session_id, reason, session.memory_bytes, session.duration)
+        await websocket.close(code=WS_CLOSE_POLICY_VIOLATION, reason=reason)
+
+    def enqueue_audio(chunk: bytes):
+        """受信した音声をキューに入れる（上限を超える分は古いものから捨てる）"""
+        while session.audio_buffered + len(chunk) > AUDIO_QUEUE_MAX_BYTES and not audio_queue.empty():
+            _, dropped = audio_queue.get_nowait()
+            metrics.AUDIO_QUEUE_DEPTH.dec()
+            session.release_audio(len(dropped), dropped=True)
+        session.buffer_audio(len(chunk))
+        metrics.AUDIO_QUEUE_DEPTH.inc()
+        audio_queue.put_nowait((time.perf_counter(), chunk))
+
     try:
+        # 録音ごとに接続し直すため、会話は接続ではなくクライアントの session_id で続ける
+        conversation = await run_state(conversations.get,
+                                       websocket.query_params.get("session_id"))
+        # Transcribeの接続を待たずに録音を始められるよう、先に音声形式を通知する
+        await send_text(websocket, audio_config_message(conversation.session_id), session)
+        remaining = streaming_sessions.remaining(session)
+        if remaining is not None:
+            duration_timer = asyncio.get_running_loop().call_later(
+                remaining, lambda: asyncio.ensure_future(close_for_limit(DURATION_LIMIT)))
+
         # Amazon Transcribeクライアントの初期化
         logging.info("Amazon Transcribeクライアントを初期化中...")
-        client = TranscribeStreamingClient(region=os.getenv('AWS_REGION', 'us-east-1'))
+        client = create_transcribe_client()
         logging.info("Amazon Transcribeクライアントの初期化が完了しました")
 
         # ストリーミングセッションの開始
         logging.info("ストリーミングセッションを開始します...")
         # ストリーミングセッションの開始（基本パラメータのみ）
         # Amazon Transcribeの設定をデバッグ出力
-        logging.debug("TranscribeStreamingClient設定:")
-        logging.debug(f"- 言語コード: ja-JP")
-        logging.debug(f"- サンプリングレート: 8000 Hz")
-        logging.debug(f"- エンコーディング: pcm")
-        logging.debug(f"- リージョン: {os.getenv('AWS_REGION', 'us-east-1')}")
+        logging.debug(
+            "TranscribeStreamingClient設定: 言語コード=ja-JP, サンプリングレート=%d Hz, "
+            "エンコーディング=pcm, リージョン=%s", AUDIO_SAMPLE_RATE, os.getenv('AWS_REGION', 'us-east-1')
+        )
         
         # ストリーミングセッションの開始（基本パラメータと安定性設定）
-        stream = await client.start_stream_transcription(
+        # Transcribeの障害中はブレーカーが開き、接続を待たずにエラーを返す
+        stream_open_started = time.perf_counter()
+        stream = await transcribe_breaker.call(lambda: client.start_stream_transcription(
             language_code="ja-JP",
-            media_sample_rate_hz=8000,
+            media_sample_rate_hz=AUDIO_SAMPLE_RATE,
             media_encoding="pcm",
             vocabulary_name=None,  # カスタム語彙は使用しない
             session_id="test-session",  # セッションIDを指定
@@ -197,51 +700,63 @@ async def transcribe_streaming(websocket: WebSocket):
             enable_partial_results_stabilization=True,  # 部分的な結果の安定化を有効化
             partial_results_stability="high",  # 高い安定性を設定
             show_speaker_label=False  # スピーカーラベルは不要
-        )
+        ))
+        metrics.TRANSCRIBE_STREAM_OPEN_DURATION.observe(time.perf_counter() - stream_open_started)
         # AWS認証情報の確認
-        logging.debug("AWS認証情報の確認:")
-        logging.debug(f"- リージョン: {os.getenv('AWS_REGION', 'us-east-1')}")
-        logging.debug(f"- アクセスキーID: {'設定済み' if os.getenv('AWS_ACCESS_KEY_ID') else '未設定'}")
-        logging.debug(f"- シークレットキー: {'設定済み' if os.getenv('AWS_SECRET_ACCESS_KEY') else '未設定'}")
-
-        # ストリーム設定の確認
-        # ストリーム処理のデバッグログを追加
-        logging.debug("ストリーム情報:")
-        logging.debug(f"- 入力ストリーム: {stream.input_stream}")
-        logging.debug(f"- 出力ストリーム: {stream.output_stream}")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(
+                "AWS認証情報の確認: リージョン=%s, アクセスキーID=%s, シークレットキー=%s",
+                os.getenv('AWS_REGION', 'us-east-1'),
+                '設定済み' if os.getenv('AWS_ACCESS_KEY_ID') else '未設定',
+                '設定済み' if os.getenv('AWS_SECRET_ACCESS_KEY') else '未設定',
+            )
+            logging.debug("ストリーム情報: 入力=%s, 出力=%s", stream.input_stream, stream.output_stream)
         logging.info("ストリーミングセッションが開始されました")
 
         # ハンドラーの初期化
-        handler = TranscribeHandler(stream.output_stream, websocket, llm)
+        handler = TranscribeHandler(stream.output_stream, websocket, llm,
+                                    session_id=conversation.session_id,
+                                    client_id=session.client_id,
+                                    router=model_router, intent_matcher=intent_matcher,
+                                    sessions=conversations, stream_session=session)
 
         async def mic_stream():
             """音声データのストリーミング"""
-            while True:
+            ended = False
+            while not ended:
                 try:
-                    chunk = await audio_queue.get()
-                    if stop_audio_stream or not chunk:
+                    item = await audio_queue.get()
+                    if item is None:
                         break
-                    
-                    # チャンクサイズとデータ形式を確認
-                    chunk_size = len(chunk)
-                    logging.debug(f"音声チャンクの処理:")
-                    logging.debug(f"- チャンクサイズ: {chunk_size} バイト")
-                    logging.debug(f"- データタイプ: {type(chunk)}")
-                    
-                    if chunk_size > 0:
-                        # PCMデータとしてチャンクを送信
-                        # Amazon Transcribeは16kHz、16ビット、モノラルPCMを期待
-                        yield chunk, None
-                    else:
-                        logging.warning("空のチャンクをスキップします")
+                    # クライアントは20〜40msの小さなフレームを送るため、溜まっている分は
+                    # まとめて1回で送り、Transcribeへの呼び出し回数を抑える
+                    parts = []
+                    while item is not None:
+                        queued_at, chunk = item
+                        metrics.AUDIO_QUEUE_DEPTH.dec()
+                        session.release_audio(len(chunk))
+                        metrics.AUDIO_QUEUE_LAG.observe(time.perf_counter() - queued_at)
+                        if chunk:
+                            parts.append(chunk)
+                        if sum(map(len, parts)) >= AUDIO_MAX_SEND_BYTES or audio_queue.empty():
+                            break
+                        item = audio_queue.get_nowait()
+                    ended = item is None
+                    if stop_audio_stream:
+                        break
+                    if not parts:
+                        stream_logger.warning("空のチャンクをスキップします")
                         continue
-                        
+
+                    chunk = b"".join(parts)
+                    stream_logger.debug("音声チャンクの処理: %d バイト（%d フレーム）",
+                                        len(chunk), len(parts))
+                    # PCMデータとしてチャンクを送信（AUDIO_SAMPLE_RATE、16ビット、モノラル）
+                    yield chunk, None
+
                 except Exception as e:
-                    logging.error(f"音声ストリーミングエラー: {e}")
+                    logging.error("音声ストリーミングエラー: %s", e)
                     break
-                
-                # チャンク間に小さな遅延を入れる
-                await asyncio.sleep(0.01)
 
         async def write_chunks(stream):
             """音声チャンクの送信"""
@@ -252,48 +767,58 @@ async def transcribe_streaming(websocket: WebSocket):
                 try:
                     chunk_count += 1
                     total_bytes += len(chunk)
-                    logging.info(f"チャンク {chunk_count} を送信中 (合計: {total_bytes} バイト)")
+                    stream_logger.debug("チャンク %d を送信中 (合計: %d バイト)", chunk_count, total_bytes)
                     
                     # 音声データをTranscribeに送信
                     await stream.input_stream.send_audio_event(audio_chunk=chunk)
-                    logging.debug(f"チャンク {chunk_count} の送信完了")
-                    
-                    # ストリームの状態を確認
-                    if hasattr(stream, 'status'):
-                        logging.debug(f"ストリーム状態: {stream.status}")
+                    handler.last_audio_sent_at = time.perf_counter()
+                    handler.timeline.mark("audio_sent")
+                    summary.chunks_sent += 1
+                    summary.bytes_sent += len(chunk)
                     
                 except OSError as e:
-                    logging.error(f"OSError in write_chunks: {e}")
+                    logging.error("OSError in write_chunks: %s", e)
+                    summary.errors += 1
                     break
                 except Exception as e:
-                    logging.error(f"予期せぬエラー in write_chunks: {e}")
+                    logging.error("予期せぬエラー in write_chunks: %s", e)
+                    summary.errors += 1
                     break
-                    
-                # 短い遅延を入れてCPU使用率を抑える
-                await asyncio.sleep(0.01)
             
-            logging.info("すべてのチャンクの送信が完了しました")
+            logging.info("すべてのチャンクの送信が完了しました（%d チャンク, %d バイト）", chunk_count, total_bytes)
             await stream.input_stream.end_stream()
             logging.info("ストリームを終了しました")
 
-        # 非同期タスクの作成と開始
-        send_task = asyncio.create_task(write_chunks(stream))
-        handle_task = asyncio.create_task(handler.handle_events())
+        # 非同期タスクの作成と開始（CPU時間とタスク数をセッションに記録する）
+        send_task = asyncio.create_task(session.track(write_chunks(stream)))
+        handle_task = asyncio.create_task(session.track(handler.handle_events()))
 
         while websocket_open:
             try:
                 # メッセージの受信を待機
                 message = await websocket.receive()
-                logging.info(f"受信メッセージタイプ: {message.get('type')}")
+                stream_logger.debug("受信メッセージタイプ: %s", message.get('type'))
+                summary.messages_received += 1
 
+                if message["type"] == "websocket.disconnect":
+                    websocket_open = False
+                    break
                 if message["type"] == "websocket.receive":
                     if "bytes" in message:
-                        audio_chunk = message["bytes"]
-                        logging.info(f"音声データを受信しました（サイズ: {len(audio_chunk)}バイト）")
-                        await audio_queue.put(audio_chunk)
+                        with session.cpu():
+                            audio_chunk = message["bytes"]
+                            handler.timeline.mark("first_audio")
+                            summary.bytes_received += len(audio_chunk)
+                            stream_logger.debug("音声データを受信しました（サイズ: %dバイト）", len(audio_chunk))
+                            enqueue_audio(audio_chunk)
+                            reason = streaming_sessions.check(session)
+                        if reason is not None:
+                            stop_audio_stream = True
+                            await close_for_limit(reason)
+                            break
                     elif "text" in message:
                         text_message = message["text"]
-                        logging.info(f"テキストメッセージを受信: {text_message}")
+                        logging.info("テキストメッセージを受信: %s", text_message)
                         if text_message == "submit_response":
                             logging.info("音声入力の終了シグナルを受信")
                             stop_audio_stream = True
@@ -306,16 +831,24 @@ async def transcribe_streaming(websocket: WebSocket):
                 break
 
     except Exception as e:
-        logging.error(f"Error in transcribe_streaming: {e}")
+        logging.error("Error in transcribe_streaming: %s", e)
+        summary.errors += 1
         try:
             if websocket_open and websocket.client_state and websocket.client_state.value != 3:  # 3 = DISCONNECTED
                 await websocket.send_text(f"エラーが発生しました: {str(e)}")
         except Exception as ws_error:
-            logging.error(f"Error sending error message: {ws_error}")
+            logging.error("Error sending error message: %s", ws_error)
     finally:
         # クリーンアップ処理
         websocket_open = False
         stop_audio_stream = True
+        if duration_timer is not None:
+            duration_timer.cancel()
+        metrics.ACTIVE_SESSIONS.dec()
+        session_slot.release()
+        if 'handler' in locals():
+            summary.transcripts = handler.utterance_count - 1
+        summary.log()
         
         try:
             await audio_queue.put(None)  # 終了シグナル
@@ -325,12 +858,21 @@ async def transcribe_streaming(websocket: WebSocket):
                 tasks_to_wait = [send_task, handle_task]
                 await asyncio.gather(*tasks_to_wait, return_exceptions=True)
         except Exception as cleanup_error:
-            logging.error(f"Error during task cleanup: {cleanup_error}")
+            logging.error("Error during task cleanup: %s", cleanup_error)
+        finally:
+            # 送信されずに残ったチャンクをキュー滞留数から差し引く
+            while not audio_queue.empty():
+                item = audio_queue.get_nowait()
+                if item is not None:
+                    metrics.AUDIO_QUEUE_DEPTH.dec()
+                    session.release_audio(len(item[1]))
+            streaming_sessions.close(session)
         
-        # WebSocketの状態を確認してから閉じる
+        # WebSocketの状態を確認してから閉じる（上限による終了では閉じ済み）
         try:
-            if websocket.client_state and websocket.client_state.value != 3:  # 3 = DISCONNECTED
+            if session.close_reason is None and websocket.client_state \
+                    and websocket.client_state.value != 3:  # 3 = DISCONNECTED
                 await websocket.close()
         except Exception as ws_error:
-            logging.error(f"Error during WebSocket cleanup: {ws_error}")
+            logging.error("Error during WebSocket cleanup: %s", ws_error)
             pass  # 既に閉じている場合は無視
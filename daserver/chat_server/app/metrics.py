@@ -0,0 +1,378 @@
+"""Prometheusテキスト形式のメトリクス収集
+
+外部サービスや追加ライブラリに依存しない軽量なカウンタ・ゲージ・ヒストグラム。
+本番環境で常時有効にできるよう、記録処理はロック1回と数回の加算のみで行う。
+
+複数のワーカープロセスで動かす場合は、各プロセスが export() したスナップショットを
+状態ストアで共有し、render(peers) で合算して出力する。
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# レイテンシ用のデフォルトバケット（秒）
+DEFAULT_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+LabelValues = Tuple[str, ...]
+# export() の形式: [[ラベル値のリスト, 値], ...]
+Series = List[List[Any]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """ラベル付きメトリクスの基底クラス"""
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name}: ラベルが一致しません（期待値: {self.labelnames}）"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def export(self) -> Series:
+        """他のプロセスと合算するためのスナップショット（JSONに変換できる形式）"""
+        raise NotImplementedError
+
+    def collect(self, peers: Iterable[Series] = ()) -> List[str]:
+        raise NotImplementedError
+
+    def render(self, peers: Iterable[Series] = ()) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self.collect(peers))
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """単調増加するカウンタ"""
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def export(self) -> Series:
+        with self._lock:
+            return [[list(key), v] for key, v in self._values.items()]
+
+    def _merge(self, current: float, value: float) -> float:
+        return current + value
+
+    def collect(self, peers: Iterable[Series] = ()) -> List[str]:
+        with self._lock:
+            merged = dict(self._values)
+        for series in peers:
+            for key, v in series:
+                key = tuple(key)
+                merged[key] = self._merge(merged[key], v) if key in merged else v
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}"
+            for key, v in merged.items()
+        ]
+
+
+class Gauge(Counter):
+    """増減する値
+
+    複数プロセスの値は merge="sum" なら合計、"max" なら最大値にまとめる。
+    """
+    kind = "gauge"
+
+    def __init__(self, *args, merge: str = "sum", **kwargs):
+        super().__init__(*args, **kwargs)
+        if merge not in ("sum", "max"):
+            raise ValueError(f"{self.name}: merge の値が不正です: {merge}")
+        self.merge = merge
+
+    def _merge(self, current: float, value: float) -> float:
+        return current + value if self.merge == "sum" else max(current, value)
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """累積バケット形式のヒストグラム"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベル値 -> (バケットごとの件数, 合計, 件数)
+        self._series: Dict[LabelValues, List] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """with ブロックの所要時間を記録する"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(self._key(labels))
+        return series[2] if series else 0
+
+    def export(self) -> Series:
+        with self._lock:
+            return [[list(k), [list(s[0]), s[1], s[2]]] for k, s in self._series.items()]
+
+    def collect(self, peers: Iterable[Series] = ()) -> List[str]:
+        with self._lock:
+            merged = {k: [list(s[0]), s[1], s[2]] for k, s in self._series.items()}
+        for series in peers:
+            for key, (counts, total, count) in series:
+                current = merged.setdefault(tuple(key), [[0] * (len(self.buckets) + 1), 0.0, 0])
+                current[0] = [a + b for a, b in zip(current[0], counts)]
+                current[1] += total
+                current[2] += count
+        lines = []
+        for key, (counts, total, count) in merged.items():
+            running = 0
+            for upper, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                running += bucket_count
+                le = f'le="{_format_value(upper)}"'
+                labels = _format_labels(self.labelnames, key, le)
+                lines.append(f"{self.name}_bucket{labels} {running}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """メトリクスの登録とテキスト形式での出力"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"メトリクス {metric.name} は登録済みです")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+              merge: str = "sum") -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, merge=merge))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def export(self) -> Dict[str, Any]:
+        """このプロセスの全メトリクスとCPU時間のスナップショット"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            "cpu": time.process_time(),
+            "metrics": {m.name: m.export() for m in metrics},
+        }
+
+    def render(self, peers: Iterable[Dict[str, Any]] = ()) -> str:
+        """Prometheusテキスト形式（version 0.0.4）で出力
+
+        Args:
+            peers: 合算する他のプロセスの export() の結果
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        peers = list(peers)
+        cpu = time.process_time() + sum(peer.get("cpu", 0.0) for peer in peers)
+        process = [
+            "# HELP process_cpu_seconds_total Total user and system CPU time spent in seconds.",
+            "# TYPE process_cpu_seconds_total counter",
+            f"process_cpu_seconds_total {_format_value(cpu)}",
+        ]
+        rendered = [
+            m.render([peer["metrics"][m.name] for peer in peers
+                      if m.name in peer.get("metrics", {})])
+            for m in metrics
+        ]
+        return "\n".join(rendered + process) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTPリクエストの処理時間",
+    ("method", "route", "status"),
+)
+TRANSCRIBE_STREAM_OPEN_DURATION = REGISTRY.histogram(
+    "transcribe_stream_open_seconds", "Transcribeストリームの開始にかかった時間",
+)
+AUDIO_QUEUE_DEPTH = REGISTRY.gauge(
+    "audio_queue_depth", "全セッションの音声キューに滞留しているチャンク数",
+)
+AUDIO_QUEUE_LAG = REGISTRY.histogram(
+    "audio_queue_lag_seconds", "音声チャンクがキューに入ってから送信されるまでの時間",
+)
+TRANSCRIBE_EVENT_LATENCY = REGISTRY.histogram(
+    "transcribe_event_latency_seconds", "最後の音声送信から確定結果を受信するまでの時間",
+)
+LLM_TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    "llm_time_to_first_token_seconds", "LLMの最初のトークンが届くまでの時間", ("path",),
+)
+LLM_REQUEST_DURATION = REGISTRY.histogram(
+    "llm_request_duration_seconds", "LLM呼び出し全体の時間", ("path",),
+)
+MARKDOWN_RENDER_DURATION = REGISTRY.histogram(
+    "markdown_render_seconds", "MarkdownからHTMLへの変換時間",
+)
+WEBSOCKET_SEND_DURATION = REGISTRY.histogram(
+    "websocket_send_seconds", "WebSocketへのメッセージ送信時間",
+)
+ACTIVE_SESSIONS = REGISTRY.gauge(
+    "transcribe_active_sessions", "実行中の音声ストリーミングセッション数",
+)
+EVENT_LOOP_LAG = REGISTRY.histogram(
+    "event_loop_lag_seconds", "イベントループのスケジューリング遅延",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+EVENT_LOOP_BLOCKED = REGISTRY.counter(
+    "event_loop_blocked_total", "しきい値を超えてイベントループがブロックされた回数",
+)
+MARKDOWN_CACHE_REQUESTS = REGISTRY.counter(
+    "markdown_cache_requests_total", "Markdown変換キャッシュの参照回数", ("result",),
+)
+ADMISSION_ACTIVE = REGISTRY.gauge(
+    "admission_active", "受け付け済みで実行中のセッション・LLM呼び出し数", ("kind",),
+)
+ADMISSION_REJECTED = REGISTRY.counter(
+    "admission_rejected_total", "受け付け制御で拒否されたリクエスト数", ("kind", "reason"),
+)
+LLM_GATEWAY_QUEUE_TIME = REGISTRY.histogram(
+    "llm_gateway_queue_seconds", "LLMゲートウェイでの実行待ち時間", ("priority",),
+)
+LLM_GATEWAY_QUEUED = REGISTRY.gauge(
+    "llm_gateway_queued", "LLMゲートウェイで実行を待っているリクエスト数", ("priority",),
+)
+LLM_GATEWAY_DROPPED = REGISTRY.counter(
+    "llm_gateway_dropped_total", "実行前に破棄されたLLMリクエスト数", ("priority", "reason"),
+)
+CIRCUIT_STATE = REGISTRY.gauge(
+    "circuit_breaker_state", "上流ごとのサーキットブレーカーの状態（0=closed, 1=half_open, 2=open）",
+    ("upstream",), merge="max",
+)
+CIRCUIT_REJECTED = REGISTRY.counter(
+    "circuit_breaker_rejected_total", "ブレーカーが開いていたため即座に失敗させた呼び出し数",
+    ("upstream",),
+)
+LLM_HEDGES = REGISTRY.counter(
+    "llm_hedged_requests_total", "発行したヘッジリクエスト数（outcome=won はヘッジ側が先に完了）",
+    ("upstream", "outcome"),
+)
+LLM_ROUTED = REGISTRY.counter(
+    "llm_routed_requests_total", "モデルルーティングで各ティアに振り分けたリクエスト数",
+    ("tier", "reason"),
+)
+LLM_TIER_DURATION = REGISTRY.histogram(
+    "llm_tier_request_duration_seconds", "ティアごとのLLM呼び出し全体の時間", ("tier",),
+)
+LLM_TIER_TOKENS = REGISTRY.counter(
+    "llm_tier_tokens_total", "ティアごとの入出力トークン数", ("tier", "direction"),
+)
+LLM_TIER_COST = REGISTRY.counter(
+    "llm_tier_cost_usd_total", "ティアごとのLLM呼び出しの推定コスト（USD）", ("tier",),
+)
+INTENT_MATCHES = REGISTRY.counter(
+    "intent_matches_total", "LLMを呼ばずにインテントで応答した件数", ("intent", "path"),
+)
+CONVERSATION_SESSIONS = REGISTRY.gauge(
+    "conversation_sessions", "状態ストアに保持している会話セッション数", merge="max",
+)
+CONVERSATION_CONTEXT_TOKENS = REGISTRY.histogram(
+    "conversation_context_tokens", "LLMに送った会話コンテキストの推定トークン数",
+    buckets=(50, 100, 250, 500, 1000, 1500, 2000, 4000, 8000),
+)
+SESSION_EVICTIONS = REGISTRY.counter(
+    "conversation_session_evictions_total", "破棄した会話セッション数", ("reason",),
+)
+SESSION_SUMMARIES = REGISTRY.counter(
+    "conversation_summaries_total", "古い発言の要約の実行回数", ("result",),
+)
+WARMUP_DURATION = REGISTRY.gauge(
+    "warmup_duration_seconds", "起動時のウォームアップにかかった時間", ("component",), merge="max",
+)
+WARMUP_READY = REGISTRY.gauge(
+    "warmup_ready", "ウォームアップが完了して準備完了になったワーカー数",
+)
+AUDIO_DROPPED_BYTES = REGISTRY.counter(
+    "audio_dropped_bytes_total", "音声キューの上限を超えたため捨てた音声のバイト数",
+)
+STREAMING_SESSION_CPU = REGISTRY.histogram(
+    "streaming_session_cpu_seconds", "音声セッションがイベントループ上で使ったCPU時間",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+STREAMING_SESSION_PEAK_AUDIO = REGISTRY.histogram(
+    "streaming_session_audio_buffered_peak_bytes", "音声セッションのキューに溜まった音声の最大バイト数",
+    buckets=(1600, 3200, 8000, 16000, 32000, 80000, 160000),
+)
+STREAMING_SESSION_LIMITED = REGISTRY.counter(
+    "streaming_session_limit_closes_total", "上限を超えたため閉じた音声セッション数", ("reason",),
+)
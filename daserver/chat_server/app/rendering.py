@@ -0,0 +1,134 @@
+"""MarkdownからHTMLへの変換サービス
+
+Markdown インスタンスはスレッドごとに1つ作成して reset() しながら再利用し、
+拡張機能の読み込みを応答ごとに繰り返さないようにする。変換はワーカースレッドで
+実行してイベントループをブロックせず、結果は本文のハッシュをキーに状態ストアへ
+キャッシュする。
+"""
+import asyncio
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Sequence
+
+from markdown import Markdown
+
+from app import metrics
+from app import state_store
+from app.state_store import InProcessStore, StateStore
+
+# ウォームアップで変換する、使用する拡張機能の構文を一通り含んだ文書
+WARMUP_TEXT = "# 見出し\n\n**強調** と `コード`\n\n- 項目\n\n| 列 |\n| --- |\n| 値 |\n"
+
+
+class MarkdownRenderer:
+    """スレッドごとのMarkdownインスタンスとLRUキャッシュを持つレンダラー"""
+
+    def __init__(self, extensions: Sequence[str] = ('extra',),
+                 max_workers: Optional[int] = None, cache_size: Optional[int] = None,
+                 state: Optional[StateStore] = None):
+        """
+        Args:
+            extensions: Markdown拡張機能
+            max_workers: 変換用ワーカースレッド数（MARKDOWN_WORKERS、デフォルト2）
+            cache_size: キャッシュするHTMLの件数（MARKDOWN_CACHE_SIZE、デフォルト512、0で無効）
+            state: キャッシュを保存する状態ストア（未指定時はこのインスタンス専用）
+        """
+        self.extensions = list(extensions)
+        self.max_workers = max_workers or int(os.getenv('MARKDOWN_WORKERS', '2'))
+        self.cache_size = cache_size if cache_size is not None else int(
+            os.getenv('MARKDOWN_CACHE_SIZE', '512'))
+        self._local = threading.local()
+        state = state or InProcessStore()
+        # 共有ストアの読み書きはファイルI/Oになるため、イベントループ上では行わない
+        self._shared = state.shared
+        self._cache = state.namespace("markdown", max_entries=max(self.cache_size, 1))
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(text: str) -> str:
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+    def _markdown(self) -> Markdown:
+        """このスレッド用のMarkdownインスタンス（初回のみ作成）"""
+        md = getattr(self._local, 'md', None)
+        if md is None:
+            md = self._local.md = Markdown(extensions=self.extensions)
+        return md
+
+    def _cached(self, key: str) -> Optional[str]:
+        if self.cache_size <= 0:
+            return None
+        return self._cache.get(key)
+
+    def _store(self, key: str, html: str) -> None:
+        if self.cache_size <= 0:
+            return
+        self._cache.set(key, html)
+
+    def convert(self, text: str) -> str:
+        """キャッシュを使わずに変換する（呼び出し元スレッドで実行）"""
+        with metrics.MARKDOWN_RENDER_DURATION.time():
+            return self._markdown().reset().convert(text)
+
+    def render_sync(self, text: str) -> str:
+        """キャッシュを使って同期的に変換する"""
+        key = self.cache_key(text)
+        html = self._cached(key)
+        if html is not None:
+            metrics.MARKDOWN_CACHE_REQUESTS.inc(result="hit")
+            return html
+        metrics.MARKDOWN_CACHE_REQUESTS.inc(result="miss")
+        html = self.convert(text)
+        self._store(key, html)
+        return html
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='markdown'
+                )
+            return self._executor
+
+    async def render(self, text: str) -> str:
+        """イベントループをブロックせずに変換する
+
+        キャッシュにある場合はスレッドを経由せずにそのまま返す。共有ストアの場合は
+        キャッシュの確認もワーカースレッドで行う。
+        """
+        loop = asyncio.get_running_loop()
+        if self._shared:
+            return await loop.run_in_executor(self._get_executor(), self.render_sync, text)
+        key = self.cache_key(text)
+        html = self._cached(key)
+        if html is not None:
+            metrics.MARKDOWN_CACHE_REQUESTS.inc(result="hit")
+            return html
+        metrics.MARKDOWN_CACHE_REQUESTS.inc(result="miss")
+        html = await loop.run_in_executor(self._get_executor(), self.convert, text)
+        self._store(key, html)
+        return html
+
+    async def warm_up(self) -> None:
+        """拡張機能の読み込みと変換用スレッドの起動を済ませておく（結果はキャッシュしない）"""
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        await asyncio.gather(*(
+            loop.run_in_executor(executor, self.convert, WARMUP_TEXT)
+            for _ in range(self.max_workers)
+        ))
+
+    def clear_cache(self) -> None:
+        self._cache.clear()
+
+    def shutdown(self) -> None:
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+
+renderer = MarkdownRenderer(state=state_store.store)
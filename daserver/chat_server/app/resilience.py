@@ -0,0 +1,243 @@
+"""上流サービス（Bedrock・Transcribe）の遅延・障害対策
+
+- ヘッジリクエスト: 応答が過去のレイテンシのパーセンタイルより遅い場合に
+  2本目のリクエストを発行し、先に完了した方を採用する（発行数は予算で制限）
+- サーキットブレーカー: 連続して失敗した上流への呼び出しを一定時間すぐに失敗させ、
+  タイムアウトまで待たせない
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Optional, Tuple, Type, TypeVar
+
+from app import metrics
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いているため呼び出さなかった"""
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(
+            f"{upstream} が一時的に利用できません。しばらくしてから再試行してください。"
+        )
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_seconds(self) -> int:
+        """Retry-Afterヘッダー用の整数秒（最低1秒）"""
+        return max(1, math.ceil(self.retry_after))
+
+
+class CircuitBreaker:
+    """上流ごとのサーキットブレーカー
+
+    closed: 通常どおり呼び出す。failure_threshold 回連続で失敗すると open へ
+    open: reset_timeout 秒間は呼び出さずに CircuitOpenError を送出する
+    half_open: 試行として1件だけ通し、成功すれば closed、失敗すれば open に戻す
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+    _STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, failure_threshold: Optional[int] = None,
+                 reset_timeout: Optional[float] = None):
+        self.name = name
+        self.failure_threshold = failure_threshold or int(
+            os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+        self.reset_timeout = reset_timeout if reset_timeout is not None else float(
+            os.getenv('CIRCUIT_RESET_TIMEOUT', '30'))
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self._set_state(self.CLOSED)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and self._retry_after() <= 0:
+                return self.HALF_OPEN
+            return self._state
+
+    def _retry_after(self) -> float:
+        return self._opened_at + self.reset_timeout - time.monotonic()
+
+    def _set_state(self, state: str) -> None:
+        self._state = state
+        metrics.CIRCUIT_STATE.set(self._STATE_VALUES[state], upstream=self.name)
+
+    def allow(self) -> None:
+        """呼び出してよいか確認する
+
+        Raises:
+            CircuitOpenError: ブレーカーが開いている場合
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            retry_after = self._retry_after()
+            if self._state == self.OPEN and retry_after <= 0:
+                self._set_state(self.HALF_OPEN)
+            if self._state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+        metrics.CIRCUIT_REJECTED.inc(upstream=self.name)
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._trial_in_flight = False
+            if self._state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def _release_trial(self) -> None:
+        with self._lock:
+            self._trial_in_flight = False
+
+    async def call(self, func: Callable[[], Awaitable[T]],
+                   ignore: Tuple[Type[BaseException], ...] = (),
+                   is_failure: Optional[Callable[[BaseException], bool]] = None) -> T:
+        """ブレーカーを通して非同期関数を呼び出す
+
+        Args:
+            func: 上流を呼び出す非同期関数
+            ignore: 上流の障害として数えない例外（受け付け制御での拒否など）
+            is_failure: 例外が上流の障害かを判定する関数（未指定時は ignore 以外すべて）
+
+        Raises:
+            CircuitOpenError: ブレーカーが開いている場合
+        """
+        self.allow()
+        try:
+            result = await func()
+        except (asyncio.CancelledError,) + tuple(ignore):
+            self._release_trial()
+            raise
+        except Exception as e:
+            if is_failure is None or is_failure(e):
+                self.record_failure()
+            else:
+                # 不正なリクエストなど呼び出し側の問題は障害に数えない
+                self._release_trial()
+            raise
+        self.record_success()
+        return result
+
+
+class LatencyTracker:
+    """直近のレイテンシを保持し、パーセンタイルを求める"""
+
+    def __init__(self, window: int = 500):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Hedger:
+    """パーセンタイルに基づく遅延でヘッジリクエストを発行する
+
+    環境変数:
+        HEDGE_ENABLED: 1で有効（デフォルト1）
+        HEDGE_PERCENTILE: ヘッジまでの待ち時間に使うパーセンタイル（デフォルト0.95）
+        HEDGE_MIN_DELAY: ヘッジまでの最小待ち時間（秒、デフォルト0.5）
+        HEDGE_INITIAL_DELAY: 計測値が少ない間の待ち時間（秒、デフォルト5）
+        HEDGE_BUDGET: リクエストあたりに発行できるヘッジの割合（デフォルト0.1）
+    """
+
+    def __init__(self, name: str, enabled: Optional[bool] = None,
+                 percentile: Optional[float] = None, min_delay: Optional[float] = None,
+                 initial_delay: Optional[float] = None, budget: Optional[float] = None,
+                 min_samples: int = 20, max_tokens: float = 10.0):
+        self.name = name
+        self.enabled = enabled if enabled is not None else os.getenv('HEDGE_ENABLED', '1') == '1'
+        self.percentile = percentile if percentile is not None else float(
+            os.getenv('HEDGE_PERCENTILE', '0.95'))
+        self.min_delay = min_delay if min_delay is not None else float(
+            os.getenv('HEDGE_MIN_DELAY', '0.5'))
+        self.initial_delay = initial_delay if initial_delay is not None else float(
+            os.getenv('HEDGE_INITIAL_DELAY', '5'))
+        self.budget = budget if budget is not None else float(os.getenv('HEDGE_BUDGET', '0.1'))
+        self.min_samples = min_samples
+        self.max_tokens = max_tokens
+        self.latency = LatencyTracker()
+        self._tokens = 0.0
+
+    def delay(self) -> float:
+        """ヘッジを発行するまでの待ち時間"""
+        if len(self.latency) < self.min_samples:
+            return self.initial_delay
+        return max(self.min_delay, self.latency.percentile(self.percentile))
+
+    def _take_budget(self) -> bool:
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return True
+        return False
+
+    async def run(self, func: Callable[[], Awaitable[T]]) -> T:
+        """func を実行し、遅い場合は2本目を発行して先に成功した結果を返す
+
+        負けた方のタスクはキャンセルする（スレッドで実行中の同期呼び出しは
+        完了まで動き続けるが、結果は破棄される）。
+        """
+        if not self.enabled:
+            return await func()
+
+        self._tokens = min(self.max_tokens, self._tokens + self.budget)
+        started = time.perf_counter()
+        primary = asyncio.ensure_future(func())
+        done, _ = await asyncio.wait({primary}, timeout=self.delay())
+        if done or not self._take_budget():
+            result = await primary
+            self.latency.observe(time.perf_counter() - started)
+            return result
+
+        metrics.LLM_HEDGES.inc(upstream=self.name, outcome="issued")
+        hedge = asyncio.ensure_future(func())
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            metrics.LLM_HEDGES.inc(upstream=self.name, outcome="won")
+                        self.latency.observe(time.perf_counter() - started)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+# 上流ごとのブレーカーとLLMのヘッジ設定
+bedrock_breaker = CircuitBreaker("bedrock")
+transcribe_breaker = CircuitBreaker("transcribe")
+llm_hedger = Hedger("bedrock")
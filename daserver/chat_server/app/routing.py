@@ -0,0 +1,253 @@
+"""問い合わせの複雑さによるモデルルーティング
+
+短い・単純な問い合わせは高速で安価なモデル（fast）に、複雑な問い合わせは
+大きいモデル（standard）に振り分ける。判定は次の順に行う。
+
+1. ルール表（ROUTING_RULES_PATH のJSON）で最初に一致したルール
+2. 複雑さを示す特徴（コードブロック、複数行・複数の質問、説明や比較を求める語）
+3. 文字数（ROUTING_SHORT_CHARS 以下なら fast）
+
+ルール表の例:
+    {
+      "short_chars": 40,
+      "tiers": {"fast": {"model_id": "anthropic.claude-3-haiku-20240307-v1:0"}},
+      "rules": [
+        {"tier": "standard", "pattern": "見積|契約"},
+        {"tier": "fast", "path": "voice", "max_chars": 80}
+      ]
+    }
+
+振り分け結果と所要時間・トークン数は ROUTING_LOG_PATH にJSONLで書き出し、
+オフラインでのしきい値やルールの調整に使う。
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app import metrics
+from app.timeline import JsonlRecorder
+
+
+class ModelTier:
+    """ルーティング先のモデルと料金（1000トークンあたりのUSD）"""
+    __slots__ = ("name", "model_id", "temperature", "max_tokens", "input_cost", "output_cost")
+
+    def __init__(self, name: str, model_id: str, temperature: float = 0.7,
+                 max_tokens: Optional[int] = None, input_cost: float = 0.0,
+                 output_cost: float = 0.0):
+        self.name = name
+        self.model_id = model_id
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.input_cost = input_cost
+        self.output_cost = output_cost
+
+    def cost(self, input_tokens: int, output_tokens: int) -> float:
+        return (input_tokens * self.input_cost + output_tokens * self.output_cost) / 1000.0
+
+
+FAST, STANDARD = "fast", "standard"
+
+DEFAULT_TIERS = {
+    FAST: ModelTier(FAST, "anthropic.claude-3-haiku-20240307-v1:0",
+                    temperature=0.5, max_tokens=512,
+                    input_cost=0.00025, output_cost=0.00125),
+    STANDARD: ModelTier(STANDARD, "anthropic.claude-3-sonnet-20240229-v1:0",
+                        temperature=0.7, input_cost=0.003, output_cost=0.015),
+}
+
+# 複雑な問い合わせとみなす語（説明・比較・生成などを求めるもの）
+COMPLEX_KEYWORDS = (
+    "説明", "比較", "理由", "なぜ", "どうして", "手順", "方法", "違い", "要約",
+    "分析", "設計", "コード", "プログラム", "書いて", "翻訳", "詳しく",
+)
+_COMPLEX_PATTERN = re.compile("|".join(map(re.escape, COMPLEX_KEYWORDS)))
+_QUESTION_MARKS = re.compile(r"[?？]")
+
+
+class RoutingRule:
+    """ルール表の1行（指定した条件をすべて満たすと tier に振り分ける）"""
+    __slots__ = ("tier", "pattern", "min_chars", "max_chars", "path")
+
+    def __init__(self, tier: str, pattern: Optional[str] = None,
+                 min_chars: Optional[int] = None, max_chars: Optional[int] = None,
+                 path: Optional[str] = None):
+        self.tier = tier
+        self.pattern = re.compile(pattern) if pattern else None
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.path = path
+
+    def matches(self, text: str, path: str) -> bool:
+        if self.path is not None and self.path != path:
+            return False
+        if self.min_chars is not None and len(text) < self.min_chars:
+            return False
+        if self.max_chars is not None and len(text) > self.max_chars:
+            return False
+        if self.pattern is not None and not self.pattern.search(text):
+            return False
+        return True
+
+
+class RoutingDecision:
+    """1件の振り分け結果"""
+    __slots__ = ("tier", "reason", "path", "chars", "prompt_hash")
+
+    def __init__(self, tier: str, reason: str, path: str, text: str):
+        self.tier = tier
+        self.reason = reason
+        self.path = path
+        self.chars = len(text)
+        self.prompt_hash = hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def load_rules(path: str) -> dict:
+    """ルール表のJSONを読み込む"""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def usage_of(ai_msg, messages, text: str) -> Tuple[int, int]:
+    """応答から入出力トークン数を取り出す
+
+    LangChainの usage_metadata、Bedrockの response_metadata["usage"] の順に参照し、
+    どちらもない場合は文字数で概算する（日本語はおおむね1文字1トークン）。
+    """
+    usage = getattr(ai_msg, "usage_metadata", None)
+    if isinstance(usage, dict) and "input_tokens" in usage:
+        return int(usage["input_tokens"]), int(usage.get("output_tokens", 0))
+    response_metadata = getattr(ai_msg, "response_metadata", None)
+    if isinstance(response_metadata, dict):
+        usage = response_metadata.get("usage")
+        if isinstance(usage, dict) and "prompt_tokens" in usage:
+            return int(usage["prompt_tokens"]), int(usage.get("completion_tokens", 0))
+    prompt_chars = sum(len(str(content)) for _, content in messages)
+    return prompt_chars, len(text)
+
+
+class ModelRouter:
+    """問い合わせをモデルのティアに振り分け、ティアごとのLLMクライアントを管理する
+
+    環境変数:
+        ROUTING_ENABLED: 1で有効（デフォルト1）。0の場合はすべて standard
+        ROUTING_SHORT_CHARS: fast に振り分ける最大文字数（デフォルト60）
+        ROUTING_RULES_PATH: ルール表のJSONファイル
+        ROUTING_LOG_PATH: 振り分け結果を書き出すJSONLファイル
+    """
+
+    def __init__(self, llm_factory: Optional[Callable[[ModelTier], object]] = None,
+                 tiers: Optional[Dict[str, ModelTier]] = None,
+                 rules: Optional[List[RoutingRule]] = None,
+                 short_chars: Optional[int] = None, enabled: Optional[bool] = None,
+                 default_tier: str = STANDARD, log_path: Optional[str] = None):
+        """
+        Args:
+            llm_factory: ティアからLLMクライアントを作成する関数
+            tiers: ティア名とモデルの対応（未指定時は DEFAULT_TIERS）
+            rules: ヒューリスティックより先に評価するルール
+            short_chars: fast に振り分ける最大文字数
+            enabled: ルーティングを有効にするか
+            default_tier: 呼び出し元のLLMクライアントをそのまま使うティア
+            log_path: 振り分け結果のJSONLファイル
+        """
+        self.llm_factory = llm_factory
+        self.tiers = dict(tiers or DEFAULT_TIERS)
+        self.rules = list(rules or [])
+        self.short_chars = short_chars if short_chars is not None else int(
+            os.getenv('ROUTING_SHORT_CHARS', '60'))
+        self.enabled = enabled if enabled is not None else os.getenv('ROUTING_ENABLED', '1') == '1'
+        self.default_tier = default_tier
+        self.decision_log = JsonlRecorder(
+            log_path if log_path is not None else os.getenv('ROUTING_LOG_PATH') or None)
+        self._clients: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, llm_factory: Optional[Callable[[ModelTier], object]] = None) -> "ModelRouter":
+        """環境変数とルール表から作成する"""
+        path = os.getenv('ROUTING_RULES_PATH')
+        if not path:
+            return cls(llm_factory)
+        config = load_rules(path)
+        tiers = {name: ModelTier(tier.name, tier.model_id, tier.temperature, tier.max_tokens,
+                                 tier.input_cost, tier.output_cost)
+                 for name, tier in DEFAULT_TIERS.items()}
+        for name, overrides in config.get("tiers", {}).items():
+            tier = tiers.setdefault(name, ModelTier(name, overrides.get("model_id", "")))
+            for key, value in overrides.items():
+                if key in ModelTier.__slots__ and key != "name":
+                    setattr(tier, key, value)
+        rules = [RoutingRule(**rule) for rule in config.get("rules", [])]
+        return cls(llm_factory, tiers=tiers, rules=rules, short_chars=config.get("short_chars"))
+
+    def classify(self, text: str, path: str = "chat") -> Tuple[str, str]:
+        """ティア名と振り分けの理由を返す"""
+        text = text.strip()
+        for index, rule in enumerate(self.rules):
+            if rule.tier in self.tiers and rule.matches(text, path):
+                return rule.tier, f"rule:{index}"
+        if "```" in text or text.count("\n") >= 2:
+            return STANDARD, "structure"
+        if len(_QUESTION_MARKS.findall(text)) >= 2:
+            return STANDARD, "multi_question"
+        if _COMPLEX_PATTERN.search(text):
+            return STANDARD, "keyword"
+        if len(text) <= self.short_chars:
+            return FAST, "short"
+        return STANDARD, "long"
+
+    def route(self, text: str, path: str = "chat") -> RoutingDecision:
+        """問い合わせを振り分け、件数を記録する"""
+        if self.enabled:
+            tier, reason = self.classify(text, path)
+        else:
+            tier, reason = self.default_tier, "disabled"
+        metrics.LLM_ROUTED.inc(tier=tier, reason=reason)
+        return RoutingDecision(tier, reason, path, text)
+
+    def llm_for(self, tier: str, default_llm):
+        """ティアのLLMクライアント（default_tier は呼び出し元のクライアントを使う）"""
+        if tier == self.default_tier or self.llm_factory is None or tier not in self.tiers:
+            return default_llm
+        with self._lock:
+            client = self._clients.get(tier)
+            if client is None:
+                client = self._clients[tier] = self.llm_factory(self.tiers[tier])
+        return client
+
+    def select(self, text: str, path: str, default_llm):
+        """振り分け結果とそのティアのLLMクライアントを返す"""
+        decision = self.route(text, path)
+        return decision, self.llm_for(decision.tier, default_llm)
+
+    def record(self, decision: RoutingDecision, elapsed: float, messages, ai_msg) -> None:
+        """ティアごとの所要時間・トークン数・コストを記録し、振り分けログに書き出す"""
+        text = str(getattr(ai_msg, "content", ai_msg))
+        input_tokens, output_tokens = usage_of(ai_msg, messages, text)
+        tier = self.tiers.get(decision.tier)
+        cost = tier.cost(input_tokens, output_tokens) if tier else 0.0
+        metrics.LLM_TIER_DURATION.observe(elapsed, tier=decision.tier)
+        metrics.LLM_TIER_TOKENS.inc(input_tokens, tier=decision.tier, direction="input")
+        metrics.LLM_TIER_TOKENS.inc(output_tokens, tier=decision.tier, direction="output")
+        metrics.LLM_TIER_COST.inc(cost, tier=decision.tier)
+        logging.debug("モデルルーティング: %s -> %s (%s, %.0f ms)",
+                      decision.path, decision.tier, decision.reason, elapsed * 1000.0)
+        self.decision_log.write({
+            "timestamp": time.time(),
+            "path": decision.path,
+            "tier": decision.tier,
+            "model": tier.model_id if tier else "",
+            "reason": decision.reason,
+            "chars": decision.chars,
+            "prompt_hash": decision.prompt_hash,
+            "latency_ms": round(elapsed * 1000.0, 1),
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cost_usd": round(cost, 6),
+        })
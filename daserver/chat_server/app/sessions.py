@@ -0,0 +1,266 @@
+"""会話セッションとトークン予算付きのコンテキストウィンドウ
+
+セッションごとに直近の会話をメモリに保持し、LLMへのリクエストには
+トークン予算（SESSION_TOKEN_BUDGET）に収まる範囲の新しい発言だけを含める。
+予算からあふれた古い発言は、要約関数が設定されている場合はバックグラウンドで
+要約してシステムプロンプトに添える。会話がどれだけ長くなっても、
+1リクエストあたりのプロンプトの大きさと待ち時間はほぼ一定に保たれる。
+
+しばらく使われていないセッションはLRU順に破棄する。セッションは状態ストアに
+保存するため、共有ストアを使えば複数のワーカーで同じ会話を続けられる。
+"""
+import asyncio
+import logging
+import math
+import os
+import threading
+import uuid
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from app import metrics
+from app.state_store import InProcessStore, StateStore
+
+Message = Tuple[str, str]
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算（日本語などは1文字1トークン、ASCIIは4文字1トークン）"""
+    ascii_chars = sum(1 for ch in text if ch < "\x80")
+    return (len(text) - ascii_chars) + math.ceil(ascii_chars / 4)
+
+
+class Turn:
+    """会話の1発言"""
+    __slots__ = ("index", "role", "content", "tokens")
+
+    def __init__(self, index: int, role: str, content: str):
+        self.index = index
+        self.role = role
+        self.content = content
+        self.tokens = estimate_tokens(content)
+
+
+class Conversation:
+    """1セッション分の会話（直近の発言と、それ以前の要約）"""
+    __slots__ = ("session_id", "turns", "summary", "summary_tokens", "next_index")
+
+    def __init__(self, session_id: str, max_turns: int):
+        self.session_id = session_id
+        self.turns: Deque[Turn] = deque(maxlen=max_turns)
+        self.summary = ""
+        self.summary_tokens = 0
+        self.next_index = 0
+
+    def add(self, role: str, content: str) -> None:
+        self.turns.append(Turn(self.next_index, role, content))
+        self.next_index += 1
+
+    @property
+    def tokens(self) -> int:
+        return sum(turn.tokens for turn in self.turns)
+
+    def set_summary(self, summary: str, upto_index: int) -> None:
+        """要約を設定し、要約済みの発言を取り除く"""
+        self.summary = summary
+        self.summary_tokens = estimate_tokens(summary)
+        while self.turns and self.turns[0].index <= upto_index:
+            self.turns.popleft()
+
+    def load(self, state: Optional[Dict[str, Any]]) -> "Conversation":
+        """状態ストアに保存した内容を読み込む"""
+        self.turns.clear()
+        self.summary, self.summary_tokens, self.next_index = "", 0, 0
+        if state:
+            self.turns.extend(Turn(index, role, content)
+                              for index, role, content in state["turns"])
+            self.summary = state["summary"]
+            self.summary_tokens = estimate_tokens(self.summary)
+            self.next_index = state["next_index"]
+        return self
+
+    def dump(self) -> Dict[str, Any]:
+        """状態ストアに保存する形式に変換する"""
+        return {
+            "turns": [[turn.index, turn.role, turn.content] for turn in self.turns],
+            "summary": self.summary,
+            "next_index": self.next_index,
+        }
+
+
+Summarizer = Callable[[str, List[Turn]], Awaitable[str]]
+
+
+class SessionStore:
+    """会話セッションのLRUストア
+
+    環境変数:
+        SESSION_MAX: 保持するセッション数の上限（デフォルト10000）
+        SESSION_IDLE_TIMEOUT: この秒数使われていないセッションを破棄する（デフォルト1800）
+        SESSION_TOKEN_BUDGET: 1リクエストのプロンプトのトークン予算（デフォルト1500）
+        SESSION_MAX_TURNS: セッションごとに保持する発言数の上限（デフォルト50）
+    """
+
+    def __init__(self, max_sessions: Optional[int] = None,
+                 idle_timeout: Optional[float] = None,
+                 token_budget: Optional[int] = None,
+                 max_turns: Optional[int] = None,
+                 summarizer: Optional[Summarizer] = None,
+                 state: Optional[StateStore] = None):
+        """
+        Args:
+            max_sessions: 保持するセッション数の上限
+            idle_timeout: 破棄するまでの未使用時間（秒）
+            token_budget: 1リクエストのプロンプトのトークン予算
+            max_turns: セッションごとに保持する発言数の上限
+            summarizer: 古い発言を要約する非同期関数（未指定時は要約せずに切り捨てる）
+            state: セッションを保存する状態ストア（未指定時はこのインスタンス専用）
+        """
+        self.max_sessions = max_sessions or int(os.getenv('SESSION_MAX', '10000'))
+        self.idle_timeout = idle_timeout if idle_timeout is not None else float(
+            os.getenv('SESSION_IDLE_TIMEOUT', '1800'))
+        self.token_budget = token_budget or int(os.getenv('SESSION_TOKEN_BUDGET', '1500'))
+        self.max_turns = max_turns or int(os.getenv('SESSION_MAX_TURNS', '50'))
+        self.summarizer = summarizer
+        state = state or InProcessStore()
+        # 共有ストアはファイルI/Oになるため、要約の書き込みはスレッドで行う
+        self._shared = state.shared
+        self._sessions = state.namespace(
+            "sessions", max_entries=self.max_sessions, ttl=self.idle_timeout,
+            on_evict=self._evicted)
+        # このプロセスで要約中のセッション
+        self._summarizing: Set[str] = set()
+        self._summarizing_lock = threading.Lock()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    @staticmethod
+    def _evicted(reason: str, count: int) -> None:
+        metrics.SESSION_EVICTIONS.inc(count, reason=reason)
+
+    def get(self, session_id: Optional[str] = None) -> Conversation:
+        """セッションを取得する（存在しない場合は作成する）"""
+        if not session_id or len(session_id) > 64:
+            session_id = uuid.uuid4().hex
+        conversation = Conversation(session_id, self.max_turns)
+        state = self._sessions.get(session_id)
+        if state is None:
+            self._sessions.set(session_id, conversation.dump())
+            metrics.CONVERSATION_SESSIONS.set(len(self._sessions))
+        return conversation.load(state)
+
+    def discard(self, session_id: str) -> None:
+        self._sessions.delete(session_id)
+        metrics.CONVERSATION_SESSIONS.set(len(self._sessions))
+
+    def build_messages(self, conversation: Conversation, system_prompt: str,
+                       text: str) -> List[Message]:
+        """トークン予算に収まる直近の発言と、古い発言の要約でメッセージを組み立てる"""
+        if conversation.summary:
+            system_prompt = f"{system_prompt}\n\nこれまでの会話の要約:\n{conversation.summary}"
+        remaining = self.token_budget - estimate_tokens(system_prompt) - estimate_tokens(text)
+        history: List[Message] = []
+        for turn in reversed(conversation.turns):
+            if turn.tokens > remaining:
+                break
+            remaining -= turn.tokens
+            history.append((turn.role, turn.content))
+        history.reverse()
+        messages = [("system", system_prompt)] + history + [("human", text)]
+        metrics.CONVERSATION_CONTEXT_TOKENS.observe(self.token_budget - remaining)
+        return messages
+
+    def record(self, conversation: Conversation, text: str, reply: str,
+               loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        """発言と応答を記録し、予算を超えた古い発言の要約を予約する
+
+        他のワーカーが同じセッションに書き込んでいる場合もあるため、
+        ストアの最新の内容に追記して conversation をその結果で更新する。
+
+        Args:
+            loop: 要約のタスクを作成するイベントループ（共有ストアのために
+                ワーカースレッドから呼び出す場合に指定する）
+        """
+        def append(state):
+            current = Conversation(conversation.session_id, self.max_turns).load(state)
+            current.add("human", text)
+            current.add("ai", reply)
+            return current.dump()
+
+        conversation.load(self._sessions.update(conversation.session_id, append))
+        if self.summarizer is not None and conversation.tokens > self.token_budget:
+            self._schedule_summary(conversation, loop)
+
+    def _schedule_summary(self, conversation: Conversation,
+                          loop: Optional[asyncio.AbstractEventLoop]) -> None:
+        # 直近の発言が予算の半分に収まるよう、それより古い発言を要約の対象にする
+        turns = list(conversation.turns)
+        keep, kept_tokens, split = self.token_budget // 2, 0, len(turns)
+        for i in range(len(turns) - 1, -1, -1):
+            if kept_tokens + turns[i].tokens > keep:
+                break
+            kept_tokens += turns[i].tokens
+            split = i
+        turns = turns[:split]
+        if not turns:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is None and loop is None:
+            return
+        with self._summarizing_lock:
+            if conversation.session_id in self._summarizing:
+                return
+            self._summarizing.add(conversation.session_id)
+        if running is not None:
+            self._start_summary(conversation, turns)
+        else:
+            loop.call_soon_threadsafe(self._start_summary, conversation, turns)
+
+    def _start_summary(self, conversation: Conversation, turns: List[Turn]) -> None:
+        task = asyncio.get_running_loop().create_task(self._summarize(conversation, turns))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _summarize(self, conversation: Conversation, turns: List[Turn]) -> None:
+        session_id = conversation.session_id
+        try:
+            summary = await self.summarizer(conversation.summary, turns)
+            # 要約が予算を使い切らないよう、予算の3分の1の文字数に収める
+            summary = summary.strip()[: self.token_budget // 3]
+
+            def apply(state):
+                # 要約中に破棄されたセッションは作り直さない
+                if state is None:
+                    return None
+                current = Conversation(session_id, self.max_turns).load(state)
+                current.set_summary(summary, turns[-1].index)
+                return current.dump()
+
+            if self._shared:
+                await asyncio.to_thread(self._sessions.update, session_id, apply)
+            else:
+                self._sessions.update(session_id, apply)
+            metrics.SESSION_SUMMARIES.inc(result="ok")
+        except Exception as e:
+            # 要約できなかった場合も、古い発言は予算の計算で自然に除外される
+            logging.warning("会話の要約に失敗しました: %s", e)
+            metrics.SESSION_SUMMARIES.inc(result="error")
+        finally:
+            with self._summarizing_lock:
+                self._summarizing.discard(session_id)
+
+    async def wait_for_summaries(self) -> None:
+        """実行中の要約の完了を待つ"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def format_turns(turns: List[Turn]) -> str:
+    """要約用に発言を「ユーザー: …」「アシスタント: …」の形式に整形する"""
+    names = {"human": "ユーザー", "ai": "アシスタント"}
+    return "\n".join(f"{names.get(t.role, t.role)}: {t.content}" for t in turns)
@@ -0,0 +1,398 @@
+"""キャッシュ・セッション・レート制限・メトリクスの状態ストア
+
+状態は名前空間（Namespace）ごとのキーと値として保存する。実装は2種類ある。
+
+- InProcessStore: プロセス内の辞書（デフォルト）。uvicornのワーカーが1つの場合に使う
+- SQLiteStore: WALモードのローカルSQLiteファイル。同じマシン上の複数のワーカー・
+  プロセスで状態を共有する
+
+値はJSONに変換できるもの（文字列・数値・リスト・辞書）に限る。プロセス内ストアは
+値をそのまま保持するため、取得した値を変更せず、必ず set() / update() で書き戻すこと。
+
+環境変数:
+    STATE_STORE: memory または sqlite（デフォルト memory）
+    STATE_STORE_PATH: SQLiteファイルのパス（デフォルト /tmp/chat_server_state.db）
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# 破棄時のコールバック（理由, 件数）
+EvictCallback = Callable[[str, int], None]
+
+# SQLiteの読み込みで最終利用時刻をすぐに書き込むのは、前回から ttl のこの割合が過ぎた場合のみ
+TOUCH_FRACTION = 0.5
+# 次の書き込みまで溜めておく読み込み時刻の上限（超えたらまとめて書き込む）
+MAX_PENDING_TOUCHES = 1024
+
+
+class Namespace:
+    """状態ストアの名前空間
+
+    max_entries を超えると最も古いものから、ttl（秒）のあいだ読み書きされなかった
+    ものは期限切れとして破棄する。
+    """
+
+    def __init__(self, name: str, max_entries: Optional[int] = None,
+                 ttl: Optional[float] = None, on_evict: Optional[EvictCallback] = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.on_evict = on_evict
+
+    def _evicted(self, reason: str, count: int) -> None:
+        if count and self.on_evict is not None:
+            self.on_evict(reason, count)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def update(self, key: str, fn: Callable[[Any], Any]) -> Any:
+        """現在の値（ない場合は None）に fn を適用して書き戻す（アトミック）
+
+        fn が None を返した場合はキーを削除する。
+        """
+        raise NotImplementedError
+
+    def items(self) -> List[Tuple[str, Any]]:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        return len(self.items())
+
+    def __iter__(self) -> Iterator[str]:
+        return iter([key for key, _ in self.items()])
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+
+class InProcessNamespace(Namespace):
+    """プロセス内のLRU辞書による名前空間"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # キー -> (値, 期限)。先頭ほど長く使われていない
+        self._data: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _expires_at(self, now: float) -> float:
+        return now + self.ttl if self.ttl is not None else float("inf")
+
+    def _purge(self, now: float) -> None:
+        expired = 0
+        while self._data:
+            _, expires_at = next(iter(self._data.values()))
+            if expires_at >= now:
+                break
+            self._data.popitem(last=False)
+            expired += 1
+        self._evicted("idle", expired)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            self._data[key] = (entry[0], self._expires_at(now))
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            self._data[key] = (value, self._expires_at(now))
+            self._data.move_to_end(key)
+            evicted = 0
+            while self.max_entries is not None and len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                evicted += 1
+            self._evicted("capacity", evicted)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def update(self, key: str, fn: Callable[[Any], Any]) -> Any:
+        with self._lock:
+            value = fn(self.get(key))
+            if value is None:
+                self.delete(key)
+            else:
+                self.set(key, value)
+            return value
+
+    def items(self) -> List[Tuple[str, Any]]:
+        with self._lock:
+            self._purge(time.monotonic())
+            return [(key, entry[0]) for key, entry in self._data.items()]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._purge(time.monotonic())
+            return len(self._data)
+
+
+class SQLiteNamespace(Namespace):
+    """SQLiteのテーブルによる名前空間
+
+    古いものから破棄する順序は最後に読み書きした時刻で判定する。読み込みは
+    書き込みロックを取らない SELECT だけで行い、読み込んだ時刻は溜めておいて
+    次の書き込みトランザクションでまとめて反映する。ただし前回の利用から
+    ttl × TOUCH_FRACTION が過ぎた値は、期限切れにならないようその場で延長する。
+    件数の確認は書き込みのたびではなく数回に1回まとめて行う。
+    """
+
+    def __init__(self, store: "SQLiteStore", *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._store = store
+        self._writes = 0
+        self._evict_every = max(1, min(64, (self.max_entries or 64) // 8))
+        # 反映していない読み込み時刻（キー → 時刻）
+        self._touches: Dict[str, float] = {}
+        self._touches_lock = threading.Lock()
+
+    def _expires_at(self, now: float) -> Optional[float]:
+        return now + self.ttl if self.ttl is not None else None
+
+    def _select(self, conn: sqlite3.Connection, key: str, now: float) -> Any:
+        row = conn.execute(
+            "SELECT value, expires_at FROM state WHERE namespace = ? AND key = ?",
+            (self.name, key),
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] < now:
+            conn.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (self.name, key))
+            self._evicted("idle", 1)
+            return None
+        return json.loads(row[0])
+
+    def _apply_touches(self, conn: sqlite3.Connection) -> None:
+        """溜めておいた読み込み時刻を書き込みトランザクションの中で反映する"""
+        with self._touches_lock:
+            touches, self._touches = self._touches, {}
+        if touches:
+            # 他のワーカーがより新しい時刻を書いていれば戻さない
+            conn.executemany(
+                "UPDATE state SET touched_at = MAX(touched_at, ?), expires_at = MAX(expires_at, ?)"
+                " WHERE namespace = ? AND key = ?",
+                [(at, self._expires_at(at), self.name, key) for key, at in touches.items()],
+            )
+
+    def _write(self, conn: sqlite3.Connection, key: str, value: Any, now: float) -> None:
+        self._apply_touches(conn)
+        conn.execute(
+            "INSERT OR REPLACE INTO state (namespace, key, value, expires_at, touched_at)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (self.name, key, json.dumps(value, ensure_ascii=False), self._expires_at(now), now),
+        )
+        self._writes += 1
+        if self._writes % self._evict_every == 0:
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        expired = conn.execute(
+            "DELETE FROM state WHERE namespace = ? AND expires_at < ?", (self.name, now),
+        ).rowcount
+        self._evicted("idle", expired)
+        if self.max_entries is None:
+            return
+        count = conn.execute(
+            "SELECT COUNT(*) FROM state WHERE namespace = ?", (self.name,),
+        ).fetchone()[0]
+        if count > self.max_entries:
+            removed = conn.execute(
+                "DELETE FROM state WHERE namespace = ? AND key IN ("
+                " SELECT key FROM state WHERE namespace = ? ORDER BY touched_at LIMIT ?)",
+                (self.name, self.name, count - self.max_entries),
+            ).rowcount
+            self._evicted("capacity", removed)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        now = time.time()
+        row = self._store.connection().execute(
+            "SELECT value, expires_at, touched_at FROM state WHERE namespace = ? AND key = ?",
+            (self.name, key),
+        ).fetchone()
+        # 期限切れの行は次の書き込みでまとめて削除する
+        if row is None or (row[1] is not None and row[1] < now):
+            return default
+        with self._touches_lock:
+            self._touches[key] = now
+            flush = len(self._touches) >= MAX_PENDING_TOUCHES or (
+                self.ttl is not None and now - row[2] > self.ttl * TOUCH_FRACTION)
+        if flush:
+            with self._store.transaction() as conn:
+                self._apply_touches(conn)
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        with self._store.transaction() as conn:
+            self._write(conn, key, value, time.time())
+
+    def delete(self, key: str) -> None:
+        with self._store.transaction() as conn:
+            conn.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (self.name, key))
+
+    def update(self, key: str, fn: Callable[[Any], Any]) -> Any:
+        now = time.time()
+        with self._store.transaction() as conn:
+            value = fn(self._select(conn, key, now))
+            if value is None:
+                conn.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (self.name, key))
+            else:
+                self._write(conn, key, value, now)
+        return value
+
+    def items(self) -> List[Tuple[str, Any]]:
+        rows = self._store.connection().execute(
+            "SELECT key, value FROM state WHERE namespace = ?"
+            " AND (expires_at IS NULL OR expires_at >= ?) ORDER BY touched_at",
+            (self.name, time.time()),
+        ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def clear(self) -> None:
+        with self._store.transaction() as conn:
+            conn.execute("DELETE FROM state WHERE namespace = ?", (self.name,))
+
+    def __len__(self) -> int:
+        return self._store.connection().execute(
+            "SELECT COUNT(*) FROM state WHERE namespace = ?"
+            " AND (expires_at IS NULL OR expires_at >= ?)",
+            (self.name, time.time()),
+        ).fetchone()[0]
+
+
+class StateStore:
+    """状態ストアの基底クラス"""
+    # 複数のプロセスで状態を共有するか
+    shared = False
+
+    def namespace(self, name: str, max_entries: Optional[int] = None,
+                  ttl: Optional[float] = None,
+                  on_evict: Optional[EvictCallback] = None) -> Namespace:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class InProcessStore(StateStore):
+    """プロセス内の状態ストア（同じ名前の名前空間は同じデータを指す）"""
+
+    def __init__(self):
+        self._namespaces: Dict[str, InProcessNamespace] = {}
+        self._lock = threading.Lock()
+
+    def namespace(self, name: str, max_entries: Optional[int] = None,
+                  ttl: Optional[float] = None,
+                  on_evict: Optional[EvictCallback] = None) -> Namespace:
+        with self._lock:
+            ns = self._namespaces.get(name)
+            if ns is None:
+                ns = self._namespaces[name] = InProcessNamespace(name, max_entries, ttl, on_evict)
+            return ns
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE で書き込みロックを取得するトランザクション"""
+    __slots__ = ("_conn",)
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self._conn
+
+    def __exit__(self, exc_type, *exc) -> None:
+        self._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+class SQLiteStore(StateStore):
+    """WALモードのSQLiteファイルによる状態ストア
+
+    同じファイルを開いたすべてのプロセス・スレッドで状態を共有する。
+    接続はスレッドごとに作成する。
+    """
+    shared = True
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self.connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " expires_at REAL, touched_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS state_touched ON state (namespace, touched_at)"
+        )
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def transaction(self) -> _Transaction:
+        return _Transaction(self.connection())
+
+    def namespace(self, name: str, max_entries: Optional[int] = None,
+                  ttl: Optional[float] = None,
+                  on_evict: Optional[EvictCallback] = None) -> Namespace:
+        return SQLiteNamespace(self, name, max_entries, ttl, on_evict)
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def create_store(kind: Optional[str] = None, path: Optional[str] = None) -> StateStore:
+    """環境変数の設定に従って状態ストアを作成する"""
+    kind = kind or os.getenv('STATE_STORE', 'memory')
+    if kind == 'sqlite':
+        path = path or os.getenv('STATE_STORE_PATH', '/tmp/chat_server_state.db')
+        logging.info("SQLiteの状態ストアを使用します: %s", path)
+        return SQLiteStore(path)
+    if kind != 'memory':
+        raise ValueError(f"STATE_STORE の値が不正です: {kind}")
+    return InProcessStore()
+
+
+store = create_store()
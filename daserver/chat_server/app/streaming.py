@@ -0,0 +1,223 @@
+"""音声ストリーミングセッションごとの資源使用量と上限
+
+/TranscribeStreaming の接続ごとに、送受信したバイト数、キューに溜まっている音声、
+認識テキストの大きさ、実行中のタスク数、イベントループ上で費やしたCPU時間を
+固定の数値フィールドだけで記録する。推定メモリ使用量と接続時間が上限を超えた
+セッションは、エンドポイントが理由を付けて閉じる。
+"""
+import collections.abc
+import os
+import time
+from typing import Coroutine, Dict, Optional
+
+from app import metrics
+
+# 上限を超えたセッションを閉じる際のクローズコード（1008 = Policy Violation）
+WS_CLOSE_POLICY_VIOLATION = 1008
+MEMORY_LIMIT = "memory_limit"
+DURATION_LIMIT = "duration_limit"
+
+
+class StreamingSession:
+    """1つの音声ストリーミング接続の資源使用量"""
+    __slots__ = (
+        "session_id", "client_id", "started_at", "_started", "bytes_in", "bytes_out",
+        "frames_in", "audio_buffered", "audio_buffered_peak", "audio_dropped",
+        "transcript_bytes", "tasks", "cpu_seconds", "close_reason",
+    )
+
+    def __init__(self, session_id: str, client_id: str):
+        self.session_id = session_id
+        self.client_id = client_id
+        self.started_at = time.time()
+        self._started = time.monotonic()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.frames_in = 0
+        # 受信してまだTranscribeに送っていない音声
+        self.audio_buffered = 0
+        self.audio_buffered_peak = 0
+        # キューの上限を超えたため捨てた音声
+        self.audio_dropped = 0
+        self.transcript_bytes = 0
+        self.tasks = 0
+        self.cpu_seconds = 0.0
+        self.close_reason: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return time.monotonic() - self._started
+
+    @property
+    def memory_bytes(self) -> int:
+        """セッションが保持しているデータの推定サイズ"""
+        return self.audio_buffered + self.transcript_bytes
+
+    def buffer_audio(self, size: int) -> None:
+        self.bytes_in += size
+        self.frames_in += 1
+        self.audio_buffered += size
+        if self.audio_buffered > self.audio_buffered_peak:
+            self.audio_buffered_peak = self.audio_buffered
+
+    def release_audio(self, size: int, dropped: bool = False) -> None:
+        self.audio_buffered -= size
+        if dropped:
+            self.audio_dropped += size
+            metrics.AUDIO_DROPPED_BYTES.inc(size)
+
+    def add_transcript(self, text: str) -> None:
+        self.transcript_bytes += len(text.encode("utf-8"))
+
+    def release_transcript(self, text: str) -> None:
+        """応答済みで保持しなくなった認識テキストを差し引く"""
+        self.transcript_bytes -= len(text.encode("utf-8"))
+
+    def track(self, coro: Coroutine) -> "MeteredCoroutine":
+        """タスクとして実行するコルーチンのCPU時間とタスク数を記録する"""
+        return MeteredCoroutine(coro, self)
+
+    def cpu(self) -> "CpuTimer":
+        """with ブロック内でイベントループのスレッドが使ったCPU時間を記録する"""
+        return CpuTimer(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "client_id": self.client_id,
+            "started_at": self.started_at,
+            "duration_seconds": round(self.duration, 1),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "frames_in": self.frames_in,
+            "audio_buffered_bytes": self.audio_buffered,
+            "audio_buffered_peak_bytes": self.audio_buffered_peak,
+            "audio_dropped_bytes": self.audio_dropped,
+            "transcript_bytes": self.transcript_bytes,
+            "memory_bytes": self.memory_bytes,
+            "tasks": self.tasks,
+            "cpu_seconds": round(self.cpu_seconds, 4),
+        }
+
+
+class CpuTimer:
+    __slots__ = ("session", "started")
+
+    def __init__(self, session: StreamingSession):
+        self.session = session
+
+    def __enter__(self):
+        self.started = time.thread_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.session.cpu_seconds += time.thread_time() - self.started
+
+
+class MeteredCoroutine(collections.abc.Coroutine):
+    """コルーチンを1ステップ進めるごとにスレッドのCPU時間をセッションに加算する
+
+    イベントループはタスクを send() で1ステップずつ進めるため、その前後の
+    thread_time() の差がこのタスクがループ上で使ったCPU時間になる。
+    """
+    __slots__ = ("_coro", "_session", "_done")
+
+    def __init__(self, coro: Coroutine, session: StreamingSession):
+        self._coro = coro
+        self._session = session
+        self._done = False
+        session.tasks += 1
+
+    def _step(self, method, *args):
+        started = time.thread_time()
+        try:
+            return method(*args)
+        except BaseException:
+            self._finish()
+            raise
+        finally:
+            self._session.cpu_seconds += time.thread_time() - started
+
+    def _finish(self) -> None:
+        if not self._done:
+            self._done = True
+            self._session.tasks -= 1
+
+    def send(self, value):
+        return self._step(self._coro.send, value)
+
+    def throw(self, *args):
+        return self._step(self._coro.throw, *args)
+
+    def close(self):
+        self._finish()
+        self._coro.close()
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+
+class StreamingSessions:
+    """実行中の音声ストリーミングセッションと上限
+
+    環境変数:
+        SESSION_MAX_MEMORY_BYTES: セッションごとの推定メモリ使用量の上限（デフォルト1MiB、0で無制限）。
+            キューに溜まった音声と、まだ応答していない認識テキストの合計と比べる
+        SESSION_MAX_DURATION: セッションごとの接続時間の上限（秒、デフォルト3600、0で無制限）
+    """
+
+    def __init__(self, max_memory: Optional[int] = None, max_duration: Optional[float] = None):
+        self.max_memory = max_memory if max_memory is not None else int(
+            os.getenv('SESSION_MAX_MEMORY_BYTES', str(1024 * 1024)))
+        self.max_duration = max_duration if max_duration is not None else float(
+            os.getenv('SESSION_MAX_DURATION', '3600'))
+        self._sessions: Dict[str, StreamingSession] = {}
+
+    def open(self, session_id: str, client_id: str) -> StreamingSession:
+        session = self._sessions[session_id] = StreamingSession(session_id, client_id)
+        return session
+
+    def close(self, session: StreamingSession) -> None:
+        self._sessions.pop(session.session_id, None)
+        metrics.STREAMING_SESSION_CPU.observe(session.cpu_seconds)
+        metrics.STREAMING_SESSION_PEAK_AUDIO.observe(session.audio_buffered_peak)
+        if session.close_reason is not None:
+            metrics.STREAMING_SESSION_LIMITED.inc(reason=session.close_reason)
+
+    def remaining(self, session: StreamingSession) -> Optional[float]:
+        """接続時間の上限までの秒数（上限がなければ None）"""
+        if self.max_duration <= 0:
+            return None
+        return max(0.0, self.max_duration - session.duration)
+
+    def check(self, session: StreamingSession) -> Optional[str]:
+        """上限を超えていればその理由を返す"""
+        if self.max_memory > 0 and session.memory_bytes > self.max_memory:
+            return MEMORY_LIMIT
+        if self.max_duration > 0 and session.duration > self.max_duration:
+            return DURATION_LIMIT
+        return None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def report(self) -> dict:
+        sessions = [s.to_dict() for s in self._sessions.values()]
+        sessions.sort(key=lambda s: s["memory_bytes"], reverse=True)
+        return {
+            "pid": os.getpid(),
+            "limits": {"max_memory_bytes": self.max_memory,
+                       "max_duration_seconds": self.max_duration},
+            "count": len(sessions),
+            "memory_bytes": sum(s["memory_bytes"] for s in sessions),
+            "sessions": sessions,
+        }
+
+
+registry = StreamingSessions()
@@ -0,0 +1,191 @@
+"""ローカル検証用のスタブバックエンド
+
+AWSに接続せずに遅延や障害を再現するためのクライアント。`LLM_BACKEND=stub` で
+Bedrockの代わりに使用され、ヘッジやサーキットブレーカーの動作確認に利用できる。
+`TRANSCRIBE_BACKEND=stub` ではAmazon Transcribeの代わりに台本どおりの認識結果を返し、
+負荷試験（tests/load_generator.py）をオフラインで実行できる。
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import AsyncIterator, Optional, Sequence, Tuple
+
+from amazon_transcribe.model import Alternative, Result, Transcript, TranscriptEvent
+from langchain_core.messages import AIMessage
+
+
+class StubChatModel:
+    """ChatBedrock と同じ invoke(messages) を持つスタブLLM
+
+    環境変数:
+        STUB_LLM_LATENCY: 通常の応答時間（秒、デフォルト0.05）
+        STUB_LLM_SLOW_RATE: 遅い応答になる割合（デフォルト0）
+        STUB_LLM_SLOW_LATENCY: 遅い応答の応答時間（秒、デフォルト5）
+        STUB_LLM_ERROR_RATE: エラーになる割合（デフォルト0）
+    """
+
+    def __init__(self, latency: float = 0.05, slow_rate: float = 0.0,
+                 slow_latency: float = 5.0, error_rate: float = 0.0,
+                 reply: str = "スタブの応答です。", seed: Optional[int] = None):
+        self.latency = latency
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.error_rate = error_rate
+        self.reply = reply
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "StubChatModel":
+        return cls(
+            latency=float(os.getenv('STUB_LLM_LATENCY', '0.05')),
+            slow_rate=float(os.getenv('STUB_LLM_SLOW_RATE', '0')),
+            slow_latency=float(os.getenv('STUB_LLM_SLOW_LATENCY', '5')),
+            error_rate=float(os.getenv('STUB_LLM_ERROR_RATE', '0')),
+        )
+
+    def invoke(self, messages) -> AIMessage:
+        with self._lock:
+            self.calls += 1
+            failed = self._random.random() < self.error_rate
+            slow = self._random.random() < self.slow_rate
+        time.sleep(self.slow_latency if slow else self.latency)
+        if failed:
+            raise RuntimeError("スタブLLMのエラーです")
+        return AIMessage(content=self.reply)
+
+
+# 台本が指定されていない場合に順番に認識させる発話
+DEFAULT_TRANSCRIPT_SCRIPT = (
+    "今日の予定を教えてください",
+    "明日の天気はどうですか",
+    "会議の資料を要約してください",
+    "ありがとうございます",
+)
+
+
+class StubInputStream:
+    """音声を受け取り、音声の長さに応じて認識結果を予約する入力ストリーム"""
+
+    def __init__(self, transcription: "StubTranscription"):
+        self._transcription = transcription
+
+    async def send_audio_event(self, audio_chunk: bytes) -> None:
+        self._transcription.feed(len(audio_chunk))
+
+    async def end_stream(self) -> None:
+        self._transcription.finish()
+
+
+class StubTranscription:
+    """1ストリーム分の台本の進行
+
+    受け取った音声の長さ（16ビットモノラルPCMとして計算）が partial_interval 秒
+    増えるごとに発話の途中までの部分結果を、utterance_seconds 秒に達したら
+    確定結果を、それぞれ latency 秒後に出力ストリームへ送る。
+    """
+
+    def __init__(self, script: Sequence[str], sample_rate: int, utterance_seconds: float,
+                 partial_interval: float, latency: float):
+        self.script = list(script)
+        # 誤差が積み重ならないよう、音声の長さはバイト数で数える
+        bytes_per_second = sample_rate * 2
+        self.utterance_bytes = max(2, int(utterance_seconds * bytes_per_second))
+        self.partial_bytes = int(partial_interval * bytes_per_second)
+        self.latency = latency
+        self.utterances = 0
+        self._audio_bytes = 0
+        self._next_partial = self.partial_bytes
+        self._finished = False
+        # (送出時刻, イベント)。None は出力の終了
+        self._events: "asyncio.Queue[Tuple[float, Optional[TranscriptEvent]]]" = asyncio.Queue()
+        self.input_stream = StubInputStream(self)
+        self.output_stream = self._output()
+
+    def _text(self) -> str:
+        return self.script[self.utterances % len(self.script)]
+
+    def _emit(self, text: str, is_partial: bool) -> None:
+        result = Result(
+            result_id=f"stub-{self.utterances}",
+            is_partial=is_partial,
+            alternatives=[Alternative(transcript=text, items=[], entities=[])],
+        )
+        event = TranscriptEvent(transcript=Transcript(results=[result]))
+        self._events.put_nowait((time.monotonic() + self.latency, event))
+
+    def feed(self, size: int) -> None:
+        if self._finished or not self.script:
+            return
+        self._audio_bytes += size
+        while self._audio_bytes >= self.utterance_bytes:
+            self._emit(self._text(), is_partial=False)
+            self.utterances += 1
+            self._audio_bytes -= self.utterance_bytes
+            self._next_partial = self.partial_bytes
+        while self.partial_bytes > 0 and self._audio_bytes >= self._next_partial:
+            text = self._text()
+            shown = max(1, len(text) * self._audio_bytes // self.utterance_bytes)
+            self._emit(text[:shown], is_partial=True)
+            self._next_partial += self.partial_bytes
+
+    def finish(self) -> None:
+        """音声の終了。途中まで話した発話は確定させる"""
+        if self._finished:
+            return
+        self._finished = True
+        if self.script and self._audio_bytes >= max(1, self.partial_bytes):
+            self._emit(self._text(), is_partial=False)
+            self.utterances += 1
+        self._events.put_nowait((time.monotonic() + self.latency, None))
+
+    async def _output(self) -> AsyncIterator[TranscriptEvent]:
+        while True:
+            due, event = await self._events.get()
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if event is None:
+                return
+            yield event
+
+
+class StubTranscribeClient:
+    """TranscribeStreamingClient と同じ start_stream_transcription(...) を持つスタブ
+
+    環境変数:
+        STUB_TRANSCRIBE_SCRIPT: 認識させる発話（「|」区切り、順番に繰り返す）
+        STUB_TRANSCRIBE_UTTERANCE_SECONDS: 1発話あたりの音声の長さ（秒、デフォルト2）
+        STUB_TRANSCRIBE_PARTIAL_INTERVAL: 部分結果を出す音声の間隔（秒、デフォルト0.5、0で出さない）
+        STUB_TRANSCRIBE_LATENCY: 音声を受け取ってから結果を返すまでの時間（秒、デフォルト0.3）
+        STUB_TRANSCRIBE_OPEN_LATENCY: ストリームの開始にかかる時間（秒、デフォルト0.05）
+    """
+
+    def __init__(self, script: Sequence[str] = DEFAULT_TRANSCRIPT_SCRIPT,
+                 utterance_seconds: float = 2.0, partial_interval: float = 0.5,
+                 latency: float = 0.3, open_latency: float = 0.05):
+        self.script = list(script)
+        self.utterance_seconds = utterance_seconds
+        self.partial_interval = partial_interval
+        self.latency = latency
+        self.open_latency = open_latency
+
+    @classmethod
+    def from_env(cls) -> "StubTranscribeClient":
+        script = os.getenv('STUB_TRANSCRIBE_SCRIPT')
+        return cls(
+            script=script.split("|") if script else DEFAULT_TRANSCRIPT_SCRIPT,
+            utterance_seconds=float(os.getenv('STUB_TRANSCRIBE_UTTERANCE_SECONDS', '2')),
+            partial_interval=float(os.getenv('STUB_TRANSCRIBE_PARTIAL_INTERVAL', '0.5')),
+            latency=float(os.getenv('STUB_TRANSCRIBE_LATENCY', '0.3')),
+            open_latency=float(os.getenv('STUB_TRANSCRIBE_OPEN_LATENCY', '0.05')),
+        )
+
+    async def start_stream_transcription(self, media_sample_rate_hz: int = 16000,
+                                         **kwargs) -> StubTranscription:
+        await asyncio.sleep(self.open_latency)
+        return StubTranscription(self.script, media_sample_rate_hz, self.utterance_seconds,
+                                 self.partial_interval, self.latency)
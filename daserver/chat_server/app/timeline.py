@@ -0,0 +1,229 @@
+"""発話ごとのレイテンシタイムライン
+
+音声セッション内の1発話について、音声受信からWebSocketでの応答送信までの
+各ステップの時刻を記録し、JSONL形式でローテーションするファイルへ
+バックグラウンドスレッドから書き出す。
+
+集計用CLI:
+    python -m app.timeline timeline.jsonl [timeline.jsonl.2025-01-01 ...]
+"""
+import argparse
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+# 記録するステップ（発生順）
+STAGES = (
+    "first_audio",       # 最初の音声バイトを受信
+    "audio_sent",        # Transcribeへ音声を送信
+    "final_transcript",  # 確定した認識結果を受信
+    "llm_request",       # LLMへのリクエスト開始
+    "first_token",       # LLMの最初のトークン
+    "llm_complete",      # LLMの応答完了
+    "reply_sent",        # WebSocketで応答を送信
+)
+
+
+class UtteranceTimeline:
+    """1発話分のステップ時刻（開始からの経過ミリ秒）"""
+    __slots__ = ("session_id", "index", "started_at", "_origin", "marks")
+
+    def __init__(self, session_id: str, index: int):
+        self.session_id = session_id
+        self.index = index
+        self.started_at = time.time()
+        self._origin = time.perf_counter()
+        self.marks: Dict[str, float] = {}
+
+    def mark(self, stage: str) -> None:
+        """ステップの時刻を記録（最初の1回のみ）"""
+        if stage not in self.marks:
+            self.marks[stage] = (time.perf_counter() - self._origin) * 1000.0
+
+    def to_record(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "utterance": self.index,
+            "started_at": self.started_at,
+            "marks_ms": {s: round(self.marks[s], 3) for s in STAGES if s in self.marks},
+        }
+
+
+class JsonlRecorder:
+    """レコードをJSONLファイルへ非同期に書き出す
+
+    書き込みは QueueHandler / QueueListener 経由で専用スレッドが行い、
+    ファイルは日次でローテーションする。path が未設定の場合は何もしない。
+    """
+
+    def __init__(self, path: Optional[str] = None, backup_count: int = 14):
+        self.path = path
+        self.backup_count = backup_count
+        self._logger: Optional[logging.Logger] = None
+        self._listener: Optional[logging.handlers.QueueListener] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _start(self) -> logging.Logger:
+        with self._lock:
+            if self._logger is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                file_handler = logging.handlers.TimedRotatingFileHandler(
+                    self.path, when="midnight", backupCount=self.backup_count,
+                    encoding="utf-8",
+                )
+                file_handler.setFormatter(logging.Formatter("%(message)s"))
+                records: queue.SimpleQueue = queue.SimpleQueue()
+                self._listener = logging.handlers.QueueListener(records, file_handler)
+                self._listener.start()
+                atexit.register(self.stop)
+
+                logger = logging.getLogger(f"app.jsonl.{id(self)}")
+                logger.propagate = False
+                logger.setLevel(logging.INFO)
+                logger.addHandler(logging.handlers.QueueHandler(records))
+                self._logger = logger
+        return self._logger
+
+    def write(self, record: dict) -> None:
+        """レコードを書き出しキューに積む（イベントループをブロックしない）"""
+        if not self.enabled:
+            return
+        logger = self._logger or self._start()
+        logger.info(json.dumps(record, ensure_ascii=False))
+
+    def stop(self) -> None:
+        """未書き込みのレコードを書き出して停止"""
+        with self._lock:
+            if self._listener is not None:
+                self._listener.stop()
+                for handler in self._listener.handlers:
+                    handler.close()
+                self._listener = None
+                self._logger = None
+
+
+class TimelineRecorder(JsonlRecorder):
+    """発話タイムラインをJSONLファイルへ書き出す"""
+
+    def record(self, timeline: UtteranceTimeline) -> None:
+        if timeline.marks:
+            self.write(timeline.to_record())
+
+
+recorder = TimelineRecorder(os.getenv("TIMELINE_LOG_PATH") or None)
+
+
+# --- 集計CLI ---
+
+def stage_durations(record: dict) -> Dict[str, float]:
+    """隣接するステップ間の所要時間（ミリ秒）を計算する
+
+    キーは「そのステップに到達するまでの時間」を表すステップ名。
+    記録されていないステップは飛ばし、直前の記録済みステップからの差分とする。
+    """
+    marks = record.get("marks_ms", {})
+    durations = {}
+    previous = None
+    for stage in STAGES:
+        if stage not in marks:
+            continue
+        if previous is not None:
+            durations[stage] = marks[stage] - marks[previous]
+        previous = stage
+    if previous is not None and "first_audio" in marks:
+        durations["total"] = marks[previous] - marks["first_audio"]
+    return durations
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """線形補間によるパーセンタイル（sorted_values は昇順）"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    fraction = position - lower
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+
+
+def summarize(records: Iterable[dict], quantiles=(0.5, 0.9, 0.95, 0.99)) -> dict:
+    """ステップごとのパーセンタイルと最も遅いステップを求める"""
+    samples: Dict[str, List[float]] = {}
+    count = 0
+    for record in records:
+        count += 1
+        for stage, value in stage_durations(record).items():
+            samples.setdefault(stage, []).append(value)
+
+    stages = {}
+    for stage in list(STAGES) + ["total"]:
+        values = sorted(samples.get(stage, []))
+        if not values:
+            continue
+        stages[stage] = {
+            "count": len(values),
+            "mean": sum(values) / len(values),
+            **{f"p{round(q * 100)}": percentile(values, q) for q in quantiles},
+        }
+
+    # p95が最大のステップを最も遅いステップとする（合計は除く）
+    candidates = {k: v for k, v in stages.items() if k != "total"}
+    slowest = max(candidates, key=lambda k: candidates[k]["p95"]) if candidates else None
+    return {"utterances": count, "stages": stages, "slowest_stage": slowest}
+
+
+def read_records(paths: Iterable[str]) -> Iterable[dict]:
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def format_report(summary: dict) -> str:
+    lines = [f"発話数: {summary['utterances']}"]
+    header = f"{'ステップ':<18}{'件数':>8}{'平均':>10}{'p50':>10}{'p90':>10}{'p95':>10}{'p99':>10}"
+    lines.append(header)
+    for stage, stats in summary["stages"].items():
+        marker = " <- 最も遅い" if stage == summary["slowest_stage"] else ""
+        lines.append(
+            f"{stage:<18}{stats['count']:>8}{stats['mean']:>10.1f}{stats['p50']:>10.1f}"
+            f"{stats['p90']:>10.1f}{stats['p95']:>10.1f}{stats['p99']:>10.1f}{marker}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="発話タイムラインのレイテンシ集計（単位: ミリ秒）")
+    parser.add_argument("paths", nargs="+", help="タイムラインのJSONLファイル")
+    parser.add_argument("--json", action="store_true", help="JSON形式で出力")
+    args = parser.parse_args(argv)
+
+    summary = summarize(read_records(args.paths))
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    else:
+        print(format_report(summary))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""起動時のウォームアップと準備完了の判定
+
+デプロイ直後の最初のリクエストは、LLMクライアントの作成、認証情報の解決、
+Markdown拡張機能の読み込み、Transcribeの接続準備のために定常時よりはるかに遅い。
+起動時にこれらをまとめて並列に済ませ、すべて終わるまで /readyz は 503 を返して
+ロードバランサーがウォームアップ前のワーカーにトラフィックを送らないようにする。
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from app import metrics
+
+PENDING = "pending"
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
+
+
+class WarmupStep:
+    """ウォームアップする1つのコンポーネントの状態"""
+    __slots__ = ("name", "func", "required", "state", "duration", "error", "attempts")
+
+    def __init__(self, name: str, func: Callable[[], Awaitable[None]], required: bool):
+        self.name = name
+        self.func = func
+        self.required = required
+        self.state = PENDING
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+        self.attempts = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "state": self.state,
+            "required": self.required,
+            "duration_ms": round(self.duration * 1000.0, 1) if self.duration is not None else None,
+            "attempts": self.attempts,
+            "error": self.error,
+        }
+
+
+class Warmup:
+    """登録したコンポーネントを並列にウォームアップする
+
+    必須のコンポーネントがすべて ready になると準備完了とみなす。失敗したものは
+    retry_interval ごとにやり直す（認証情報の配布が遅れた場合など）。
+
+    環境変数:
+        WARMUP_ENABLED: 0 でウォームアップせずに即座に準備完了とする（デフォルト1）
+        WARMUP_TIMEOUT: コンポーネントごとの制限時間（秒、デフォルト30）
+        WARMUP_RETRY_INTERVAL: 失敗したコンポーネントをやり直す間隔（秒、デフォルト10）
+        WARMUP_OPTIONAL: 準備完了の判定に含めないコンポーネント（カンマ区切り）
+    """
+
+    def __init__(self, enabled: Optional[bool] = None, timeout: Optional[float] = None,
+                 retry_interval: Optional[float] = None, optional: Optional[str] = None):
+        self.enabled = enabled if enabled is not None else os.getenv('WARMUP_ENABLED', '1') == '1'
+        self.timeout = timeout if timeout is not None else float(os.getenv('WARMUP_TIMEOUT', '30'))
+        self.retry_interval = retry_interval if retry_interval is not None else float(
+            os.getenv('WARMUP_RETRY_INTERVAL', '10'))
+        optional = optional if optional is not None else os.getenv('WARMUP_OPTIONAL', '')
+        self.optional = {name.strip() for name in optional.split(",") if name.strip()}
+        self.steps: Dict[str, WarmupStep] = {}
+        self.started_at: Optional[float] = None
+        self.ready_after: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, name: str, func: Callable[[], Awaitable[None]], required: bool = True) -> None:
+        """ウォームアップ処理（引数なしのコルーチン関数）を登録する"""
+        self.steps[name] = WarmupStep(name, func, required and name not in self.optional)
+
+    @property
+    def ready(self) -> bool:
+        if not self.enabled:
+            return True
+        return all(step.state == READY for step in self.steps.values() if step.required)
+
+    async def _run_step(self, step: WarmupStep) -> None:
+        step.state = WARMING
+        step.attempts += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(step.func(), self.timeout)
+        except asyncio.TimeoutError:
+            step.state, step.error = FAILED, f"{self.timeout:g}秒以内に完了しませんでした"
+        except Exception as e:
+            step.state, step.error = FAILED, f"{type(e).__name__}: {e}"
+        else:
+            step.state, step.error = READY, None
+        step.duration = time.perf_counter() - started
+        metrics.WARMUP_DURATION.set(step.duration, component=step.name)
+        if step.state == READY:
+            logging.info("ウォームアップ完了: %s（%.0f ms）", step.name, step.duration * 1000.0)
+        else:
+            logging.warning("ウォームアップ失敗: %s: %s", step.name, step.error)
+
+    async def run(self) -> None:
+        """すべてのコンポーネントを並列にウォームアップし、失敗したものはやり直す"""
+        self.started_at = time.perf_counter()
+        pending = list(self.steps.values())
+        while True:
+            await asyncio.gather(*(self._run_step(step) for step in pending))
+            if self.ready and self.ready_after is None:
+                self.ready_after = time.perf_counter() - self.started_at
+                metrics.WARMUP_READY.set(1)
+                logging.info("ウォームアップが完了しました（%.0f ms）", self.ready_after * 1000.0)
+            pending = [step for step in self.steps.values() if step.state == FAILED]
+            if not pending:
+                return
+            await asyncio.sleep(self.retry_interval)
+
+    def start(self) -> None:
+        """実行中のイベントループでバックグラウンドにウォームアップを開始する"""
+        if not self.enabled:
+            metrics.WARMUP_READY.set(1)
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run(), name="warmup")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def report(self) -> dict:
+        return {
+            "status": "ready" if self.ready else "warming",
+            "ready_after_ms": round(self.ready_after * 1000.0, 1) if self.ready_after is not None else None,
+            "components": {name: step.to_dict() for name, step in self.steps.items()},
+        }
+
+
+warmup = Warmup()
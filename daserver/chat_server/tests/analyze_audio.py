@@ -0,0 +1,317 @@
+"""録音した音声（WAV/PCM）の診断ツール
+
+ファイルを np.memmap で開き、一定長の窓ごとの統計をまとめて（ベクトル化して）計算する。
+数時間の録音でもメモリに全体を読み込まない。ディレクトリを指定した場合は配下の
+*.wav / *.pcm / *.raw をすべて対象にし、ファイルごとにプロセスプールで並列に処理する。
+
+ファイルごとに次の値を出力する。
+
+- RMS・ピーク（dBFS）、クリッピングしたサンプルの割合と位置
+- DCオフセット、無音の窓の割合
+- スペクトル重心と99%ロールオフ周波数
+- 問題の検出: クリッピング、DCオフセット、ほぼ無音、エンディアンの誤り、
+  サンプリングレートの不一致（ヘッダーと想定値の違い、帯域が狭すぎる）、
+  WAVヘッダーのデータ長の誤り（録音中に書き出されたファイルなど）
+
+    python -m tests.analyze_audio recordings/ --format csv --output report.csv
+    python -m tests.analyze_audio session.pcm --sample-rate 8000
+"""
+import argparse
+import csv
+import json
+import os
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+AUDIO_EXTENSIONS = (".wav", ".pcm", ".raw")
+# 16ビットPCMのフルスケール
+FULL_SCALE = 32768.0
+# 一度にメモリに載せる音声の長さ（秒）
+BLOCK_SECONDS = 30
+# エンディアンの判定に使う音声の長さ（秒）
+ENDIAN_PROBE_SECONDS = 30
+
+
+@dataclass
+class Options:
+    """解析の設定"""
+    # サーバーが想定するサンプリングレート（ヘッダーのないPCMはこのレートとして扱う）
+    sample_rate: int = 8000
+    window_ms: float = 20.0
+    silence_db: float = -50.0
+    clip_ratio: float = 0.001
+    dc_threshold: float = 0.01
+    # 先頭から記録するクリッピング位置の数
+    max_events: int = 10
+
+
+@dataclass
+class AudioSource:
+    """memmap で開く音声データの位置と形式"""
+    path: str
+    offset: int
+    frames: int
+    channels: int
+    sample_rate: int
+    # numpy の dtype（'<i2' または '>i2'）
+    dtype: str
+    container: str
+    issues: List[str] = field(default_factory=list)
+
+
+def iter_audio_files(paths: List[str]) -> Iterator[str]:
+    """ファイルとディレクトリ（再帰的）から音声ファイルを列挙する"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    if name.lower().endswith(AUDIO_EXTENSIONS):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def open_source(path: str, options: Options) -> AudioSource:
+    """ヘッダーを読んで音声データの位置と形式を決める（データ本体は読まない）
+
+    Raises:
+        ValueError: 対応していない形式の場合
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        head = f.read(12)
+        if len(head) < 12 or head[:4] not in (b"RIFF", b"RIFX") or head[8:12] != b"WAVE":
+            # ヘッダーのない16ビットモノラルのPCM
+            return AudioSource(path, 0, size // 2, 1, options.sample_rate, "<i2", "pcm")
+
+        endian = "<" if head[:4] == b"RIFF" else ">"
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                raise ValueError("data チャンクがありません")
+            chunk_id, chunk_size = struct.unpack(endian + "4sI", chunk)
+            if chunk_id == b"fmt ":
+                fmt = f.read(chunk_size)
+                f.seek(chunk_size % 2, os.SEEK_CUR)
+            elif chunk_id == b"data":
+                break
+            else:
+                f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+        offset = f.tell()
+
+    if fmt is None:
+        raise ValueError("fmt チャンクがありません")
+    audio_format, channels, sample_rate, _, _, bits = struct.unpack(endian + "HHIIHH", fmt[:16])
+    if audio_format not in (1, 0xFFFE) or bits != 16:
+        raise ValueError(f"16ビットPCM以外の形式です（format={audio_format}, bits={bits}）")
+
+    issues = []
+    available = size - offset
+    # 録音中に書き出されたファイルはデータ長が0や最大値のままになっていることがある
+    if chunk_size == 0 or chunk_size > available:
+        issues.append("header_length")
+        chunk_size = available
+    frame_bytes = 2 * channels
+    return AudioSource(path, offset, chunk_size // frame_bytes, channels, sample_rate,
+                       endian + "i2", "wav", issues)
+
+
+def smoothness(samples: np.ndarray) -> float:
+    """隣接サンプルの差の平均と振幅の平均の比
+
+    音声は隣接サンプルの相関が強いため小さく、バイト順を取り違えた
+    データは雑音のようになるため大きくなる。
+    """
+    samples = samples.astype(np.float64)
+    level = np.mean(np.abs(samples))
+    if level == 0:
+        return 0.0
+    return float(np.mean(np.abs(np.diff(samples))) / level)
+
+
+def detect_byteswap(data: np.ndarray, source: AudioSource) -> bool:
+    """バイト順を入れ替えた方がはるかに音声らしい場合に True"""
+    probe = data[: ENDIAN_PROBE_SECONDS * source.sample_rate * source.channels]
+    if source.channels > 1:
+        probe = probe[:: source.channels]
+    if len(probe) < 2 or not np.any(probe):
+        return False
+    as_is = smoothness(probe)
+    swapped = smoothness(probe.byteswap())
+    return swapped < as_is * 0.5
+
+
+def to_db(value: float) -> Optional[float]:
+    return round(20 * np.log10(value), 2) if value > 0 else None
+
+
+def analyze_file(path: str, options: Options) -> Dict:
+    """1ファイル分の診断結果"""
+    report: Dict = {"path": path}
+    try:
+        source = open_source(path, options)
+    except (OSError, ValueError, struct.error) as e:
+        report["error"] = str(e)
+        return report
+
+    issues = list(source.issues)
+    report.update({
+        "container": source.container,
+        "sample_rate": source.sample_rate,
+        "channels": source.channels,
+        "duration_seconds": round(source.frames / source.sample_rate, 3),
+    })
+    if source.sample_rate != options.sample_rate:
+        issues.append("sample_rate_mismatch")
+    if source.frames == 0:
+        report["issues"] = issues + ["empty"]
+        return report
+
+    data = np.memmap(path, dtype=np.dtype(source.dtype), mode="r", offset=source.offset,
+                     shape=(source.frames * source.channels,))
+    byteswapped = detect_byteswap(data, source)
+    if byteswapped:
+        issues.append("endianness")
+
+    window = max(1, int(source.sample_rate * options.window_ms / 1000))
+    windows_per_block = max(1, BLOCK_SECONDS * source.sample_rate // window)
+    n_windows = source.frames // window
+    silence_level = 10 ** (options.silence_db / 20)
+    freqs = np.fft.rfftfreq(window, 1.0 / source.sample_rate)
+    taper = np.hanning(window).astype(np.float32)
+
+    total_sq = total_sum = 0.0
+    peak = 0.0
+    clipped = silent = 0
+    centroid_sum = centroid_weight = 0.0
+    spectrum = np.zeros(len(freqs))
+    clip_events: List[float] = []
+
+    for start in range(0, n_windows, windows_per_block):
+        count = min(windows_per_block, n_windows - start)
+        raw = data[start * window * source.channels:(start + count) * window * source.channels]
+        raw = np.asarray(raw).reshape(count * window, source.channels)
+        # クリッピングは変換前の整数値で数える（いずれかのチャンネルが端に張り付いたサンプル）
+        clipped_samples = ((raw >= 32767) | (raw <= -32768)).any(axis=1).reshape(count, window)
+        samples = raw.astype(np.float32).mean(axis=1) / FULL_SCALE
+        frames = samples.reshape(count, window)
+
+        total_sum += float(frames.sum(dtype=np.float64))
+        total_sq += float(np.square(frames, dtype=np.float64).sum())
+        peak = max(peak, float(np.abs(frames).max()))
+
+        clipped_per_window = clipped_samples.sum(axis=1)
+        clipped += int(clipped_per_window.sum())
+        if len(clip_events) < options.max_events:
+            for index in np.flatnonzero(clipped_per_window)[: options.max_events - len(clip_events)]:
+                clip_events.append(round((start + int(index)) * window / source.sample_rate, 3))
+
+        rms = np.sqrt(np.mean(np.square(frames), axis=1))
+        voiced = rms >= silence_level
+        silent += int(count - voiced.sum())
+        if voiced.any():
+            magnitude = np.abs(np.fft.rfft(frames[voiced] * taper, axis=1))
+            weight = magnitude.sum(axis=1)
+            centroid_sum += float((magnitude @ freqs).sum())
+            centroid_weight += float(weight.sum())
+            spectrum += np.square(magnitude, dtype=np.float64).sum(axis=0)
+
+    n_samples = n_windows * window
+    rms_total = np.sqrt(total_sq / n_samples) if n_samples else 0.0
+    dc_offset = total_sum / n_samples if n_samples else 0.0
+    clip_ratio = clipped / n_samples if n_samples else 0.0
+    silence_ratio = silent / n_windows if n_windows else 1.0
+    centroid = centroid_sum / centroid_weight if centroid_weight else None
+    rolloff = None
+    if spectrum.any():
+        cumulative = np.cumsum(spectrum)
+        rolloff = float(freqs[np.searchsorted(cumulative, cumulative[-1] * 0.99)])
+
+    if clip_ratio > options.clip_ratio:
+        issues.append("clipping")
+    if abs(dc_offset) > options.dc_threshold:
+        issues.append("dc_offset")
+    if silence_ratio > 0.95:
+        issues.append("mostly_silent")
+    # 実際の帯域がナイキスト周波数よりはるかに狭い場合は、低いレートの音声を
+    # 高いレートとして保存・解釈している可能性がある
+    if rolloff is not None and not byteswapped and silence_ratio < 0.95 \
+            and rolloff < 0.25 * source.sample_rate / 2:
+        issues.append("narrow_bandwidth")
+
+    report.update({
+        "rms_dbfs": to_db(rms_total),
+        "peak_dbfs": to_db(peak),
+        "dc_offset": round(dc_offset, 5),
+        "clipped_ratio": round(clip_ratio, 6),
+        "clipped_at_seconds": clip_events,
+        "silence_ratio": round(silence_ratio, 4),
+        "spectral_centroid_hz": round(centroid, 1) if centroid is not None else None,
+        "rolloff_hz": rolloff,
+        "issues": issues,
+    })
+    return report
+
+
+def analyze_all(paths: List[str], options: Options, jobs: int) -> List[Dict]:
+    files = list(iter_audio_files(paths))
+    if jobs <= 1 or len(files) <= 1:
+        return [analyze_file(path, options) for path in files]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(analyze_file, files, [options] * len(files)))
+
+
+CSV_COLUMNS = (
+    "path", "container", "sample_rate", "channels", "duration_seconds", "rms_dbfs",
+    "peak_dbfs", "dc_offset", "clipped_ratio", "silence_ratio", "spectral_centroid_hz",
+    "rolloff_hz", "issues", "error",
+)
+
+
+def write_csv(reports: List[Dict], out) -> None:
+    writer = csv.DictWriter(out, fieldnames=CSV_COLUMNS, extrasaction="ignore")
+    writer.writeheader()
+    for report in reports:
+        writer.writerow({**report, "issues": ";".join(report.get("issues", []))})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="音声ファイルまたはディレクトリ")
+    parser.add_argument("--sample-rate", type=int, default=Options.sample_rate,
+                        help="想定するサンプリングレート（ヘッダーのないPCMにも使用）")
+    parser.add_argument("--window-ms", type=float, default=Options.window_ms)
+    parser.add_argument("--silence-db", type=float, default=Options.silence_db,
+                        help="この値（dBFS）未満の窓を無音とみなす")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="並列に処理するプロセス数")
+    parser.add_argument("--format", choices=("json", "csv"), default="json")
+    parser.add_argument("--output", help="出力先（省略時は標準出力）")
+    args = parser.parse_args()
+
+    options = Options(sample_rate=args.sample_rate, window_ms=args.window_ms,
+                      silence_db=args.silence_db)
+    reports = analyze_all(args.paths, options, args.jobs)
+
+    out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    try:
+        if args.format == "csv":
+            write_csv(reports, out)
+        else:
+            json.dump(reports, out, ensure_ascii=False, indent=2)
+            out.write("\n")
+    finally:
+        if args.output:
+            out.close()
+    # 問題が見つかったファイルがあれば終了コード1
+    if any(report.get("issues") or report.get("error") for report in reports):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Markdown変換のマイクロベンチマーク
+
+応答ごとに markdown() を呼ぶ従来の方法と、MarkdownRenderer（インスタンス再利用、
+キャッシュあり/なし）を比較する。
+
+    python -m tests.bench_markdown [--iterations 200]
+"""
+import argparse
+import statistics
+import time
+
+from markdown import markdown
+
+from app.rendering import MarkdownRenderer
+
+SAMPLE = """## 回答
+
+以下の手順で設定できます。
+
+1. **設定ファイル**を開きます
+2. `timeout` の値を変更します
+3. サーバーを再起動します
+
+| 項目 | 説明 | デフォルト |
+| --- | --- | --- |
+| timeout | タイムアウト秒数 | 30 |
+| retries | 再試行回数 | 3 |
+
+```python
+def hello():
+    print("こんにちは")
+```
+
+> 注意: 変更後は必ず動作を確認してください。
+"""
+
+
+def measure(func, texts):
+    timings = []
+    for text in texts:
+        started = time.perf_counter()
+        func(text)
+        timings.append((time.perf_counter() - started) * 1000.0)
+    return timings
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(f"{name:<28} 平均 {statistics.mean(timings):8.3f} ms  "
+          f"p50 {statistics.median(timings):8.3f} ms  p99 {p99:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=8, help="サンプル本文の繰り返し回数（応答の長さ）")
+    args = parser.parse_args()
+
+    # 各応答の本文が異なるよう番号を付ける
+    texts = [f"{SAMPLE * args.repeat}\n\n応答番号 {i}" for i in range(args.iterations)]
+
+    report("markdown()（従来）", measure(lambda t: markdown(t, extensions=['extra']), texts))
+
+    uncached = MarkdownRenderer(cache_size=0)
+    report("MarkdownRenderer（再利用）", measure(uncached.render_sync, texts))
+
+    cached = MarkdownRenderer()
+    for text in texts:
+        cached.render_sync(text)
+    report("MarkdownRenderer（キャッシュ）", measure(cached.render_sync, texts))
+
+
+if __name__ == "__main__":
+    main()
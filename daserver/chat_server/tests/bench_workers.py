@@ -0,0 +1,111 @@
+"""ワーカー数ごとの /chat スループットのベンチマーク
+
+uvicorn を --workers 1..N で起動し、スタブのLLM（LLM_BACKEND=stub）と
+SQLiteの共有状態ストアを使って /chat に並列にリクエストを送り、
+1秒あたりの処理件数とレイテンシを比較する。
+
+    python -m tests.bench_workers [--max-workers 4] [--requests 2000] [--concurrency 64]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+
+def start_server(workers: int, port: int, state_path: str, llm_latency: float) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        LLM_BACKEND="stub",
+        STUB_LLM_LATENCY=str(llm_latency),
+        STATE_STORE="sqlite",
+        STATE_STORE_PATH=state_path,
+        # 1台のクライアントからの負荷なのでレート制限とLLMの同時実行数の上限は外す
+        CLIENT_RATE_LIMIT="0",
+        MAX_INFLIGHT_LLM_CALLS="0",
+        INTENTS_ENABLED="0",
+        LOG_LEVEL="WARNING",
+    )
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        env=env,
+    )
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/healthz")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("サーバーが起動しませんでした")
+
+
+async def drive(base_url: str, total: int, concurrency: int, sessions: int):
+    """total 件のリクエストを concurrency 並列で送り、(経過秒数, レイテンシ, エラー数) を返す"""
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=30.0, limits=limits) as client:
+        await wait_ready(client)
+
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                # セッションを使い回し、ワーカーをまたいで会話が続く状態にする
+                body = {"message": f"ベンチマーク {i}", "session_id": f"bench-{i % sessions}"}
+                started = time.perf_counter()
+                response = await client.post("/chat", json=body)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - started, latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--sessions", type=int, default=200, help="使い回す会話セッション数")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="スタブのLLMの応答時間（秒）")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    baseline = None
+    print(f"{'ワーカー数':<8} {'req/s':>9} {'倍率':>6} {'p50':>9} {'p99':>9} {'エラー':>6}")
+    for workers in range(1, args.max_workers + 1):
+        with tempfile.TemporaryDirectory() as tmp:
+            server = start_server(workers, args.port, os.path.join(tmp, "state.db"),
+                                  args.llm_latency)
+            try:
+                elapsed, latencies, errors = asyncio.run(drive(
+                    f"http://127.0.0.1:{args.port}", args.requests, args.concurrency,
+                    args.sessions))
+            finally:
+                server.terminate()
+                server.wait(30)
+        throughput = len(latencies) / elapsed
+        baseline = baseline or throughput
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"{workers:<8} {throughput:9.1f} {throughput / baseline:6.2f} "
+              f"{statistics.median(latencies) * 1000:7.1f}ms {p99 * 1000:7.1f}ms {errors:6d}")
+
+
+if __name__ == "__main__":
+    main()
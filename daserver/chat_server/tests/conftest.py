@@ -0,0 +1,28 @@
+import gc
+import httpx
+import pytest_asyncio
+from app.loop_monitor import LoopMonitor
+# アプリの読み込みは時間がかかるため、監視を始める前に済ませておく
+from app.main import app
+
+@pytest_asyncio.fixture
+async def loop_monitor():
+    """テスト中のイベントループのブロッキングを検出し、検出時はテストを失敗させる"""
+    # 前のテストまでに溜まったオブジェクトのGCによる停止を誤検出しないよう先に回収する
+    gc.collect()
+    monitor = LoopMonitor(interval=0.01, threshold=0.1)
+    monitor.start()
+    yield monitor
+    await monitor.stop()
+    monitor.assert_no_blocking()
+
+@pytest_asyncio.fixture
+async def chat_client(loop_monitor):
+    """アプリをテストと同じ（監視中の）イベントループで呼び出すHTTPクライアント
+
+    TestClient はアプリを別スレッドのループで実行するため、/chat の処理が
+    ループをブロックしても loop_monitor では検出できない。
+    """
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+        yield client
@@ -0,0 +1,297 @@
+"""/TranscribeStreaming の負荷試験クライアント
+
+多数のWebSocketセッションを同時に開き、それぞれ録音したPCM/WAVファイルを
+実時間のペースで送信して、次の値を集計する。
+
+- 最初の認識テキストまでの時間（最初の音声を送ってから「認識テキスト:」を受信するまで）
+- 応答の遅延（「認識テキスト:」を受信してから「応答:」を受信するまで）
+- 脱落したセッション（接続を拒否された、エラーで切断された、応答が返らなかった）
+- サーバーのCPU使用率（/metrics の process_cpu_seconds_total の増分）
+
+AWSに接続せずに試験する場合は、サーバーをスタブのバックエンドで起動する。
+
+    TRANSCRIBE_BACKEND=stub LLM_BACKEND=stub CLIENT_RATE_LIMIT=0 \\
+        uvicorn app.main:app --port 8000
+    python -m tests.load_generator --sessions 200 --ramp 10 recordings/*.wav
+"""
+import argparse
+import asyncio
+import json
+import math
+import statistics
+import sys
+import time
+import wave
+from array import array
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+import httpx
+import websockets
+
+# サーバーが受け付ける音声形式（16ビット・モノラル・リトルエンディアンのPCM）
+SAMPLE_RATE = 8000
+SAMPLE_WIDTH = 2
+# 受け付け上限を超えた場合のクローズコード（app.admission.WS_CLOSE_TRY_AGAIN_LATER）
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+def load_audio(path: str, sample_rate: int = SAMPLE_RATE) -> bytes:
+    """WAVまたはヘッダーなしのPCMファイルを読み込む
+
+    Raises:
+        ValueError: WAVの形式がサーバーの期待する形式と異なる場合
+    """
+    if path.lower().endswith(".wav"):
+        with wave.open(path, "rb") as wav:
+            if wav.getnchannels() != 1 or wav.getsampwidth() != SAMPLE_WIDTH:
+                raise ValueError(f"{path}: 16ビットのモノラルのWAVが必要です")
+            if wav.getframerate() != sample_rate:
+                raise ValueError(
+                    f"{path}: サンプリングレートが {wav.getframerate()} Hz です"
+                    f"（{sample_rate} Hz が必要です）"
+                )
+            return wav.readframes(wav.getnframes())
+    with open(path, "rb") as f:
+        data = f.read()
+    return data[: len(data) - len(data) % SAMPLE_WIDTH]
+
+
+def synthesize_audio(seconds: float = 3.0, sample_rate: int = SAMPLE_RATE) -> bytes:
+    """ファイルを指定しない場合に送る440Hzの正弦波"""
+    samples = array("h", (
+        int(12000 * math.sin(2 * math.pi * 440 * i / sample_rate))
+        for i in range(int(seconds * sample_rate))
+    ))
+    if sys.byteorder != "little":
+        samples.byteswap()
+    return samples.tobytes()
+
+
+@dataclass
+class SessionResult:
+    """1セッションの結果"""
+    index: int
+    # ok / rejected / failed / incomplete
+    status: str = "ok"
+    detail: str = ""
+    connect_seconds: Optional[float] = None
+    first_transcript_seconds: Optional[float] = None
+    reply_seconds: List[float] = field(default_factory=list)
+    transcripts: int = 0
+    replies: int = 0
+    errors: int = 0
+
+
+async def run_session(index: int, url: str, audio: bytes, args) -> SessionResult:
+    """1セッション分の音声を実時間のペースで送信し、応答を受信する"""
+    result = SessionResult(index)
+    chunk_bytes = int(args.sample_rate * SAMPLE_WIDTH * args.chunk_ms / 1000)
+    chunk_bytes -= chunk_bytes % SAMPLE_WIDTH
+    chunk_seconds = chunk_bytes / (args.sample_rate * SAMPLE_WIDTH) / args.speed
+    chunks = [audio[i:i + chunk_bytes] for i in range(0, len(audio), chunk_bytes)] * args.loops
+
+    await asyncio.sleep(args.ramp * index / max(1, args.sessions))
+    started = time.perf_counter()
+    try:
+        ws = await asyncio.wait_for(websockets.connect(url, max_size=None), args.connect_timeout)
+    except Exception as e:
+        result.status, result.detail = "failed", f"接続失敗: {e}"
+        return result
+    result.connect_seconds = time.perf_counter() - started
+
+    first_audio_at: Optional[float] = None
+    # 応答待ちの認識テキストを受信した時刻
+    pending: List[float] = []
+
+    async def send_audio():
+        nonlocal first_audio_at
+        begin = time.perf_counter()
+        for i, chunk in enumerate(chunks):
+            # 送信時刻を絶対時刻で決めて、待ち時間の誤差が積み重ならないようにする
+            delay = begin + i * chunk_seconds - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await ws.send(chunk)
+            if first_audio_at is None:
+                first_audio_at = time.perf_counter()
+        # サーバーは submit_response の時点でキューに残っている音声を破棄するため少し待つ
+        await asyncio.sleep(args.tail)
+        await ws.send("submit_response")
+
+    async def receive():
+        async for message in ws:
+            now = time.perf_counter()
+            if not isinstance(message, str):
+                continue
+            if message.startswith("設定:"):
+                rate = json.loads(message[len("設定:"):]).get("sample_rate")
+                if rate != args.sample_rate:
+                    result.status = "failed"
+                    result.detail = f"サーバーのサンプリングレートは {rate} Hz です"
+            elif message.startswith("認識テキスト:"):
+                result.transcripts += 1
+                pending.append(now)
+                if result.first_transcript_seconds is None and first_audio_at is not None:
+                    result.first_transcript_seconds = now - first_audio_at
+            elif message.startswith("応答:"):
+                result.replies += 1
+                if pending:
+                    result.reply_seconds.append(now - pending.pop(0))
+            elif message.startswith(("LLM処理エラー:", "エラーが発生しました:")):
+                result.errors += 1
+                if pending:
+                    pending.pop(0)
+
+    receiver = asyncio.create_task(receive())
+    try:
+        await send_audio()
+        # サーバーは残りの応答を送り終えてから接続を閉じる
+        await asyncio.wait_for(asyncio.shield(receiver), args.reply_timeout)
+    except asyncio.TimeoutError:
+        result.status, result.detail = "incomplete", "応答待ちのタイムアウト"
+    except websockets.ConnectionClosed:
+        pass
+    except Exception as e:
+        result.status, result.detail = "failed", str(e)
+    finally:
+        receiver.cancel()
+        try:
+            await receiver
+        except (asyncio.CancelledError, websockets.ConnectionClosed):
+            pass
+        except Exception as e:
+            if result.status == "ok":
+                result.status, result.detail = "failed", str(e)
+        await ws.close()
+
+    if ws.close_code == CLOSE_TRY_AGAIN_LATER:
+        result.status, result.detail = "rejected", ws.close_reason or ""
+    elif result.status == "ok" and ws.close_code not in (1000, None):
+        result.status, result.detail = "failed", f"切断（コード {ws.close_code}）"
+    elif result.status == "ok" and (pending or result.errors):
+        result.status, result.detail = "incomplete", f"応答のない発話 {len(pending)} 件"
+    return result
+
+
+async def read_server_cpu(client: httpx.AsyncClient, url: str) -> Optional[float]:
+    """/metrics の process_cpu_seconds_total（取得できない場合は None）"""
+    try:
+        response = await client.get(url)
+    except httpx.HTTPError:
+        return None
+    for line in response.text.splitlines():
+        if line.startswith("process_cpu_seconds_total "):
+            return float(line.split()[1])
+    return None
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    values = sorted(values)
+
+    def at(q: float) -> float:
+        return values[min(len(values) - 1, int(len(values) * q))]
+
+    return {"p50": statistics.median(values), "p95": at(0.95), "p99": at(0.99), "max": values[-1]}
+
+
+def metrics_url_of(url: str) -> str:
+    parts = urlsplit(url)
+    scheme = "https" if parts.scheme == "wss" else "http"
+    return urlunsplit((scheme, parts.netloc, "/metrics", "", ""))
+
+
+async def run(args) -> dict:
+    audios = [load_audio(path, args.sample_rate) for path in args.files] \
+        or [synthesize_audio(sample_rate=args.sample_rate)]
+    metrics_url = args.metrics_url or metrics_url_of(args.url)
+
+    async with httpx.AsyncClient(timeout=10.0) as client:
+        cpu_before = await read_server_cpu(client, metrics_url)
+        started = time.perf_counter()
+        results = await asyncio.gather(*(
+            run_session(i, args.url, audios[i % len(audios)], args)
+            for i in range(args.sessions)
+        ))
+        elapsed = time.perf_counter() - started
+        cpu_after = await read_server_cpu(client, metrics_url)
+
+    statuses: Dict[str, int] = {}
+    for result in results:
+        statuses[result.status] = statuses.get(result.status, 0) + 1
+    server_cpu = None
+    if cpu_before is not None and cpu_after is not None:
+        server_cpu = (cpu_after - cpu_before) / elapsed
+    return {
+        "sessions": args.sessions,
+        "elapsed_seconds": elapsed,
+        "statuses": statuses,
+        "dropped": args.sessions - statuses.get("ok", 0),
+        "first_transcript_seconds": percentiles(
+            [r.first_transcript_seconds for r in results if r.first_transcript_seconds is not None]),
+        "reply_seconds": percentiles([s for r in results for s in r.reply_seconds]),
+        "connect_seconds": percentiles(
+            [r.connect_seconds for r in results if r.connect_seconds is not None]),
+        "transcripts": sum(r.transcripts for r in results),
+        "replies": sum(r.replies for r in results),
+        # 1.0 = 1コア分
+        "server_cpu": server_cpu,
+        "failures": [asdict(r) for r in results if r.status != "ok"][:20],
+    }
+
+
+def print_report(report: dict) -> None:
+    def ms(value: Optional[float]) -> str:
+        return "-" if value is None else f"{value * 1000:.0f}ms"
+
+    print(f"セッション数: {report['sessions']}（{report['elapsed_seconds']:.1f}秒）")
+    print("結果: " + ", ".join(f"{k}={v}" for k, v in sorted(report["statuses"].items())))
+    print(f"脱落: {report['dropped']}  認識テキスト: {report['transcripts']}  応答: {report['replies']}")
+    for key, name in (("connect_seconds", "接続"),
+                      ("first_transcript_seconds", "最初の認識テキスト"),
+                      ("reply_seconds", "応答の遅延")):
+        p = report[key]
+        print(f"{name:<14} p50 {ms(p['p50']):>8}  p95 {ms(p['p95']):>8}  "
+              f"p99 {ms(p['p99']):>8}  max {ms(p['max']):>8}")
+    if report["server_cpu"] is not None:
+        print(f"サーバーCPU: {report['server_cpu'] * 100:.0f}%（1コア = 100%）")
+    for failure in report["failures"][:5]:
+        print(f"  セッション {failure['index']}: {failure['status']} {failure['detail']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="*", help="送信するWAV/PCMファイル（セッションごとに順番に割り当て）")
+    parser.add_argument("--url", default="ws://localhost:8000/TranscribeStreaming")
+    parser.add_argument("--metrics-url", help="CPU使用率を取得する /metrics のURL（省略時は --url から決定）")
+    parser.add_argument("--sessions", type=int, default=100, help="同時に開くセッション数")
+    parser.add_argument("--ramp", type=float, default=5.0, help="全セッションを開き終えるまでの秒数")
+    parser.add_argument("--loops", type=int, default=1, help="1セッションで音声を繰り返す回数")
+    parser.add_argument("--chunk-ms", type=int, default=20,
+                        help="1回に送る音声の長さ（ミリ秒、chat.html と同じ20ms）")
+    parser.add_argument("--speed", type=float, default=1.0, help="送信速度（1.0 = 実時間）")
+    parser.add_argument("--sample-rate", type=int, default=SAMPLE_RATE)
+    parser.add_argument("--tail", type=float, default=0.5,
+                        help="音声を送り終えてから submit_response を送るまでの秒数")
+    parser.add_argument("--connect-timeout", type=float, default=10.0)
+    parser.add_argument("--reply-timeout", type=float, default=30.0,
+                        help="音声を送り終えてから接続が閉じるまで待つ秒数")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    parser.add_argument("--max-drop-rate", type=float,
+                        help="脱落したセッションの割合がこれを超えたら終了コード1で終了する")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+    if args.max_drop_rate is not None and report["dropped"] > args.max_drop_rate * args.sessions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
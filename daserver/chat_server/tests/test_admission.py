@@ -0,0 +1,113 @@
+import pytest
+from unittest.mock import MagicMock, patch
+from fastapi.testclient import TestClient
+from starlette.datastructures import Headers
+from starlette.websockets import WebSocketDisconnect
+from app.admission import AdmissionController, AdmissionRejected, ClientIdentifier, TokenBucket
+from app.main import app
+
+client = TestClient(app)
+
+def test_token_bucket():
+    """トークンバケットの取得と補充のテスト"""
+    bucket = TokenBucket(rate=1.0, burst=2)
+    now = bucket.updated_at
+    assert bucket.try_acquire(now) == (True, 0.0)
+    assert bucket.try_acquire(now) == (True, 0.0)
+    allowed, wait = bucket.try_acquire(now)
+    assert not allowed
+    assert wait == pytest.approx(1.0)
+    assert bucket.try_acquire(now + 1.0)[0]
+
+def test_capacity_limit():
+    """同時実行数の上限を超えると即座に拒否されることのテスト"""
+    controller = AdmissionController(max_sessions=1, max_llm_calls=1, client_rate=0)
+    slot = controller.acquire("session")
+    with pytest.raises(AdmissionRejected) as excinfo:
+        controller.acquire("session")
+    assert excinfo.value.reason == "capacity"
+
+    slot.release()
+    slot.release()  # 二重解放しても件数は変わらない
+    assert controller.active("session") == 0
+    with controller.acquire("session"):
+        assert controller.active("session") == 1
+
+@pytest.mark.asyncio
+async def test_chat_rate_limited(chat_client):
+    """レート制限を超えた/chatリクエストに429とRetry-Afterが返ることのテスト"""
+    controller = AdmissionController(client_rate=0.5, client_burst=1)
+    llm = MagicMock()
+    llm.invoke = MagicMock(return_value=MagicMock(content="テストレスポンス"))
+    with patch("app.main.admission", controller), patch("app.main.llm", llm), \
+            patch("app.main.model_router.enabled", False):
+        first = await chat_client.post("/chat", json={"message": "質問1"})
+        second = await chat_client.post("/chat", json={"message": "質問2"})
+
+    assert first.status_code == 200
+    assert second.status_code == 429
+    assert second.headers["Retry-After"] == "2"
+    llm.invoke.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_chat_llm_capacity(chat_client):
+    """LLM呼び出し数が上限の場合に503が返ることのテスト"""
+    controller = AdmissionController(max_llm_calls=1, client_rate=0)
+    # 別のリクエストが枠を使用中
+    slot = controller.admit("10.0.0.1", "llm")
+    with patch("app.main.admission", controller):
+        response = await chat_client.post("/chat", json={"message": "質問"})
+    slot.release()
+    assert controller.active("llm") == 0
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+
+def test_streaming_session_rejected():
+    """セッション数が上限の場合にWebSocketがクローズコード1013で閉じられることのテスト"""
+    controller = AdmissionController(max_sessions=1, client_rate=0)
+    slot = controller.admit("10.0.0.1", "session")
+    with patch("app.main.admission", controller):
+        with client.websocket_connect("/TranscribeStreaming") as ws:
+            with pytest.raises(WebSocketDisconnect) as excinfo:
+                ws.receive_text()
+    slot.release()
+    assert excinfo.value.code == 1013
+    assert excinfo.value.reason == "retry_after=1"
+
+def test_client_identifier_trusts_only_configured_proxies():
+    """信頼するプロキシからの接続に限り転送元ヘッダーのアドレスを使うことのテスト"""
+    identify = ClientIdentifier(trusted_proxies="10.0.0.0/8, 192.0.2.1").identify
+    forwarded = Headers({"x-forwarded-for": "203.0.113.9, 198.51.100.7, 10.1.2.3"})
+    # 右から信頼するプロキシを読み飛ばし、最初の信頼しないアドレスがクライアント
+    assert identify("192.0.2.1", forwarded) == "198.51.100.7"
+    # 信頼しない接続元からのヘッダーは偽装できるので無視する
+    assert identify("198.51.100.50", forwarded) == "198.51.100.50"
+    assert identify("10.0.0.5", Headers({})) == "10.0.0.5"
+    assert identify(None, forwarded) == "unknown"
+    assert ClientIdentifier(trusted_proxies="").identify("10.0.0.5", forwarded) == "10.0.0.5"
+
+def test_client_identifier_forwarded_header():
+    """Forwarded ヘッダー（RFC 7239）の for パラメータからアドレスを求めることのテスト"""
+    identify = ClientIdentifier(trusted_proxies="10.0.0.1", header="forwarded").identify
+    headers = Headers({"forwarded": 'for="[2001:db8::17]:4711";proto=https, for=10.0.0.1'})
+    assert identify("10.0.0.1", headers) == "2001:db8::17"
+    with pytest.raises(ValueError):
+        ClientIdentifier(header="x-real-ip")
+
+@pytest.mark.asyncio
+async def test_chat_rate_limited_per_forwarded_client(chat_client):
+    """プロキシ経由の/chatリクエストが転送元のクライアントごとにレート制限されることのテスト"""
+    controller = AdmissionController(client_rate=0.5, client_burst=1)
+    llm = MagicMock()
+    llm.invoke = MagicMock(return_value=MagicMock(content="テストレスポンス"))
+    # ASGITransport の接続元は 127.0.0.1
+    identifier = ClientIdentifier(trusted_proxies="127.0.0.1")
+    with patch("app.main.admission", controller), patch("app.main.llm", llm), \
+            patch("app.main.client_identifier", identifier), \
+            patch("app.main.model_router.enabled", False):
+        statuses = [
+            (await chat_client.post("/chat", json={"message": "質問"},
+                                    headers={"X-Forwarded-For": address})).status_code
+            for address in ("203.0.113.1", "203.0.113.2", "203.0.113.1")
+        ]
+    assert statuses == [200, 200, 429]
@@ -0,0 +1,63 @@
+import struct
+import numpy as np
+from tests.analyze_audio import Options, analyze_all, analyze_file
+
+RATE = 8000
+
+def speech_like(seconds: float, rate: int = RATE, amplitude: float = 0.3) -> np.ndarray:
+    """複数の倍音を重ねた音声に近い信号（16ビット整数）"""
+    t = np.arange(int(seconds * rate)) / rate
+    signal = sum(np.sin(2 * np.pi * f * t) / (i + 1) for i, f in enumerate((220, 660, 1400, 2600)))
+    return (signal / np.abs(signal).max() * amplitude * 32767).astype(np.int16)
+
+def write_wav(path, samples: np.ndarray, rate: int = RATE, data_size=None) -> None:
+    data = samples.astype("<i2").tobytes()
+    size = len(data) if data_size is None else data_size
+    header = b"RIFF" + struct.pack("<I", 36 + size) + b"WAVE"
+    header += b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, rate, rate * 2, 2, 16)
+    # 解析が不明なチャンクを読み飛ばせることも確認する
+    header += b"LIST" + struct.pack("<I", 3) + b"abc\x00"
+    header += b"data" + struct.pack("<I", size)
+    path.write_bytes(header + data)
+
+def test_clean_recording_has_no_issues(tmp_path):
+    """正常な録音では問題が検出されず、統計値が妥当なことのテスト"""
+    path = tmp_path / "clean.wav"
+    write_wav(path, speech_like(3))
+    report = analyze_file(str(path), Options())
+    assert report["issues"] == []
+    assert report["duration_seconds"] == 3.0
+    assert -20 < report["rms_dbfs"] < -10
+    assert report["silence_ratio"] == 0
+    assert 220 < report["spectral_centroid_hz"] < 2600
+
+def test_detects_clipping_dc_offset_and_silence(tmp_path):
+    """クリッピング・DCオフセット・無音を検出することのテスト"""
+    loud = tmp_path / "loud.wav"
+    write_wav(loud, np.clip(speech_like(2).astype(np.int32) * 8, -32768, 32767))
+    offset = tmp_path / "offset.wav"
+    write_wav(offset, speech_like(2) + 3000)
+    silent = tmp_path / "silent.pcm"
+    silent.write_bytes(np.zeros(RATE * 2, dtype="<i2").tobytes())
+
+    reports = {r["path"]: r for r in analyze_all([str(tmp_path)], Options(), jobs=2)}
+    assert "clipping" in reports[str(loud)]["issues"]
+    assert reports[str(loud)]["clipped_at_seconds"][0] == 0.0
+    assert reports[str(offset)]["issues"] == ["dc_offset"]
+    assert reports[str(silent)]["container"] == "pcm"
+    assert "mostly_silent" in reports[str(silent)]["issues"]
+
+def test_detects_format_mismatches(tmp_path):
+    """エンディアン・サンプリングレート・ヘッダーのデータ長の誤りを検出することのテスト"""
+    swapped = tmp_path / "swapped.pcm"
+    swapped.write_bytes(speech_like(2).astype(">i2").tobytes())
+    wrong_rate = tmp_path / "16k.wav"
+    write_wav(wrong_rate, speech_like(2, rate=16000), rate=16000)
+    unfinished = tmp_path / "unfinished.wav"
+    write_wav(unfinished, speech_like(2), data_size=0)
+
+    assert "endianness" in analyze_file(str(swapped), Options())["issues"]
+    assert analyze_file(str(wrong_rate), Options())["issues"] == ["sample_rate_mismatch"]
+    report = analyze_file(str(unfinished), Options())
+    assert report["issues"] == ["header_length"]
+    assert report["duration_seconds"] == 2.0
@@ -2,6 +2,7 @@ import pytest
 from fastapi.testclient import TestClient
 from fastapi.websockets import WebSocket, WebSocketDisconnect
 import asyncio
+import threading
 from app.main import app
 from unittest.mock import AsyncMock, MagicMock, patch
 import json
@@ -44,10 +45,11 @@ def test_healthz():
     assert response.status_code == 200
     assert response.json() == {"status": "ok"}
 
-def test_chat_endpoint():
+@pytest.mark.asyncio
+async def test_chat_endpoint(chat_client):
     """チャットエンドポイントの基本的な機能テスト"""
     test_message = "こんにちは"
-    response = client.post(
+    response = await chat_client.post(
         "/chat",
         json={"message": test_message}
     )
@@ -61,9 +63,10 @@ def test_chat_endpoint():
     assert isinstance(response_data["response"], str)
     assert len(response_data["response"]) > 0
 
-def test_chat_endpoint_empty_message():
+@pytest.mark.asyncio
+async def test_chat_endpoint_empty_message(chat_client):
     """空のメッセージを送信した場合のテスト"""
-    response = client.post(
+    response = await chat_client.post(
         "/chat",
         json={"message": ""}
     )
@@ -76,9 +79,10 @@ def test_chat_endpoint_empty_message():
     assert "response" in response_data
     assert isinstance(response_data["response"], str)
 
-def test_chat_endpoint_invalid_request():
+@pytest.mark.asyncio
+async def test_chat_endpoint_invalid_request(chat_client):
     """不正なリクエストボディのテスト"""
-    response = client.post(
+    response = await chat_client.post(
         "/chat",
         json={"invalid_key": "こんにちは"}
     )
@@ -87,7 +91,7 @@ def test_chat_endpoint_invalid_request():
     assert response.status_code == 422
 
 @pytest.mark.asyncio
-async def test_transcribe_streaming(test_websocket, mock_transcribe_client, mock_llm):
+async def test_transcribe_streaming(test_websocket, mock_transcribe_client, mock_llm, loop_monitor):
     """音声認識WebSocketエンドポイントのテスト"""
     from app.main import transcribe_streaming
     import asyncio
@@ -168,7 +172,7 @@ async def test_transcribe_streaming(test_websocket, mock_transcribe_client, mock
     assert test_websocket.close.called
 
 @pytest.mark.asyncio
-async def test_transcribe_handler(test_websocket, mock_llm):
+async def test_transcribe_handler(test_websocket, mock_llm, loop_monitor):
     """TranscribeHandlerのテスト"""
     from app.main import TranscribeHandler
     from amazon_transcribe.model import TranscriptEvent
@@ -207,3 +211,36 @@ async def test_transcribe_handler(test_websocket, mock_llm):
     
     # LLMの応答が送信されたことを確認（HTMLタグを含む形式）
     test_websocket.send_text.assert_any_call("応答: <p>テストレスポンス</p>")
+
+@pytest.mark.asyncio
+async def test_chat_drops_request_after_client_disconnect(loop_monitor):
+    """LLMの実行を待つ間にクライアントが切断した/chatリクエストが実行されずに破棄されることのテスト"""
+    from fastapi import HTTPException
+    from starlette.datastructures import Headers
+    from app.llm_gateway import LLMGateway
+    from app.main import ChatRequest, chat
+
+    gateway = LLMGateway(concurrency=1, alive_interval=0.01)
+    release = threading.Event()
+    blocking_llm = MagicMock()
+    blocking_llm.invoke = MagicMock(side_effect=lambda messages: release.wait(5))
+    llm = MagicMock()
+    llm.invoke = MagicMock(return_value=MagicMock(content="テストレスポンス"))
+
+    http_request = MagicMock()
+    http_request.client.host = "127.0.0.1"
+    http_request.headers = Headers({})
+    http_request.is_disconnected = AsyncMock(side_effect=[False, True])
+
+    # 実行枠を先のリクエストで埋めておく
+    blocker = asyncio.create_task(gateway.submit(blocking_llm, "先のリクエスト"))
+    await asyncio.sleep(0)
+    assert gateway.running == 1
+    with patch("app.main.llm_gateway", gateway), patch("app.main.llm", llm), \
+            patch("app.main.model_router.enabled", False):
+        with pytest.raises(HTTPException):
+            await asyncio.wait_for(chat(ChatRequest(message="質問"), http_request), 1)
+    assert gateway.queued() == 0
+    release.set()
+    await blocker
+    llm.invoke.assert_not_called()
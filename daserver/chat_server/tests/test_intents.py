@@ -0,0 +1,124 @@
+import json
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+from app.intents import AhoCorasick, IntentMatcher, normalize
+
+def test_normalize_absorbs_kana_and_width_variants():
+    """カタカナ・半角・全角・小書きの母音の表記ゆれが同じ文字列になることのテスト"""
+    assert normalize("コンニチハ！") == "こんにちは"
+    assert normalize("ｺﾝﾆﾁﾊ") == "こんにちは"
+    assert normalize("ＨＥＬＬＯ") == "hello"
+    assert normalize("ウィンドウ") == normalize("ウインドウ")
+
+def test_aho_corasick_finds_overlapping_patterns():
+    """重なり合うパターンをすべて検出することのテスト"""
+    index = AhoCorasick()
+    for pattern in ("he", "she", "his", "hers"):
+        index.add(pattern, pattern)
+    matches = sorted(index.iter_matches("ushers"))
+    assert matches == [(1, 3, "she"), (2, 2, "he"), (2, 4, "hers")]
+
+def test_match_builtin_intents():
+    """組み込みのインテントが表記ゆれを含めて一致することのテスト"""
+    matcher = IntentMatcher(enabled=True, min_coverage=0.6)
+    now = datetime(2025, 1, 6, 9, 5)
+    assert matcher.match("ｺﾝﾆﾁﾊ").intent == "greeting"
+    assert matcher.match("今何時？", now=now).reply == "現在の時刻は9時5分です。"
+    assert matcher.match("今日は何日ですか", now=now).reply == "今日は2025年1月6日（月曜日）です。"
+    close = matcher.match("ウインドウを閉じて")
+    assert close.intent == "close_window"
+    assert close.action == "close_window"
+
+def test_unmatched_or_partial_input_passes_through():
+    """一致しない入力や、パターンが一部にしか含まれない入力はLLMに渡されることのテスト"""
+    matcher = IntentMatcher(enabled=True, min_coverage=0.6)
+    assert matcher.match("量子力学を説明して") is None
+    assert matcher.match("こんにちは、量子力学について詳しく説明してください") is None
+    assert IntentMatcher(enabled=False).match("こんにちは") is None
+
+def test_questions_about_other_things_pass_through():
+    """時刻・日付や挨拶の語を含むだけの別の質問がLLMに渡されることのテスト"""
+    matcher = IntentMatcher(enabled=True, min_coverage=0.6)
+    for text in ("会議は何時ですか", "開店は何時ですか", "あと何日ですか",
+                 "締切の日付を教えて", "会議の時間を教えて", "chi", "ok, this"):
+        assert matcher.match(text) is None, text
+    assert matcher.match("Hi!").intent == "greeting"
+    assert matcher.match("今日は何曜日？").intent == "date"
+
+def test_reply_braces_and_invalid_intents(tmp_path, monkeypatch):
+    """応答文の既知以外の波括弧がそのまま返り、不正なインテントは読み込まれないことのテスト"""
+    path = tmp_path / "intents.json"
+    path.write_text(json.dumps([
+        {"name": "json", "patterns": ["設定の例"], "reply": "{\"key\": 1} を{time}に確認"},
+    ]), encoding="utf-8")
+    monkeypatch.setenv("INTENTS_PATH", str(path))
+    match = IntentMatcher.from_env().match("設定の例", now=datetime(2025, 1, 6, 9, 5))
+    assert match.reply == "{\"key\": 1} を9時5分に確認"
+
+    path.write_text(json.dumps([{"name": "bad", "patterns": "天気", "reply": "x"}]),
+                    encoding="utf-8")
+    matcher = IntentMatcher.from_env()
+    assert "bad" not in matcher.intents and "greeting" in matcher.intents
+
+def test_close_window_requires_window_target():
+    """「閉じて」を含むだけのウィンドウ以外の依頼は close_window に一致しないことのテスト"""
+    matcher = IntentMatcher(enabled=True, min_coverage=0.6)
+    assert matcher.match("目を閉じて") is None
+    assert matcher.match("ファイルを閉じて") is None
+    assert matcher.match("チャットを閉じて").action == "close_window"
+
+def test_time_uses_assistant_timezone(monkeypatch):
+    """時刻・日付がサーバーのタイムゾーンではなく ASSISTANT_TZ で答えられることのテスト"""
+    frozen = datetime(2025, 1, 5, 23, 30, tzinfo=timezone.utc)
+
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return frozen.astimezone(tz) if tz is not None else frozen.replace(tzinfo=None)
+
+    monkeypatch.setattr("app.intents.datetime", FrozenDatetime)
+    monkeypatch.setenv("ASSISTANT_TZ", "Asia/Tokyo")
+    matcher = IntentMatcher(enabled=True, min_coverage=0.6)
+    assert matcher.match("今何時").reply == "現在の時刻は8時30分です。"
+    assert matcher.match("今日は何日").reply == "今日は2025年1月6日（月曜日）です。"
+    utc = IntentMatcher(enabled=True, min_coverage=0.6, tz="UTC")
+    assert utc.match("今何時").reply == "現在の時刻は23時30分です。"
+
+def test_from_env_adds_and_overrides_intents(tmp_path, monkeypatch):
+    """INTENTS_PATH のインテントが追加・上書きされることのテスト"""
+    path = tmp_path / "intents.json"
+    path.write_text(json.dumps([
+        {"name": "greeting", "patterns": ["やあ"], "reply": "やあ！"},
+        {"name": "weather", "patterns": ["天気は"], "reply": "天気には対応していません。"},
+    ]), encoding="utf-8")
+    monkeypatch.setenv("INTENTS_PATH", str(path))
+    matcher = IntentMatcher.from_env()
+    assert matcher.match("やあ").reply == "やあ！"
+    assert matcher.match("こんにちは") is None
+    assert matcher.match("天気は？").intent == "weather"
+    assert matcher.match("ありがとう").intent == "thanks"
+
+@pytest.mark.asyncio
+async def test_chat_answers_intent_without_llm(chat_client):
+    """/chat が定型の問い合わせにLLMを呼ばずに応答することのテスト"""
+    llm = MagicMock()
+    with patch("app.main.llm", llm), patch("app.main.model_router.enabled", False):
+        response = await chat_client.post("/chat", json={"message": "チャットを閉じて"})
+    assert response.status_code == 200
+    assert response.json()["response"] == "<p>ウィンドウを閉じます。</p>"
+    assert response.json()["action"] == "close_window"
+    llm.invoke.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_handler_answers_intent_without_llm(loop_monitor):
+    """インテントマッチャーを渡したTranscribeHandlerがLLMを呼ばずに応答することのテスト"""
+    from app.main import TranscribeHandler
+    llm = MagicMock()
+    websocket = AsyncMock()
+    handler = TranscribeHandler(AsyncMock(), websocket, llm,
+                                intent_matcher=IntentMatcher(enabled=True))
+    await handler.process_with_llm("ありがとう")
+
+    llm.invoke.assert_not_called()
+    websocket.send_text.assert_called_once_with("応答: <p>どういたしまして。</p>")
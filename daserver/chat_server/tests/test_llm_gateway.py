@@ -0,0 +1,122 @@
+import asyncio
+import threading
+import pytest
+from app.llm_gateway import LLMGateway, Priority, RequestDropped
+
+class RecordingLLM:
+    """呼び出し順を記録するLLM（最初の呼び出しはreleaseまで待機）"""
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+
+    def invoke(self, messages):
+        if not self.calls:
+            self.calls.append(messages)
+            self.release.wait(5)
+        else:
+            self.calls.append(messages)
+        return f"応答:{messages}"
+
+async def wait_until_running(gateway):
+    for _ in range(100):
+        if gateway.running:
+            return
+        await asyncio.sleep(0.01)
+
+@pytest.mark.asyncio
+async def test_voice_preempts_text(loop_monitor):
+    """待機中の音声リクエストがテキストより先に実行されることのテスト"""
+    gateway = LLMGateway(concurrency=1)
+    llm = RecordingLLM()
+    first = asyncio.create_task(gateway.submit(llm, "blocker", Priority.TEXT, "a"))
+    await wait_until_running(gateway)
+
+    text = asyncio.create_task(gateway.submit(llm, "text", Priority.TEXT, "b"))
+    await asyncio.sleep(0)
+    voice = asyncio.create_task(gateway.submit(llm, "voice", Priority.VOICE, "c"))
+    await asyncio.sleep(0)
+    assert gateway.queued() == 2
+
+    llm.release.set()
+    results = await asyncio.gather(first, text, voice)
+    assert results == ["応答:blocker", "応答:text", "応答:voice"]
+    assert llm.calls == ["blocker", "voice", "text"]
+
+@pytest.mark.asyncio
+async def test_fair_queuing_between_clients():
+    """大量に投入したクライアントがいても他のクライアントが待たされ続けないことのテスト"""
+    gateway = LLMGateway(concurrency=1)
+    llm = RecordingLLM()
+    first = asyncio.create_task(gateway.submit(llm, "blocker", Priority.TEXT, "x"))
+    await wait_until_running(gateway)
+
+    tasks = [asyncio.create_task(gateway.submit(llm, f"heavy{i}", Priority.TEXT, "heavy"))
+             for i in range(4)]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(gateway.submit(llm, "light", Priority.TEXT, "light")))
+    await asyncio.sleep(0)
+
+    llm.release.set()
+    await asyncio.gather(first, *tasks)
+    assert llm.calls.index("light") <= 2
+
+@pytest.mark.asyncio
+async def test_drops_expired_and_abandoned_requests():
+    """期限切れ・呼び出し元が離脱したリクエストが実行されずに破棄されることのテスト"""
+    gateway = LLMGateway(concurrency=1)
+    llm = RecordingLLM()
+    first = asyncio.create_task(gateway.submit(llm, "blocker", Priority.TEXT, "a"))
+    await wait_until_running(gateway)
+
+    expired = asyncio.create_task(
+        gateway.submit(llm, "expired", Priority.TEXT, "b", timeout=0.01))
+    abandoned = asyncio.create_task(
+        gateway.submit(llm, "abandoned", Priority.VOICE, "c", alive=lambda: False))
+    cancelled = asyncio.create_task(gateway.submit(llm, "cancelled", Priority.TEXT, "d"))
+    await asyncio.sleep(0.05)
+    cancelled.cancel()
+
+    llm.release.set()
+    await first
+    with pytest.raises(RequestDropped) as excinfo:
+        await expired
+    assert excinfo.value.reason == "deadline"
+    with pytest.raises(RequestDropped):
+        await abandoned
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    assert llm.calls == ["blocker"]
+    assert gateway.running == 0
+
+@pytest.mark.asyncio
+async def test_waiters_expire_without_waiting_for_a_slot(loop_monitor):
+    """待機中のリクエストが実行枠の空きを待たずに期限切れ・離脱で失敗することのテスト"""
+    gateway = LLMGateway(concurrency=1, alive_interval=0.01)
+    llm = RecordingLLM()
+    first = asyncio.create_task(gateway.submit(llm, "blocker", Priority.TEXT, "a"))
+    await wait_until_running(gateway)
+
+    connected = True
+    expired = asyncio.create_task(
+        gateway.submit(llm, "expired", Priority.TEXT, "b", timeout=0.05))
+    abandoned = asyncio.create_task(
+        gateway.submit(llm, "abandoned", Priority.TEXT, "c", alive=lambda: connected))
+    waiting = asyncio.create_task(gateway.submit(llm, "waiting", Priority.TEXT, "d"))
+    await asyncio.sleep(0)
+    assert gateway.queued() == 3
+
+    with pytest.raises(RequestDropped) as excinfo:
+        await asyncio.wait_for(expired, 1)
+    assert excinfo.value.reason == "deadline"
+    connected = False
+    with pytest.raises(RequestDropped) as excinfo:
+        await asyncio.wait_for(abandoned, 1)
+    assert excinfo.value.reason == "caller_gone"
+    # 破棄したリクエストはキューの件数に含めない
+    assert gateway.queued() == 1
+
+    llm.release.set()
+    assert await first == "応答:blocker"
+    assert await waiting == "応答:waiting"
+    assert llm.calls == ["blocker", "waiting"]
+    assert gateway.queued() == 0
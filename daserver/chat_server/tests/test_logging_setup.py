@@ -0,0 +1,67 @@
+import logging
+import queue
+from app.logging_setup import LazyQueueHandler, RateLimitFilter, SessionLogSummary
+
+class Recorder(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+def make_logger(name, *filters):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    handler = Recorder()
+    logger.addHandler(handler)
+    for f in filters:
+        logger.addFilter(f)
+    return logger, handler
+
+def test_rate_limit_filter():
+    """テンプレートごとにログが間引かれ、省略件数が付記されることのテスト"""
+    logger, handler = make_logger("test.ratelimit", RateLimitFilter(rate=0.0, burst=2))
+    for i in range(5):
+        logger.debug("チャンク %d を送信中", i)
+    logger.debug("別のメッセージ")
+
+    messages = [r.getMessage() for r in handler.records]
+    assert messages == ["チャンク 0 を送信中", "チャンク 1 を送信中", "別のメッセージ"]
+
+    limiter = RateLimitFilter(rate=1000.0, burst=1)
+    logger, handler = make_logger("test.ratelimit.refill", limiter)
+    logger.debug("チャンク %d", 1)
+    logger.debug("チャンク %d", 2)  # 直後なので抑制される
+    limiter._buckets[("test.ratelimit.refill", "チャンク %d")][0] = 1.0
+    logger.debug("チャンク %d", 3)
+    assert handler.records[-1].getMessage() == "チャンク 3 (他 1 件を省略)"
+
+def test_lazy_queue_handler_defers_formatting():
+    """キューに積む時点ではメッセージをフォーマットしないことのテスト"""
+    class Expensive:
+        formatted = 0
+
+        def __str__(self):
+            Expensive.formatted += 1
+            return "expensive"
+
+    records = queue.SimpleQueue()
+    logger, _ = make_logger("test.lazy")
+    logger.addHandler(LazyQueueHandler(records))
+    logger.info("値: %s", Expensive())
+
+    record = records.get_nowait()
+    assert Expensive.formatted == 0
+    assert record.getMessage() == "値: expensive"
+
+def test_session_summary():
+    """セッションサマリーが1行で出力されることのテスト"""
+    logger, handler = make_logger("test.summary")
+    summary = SessionLogSummary("abc")
+    summary.messages_received = 3
+    summary.bytes_received = 2048
+    summary.log(logger)
+    assert len(handler.records) == 1
+    assert "セッション abc を終了: 受信 3 メッセージ / 2048 バイト" in handler.records[0].getMessage()
@@ -0,0 +1,75 @@
+import asyncio
+import time
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from fastapi.testclient import TestClient
+from app.loop_monitor import BlockingCallError, LoopMonitor
+
+@pytest.mark.asyncio
+async def test_detects_blocking_call():
+    """ブロッキング呼び出しがスタック付きで検出されることのテスト"""
+    monitor = LoopMonitor(interval=0.01, threshold=0.05)
+    monitor.start()
+    await asyncio.sleep(0.05)
+
+    def blocking_function():
+        time.sleep(0.3)
+
+    blocking_function()
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+
+    assert len(monitor.blocking_events) == 1
+    event = monitor.blocking_events[0]
+    assert "blocking_function" in event.stack
+    assert event.duration >= 0.25
+    assert monitor.percentiles()["max_ms"] >= 250
+    with pytest.raises(BlockingCallError):
+        monitor.assert_no_blocking()
+
+@pytest.mark.asyncio
+async def test_slow_llm_does_not_block_loop(loop_monitor):
+    """LLMの同期呼び出しが遅くてもイベントループがブロックされないことのテスト"""
+    from app.main import TranscribeHandler
+
+    def slow_invoke(messages):
+        time.sleep(0.3)
+        return MagicMock(content="テストレスポンス")
+
+    llm = MagicMock()
+    llm.invoke = MagicMock(side_effect=slow_invoke)
+    websocket = AsyncMock()
+    handler = TranscribeHandler(AsyncMock(), websocket, llm)
+    await handler.process_with_llm("こんにちは")
+
+    websocket.send_text.assert_any_call("応答: <p>テストレスポンス</p>")
+    assert loop_monitor.percentiles()["samples"] > 0
+
+def test_diagnostics_endpoint():
+    """/diagnosticsエンドポイントのテスト"""
+    from app.main import app
+    with TestClient(app) as client:
+        response = client.get("/diagnostics")
+    assert response.status_code == 200
+    report = response.json()["event_loop"]
+    assert report["running"] is True
+    assert "lag" in report
+
+def test_stopped_loop_is_not_reported_as_blocking():
+    """イベントループが停止している間（run_until_complete の合間）はブロッキングとみなさないことのテスト"""
+    loop = asyncio.new_event_loop()
+    monitor = LoopMonitor(interval=0.01, threshold=0.05)
+
+    async def start():
+        monitor.start()
+        await asyncio.sleep(0.02)
+
+    try:
+        loop.run_until_complete(start())
+        # ループを回していない間に閾値を超える時間が経過する
+        time.sleep(0.3)
+        loop.run_until_complete(asyncio.sleep(0.02))
+        loop.run_until_complete(monitor.stop())
+    finally:
+        loop.close()
+    assert not monitor.blocking_events
@@ -0,0 +1,54 @@
+from fastapi.testclient import TestClient
+from app.main import app
+from app.metrics import Counter, Gauge, Histogram, Registry
+
+client = TestClient(app)
+
+def test_histogram_exposition():
+    """ヒストグラムがPrometheus形式で出力されることのテスト"""
+    registry = Registry()
+    histogram = registry.histogram("test_seconds", "テスト", ("path",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, path="chat")
+    histogram.observe(0.5, path="chat")
+    histogram.observe(5.0, path="chat")
+
+    text = registry.render()
+    assert "# TYPE test_seconds histogram" in text
+    assert 'test_seconds_bucket{path="chat",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{path="chat",le="1"} 2' in text
+    assert 'test_seconds_bucket{path="chat",le="+Inf"} 3' in text
+    assert 'test_seconds_count{path="chat"} 3' in text
+    assert "process_cpu_seconds_total" in text
+
+def test_counter_and_gauge():
+    """カウンタとゲージの値のテスト"""
+    counter = Counter("requests_total", "テスト", ("route",))
+    counter.inc(route="/chat")
+    counter.inc(2, route="/chat")
+    assert counter.value(route="/chat") == 3
+
+    gauge = Gauge("sessions", "テスト")
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    assert gauge.value() == 1
+    assert "sessions 1" in gauge.render()
+
+def test_label_mismatch():
+    """ラベルが一致しない場合にエラーとなることのテスト"""
+    histogram = Histogram("latency", "テスト", ("route",))
+    try:
+        histogram.observe(1.0, path="x")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("ValueErrorが発生していません")
+
+def test_metrics_endpoint():
+    """/metricsエンドポイントのテスト"""
+    client.get("/healthz")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_count{method="GET",route="/healthz",status="200"}' in response.text
+    assert "# TYPE transcribe_active_sessions gauge" in response.text
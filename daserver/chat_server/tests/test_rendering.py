@@ -0,0 +1,42 @@
+import pytest
+from markdown import markdown
+from app.rendering import MarkdownRenderer
+
+TEXT = "# 見出し\n\n| a | b |\n| --- | --- |\n| 1 | 2 |\n\n脚注[^1]\n\n[^1]: 注記\n"
+
+def test_matches_module_level_markdown():
+    """再利用したインスタンスでも従来と同じHTMLになることのテスト"""
+    renderer = MarkdownRenderer(cache_size=0)
+    expected = markdown(TEXT, extensions=['extra'])
+    # 2回目以降もresetされて同じ結果になる（脚注などの状態が残らない）
+    assert renderer.render_sync(TEXT) == expected
+    assert renderer.render_sync(TEXT) == expected
+    assert renderer._markdown() is renderer._markdown()
+
+def test_cache_is_bounded():
+    """キャッシュが上限件数を超えないことのテスト"""
+    renderer = MarkdownRenderer(cache_size=2)
+    for i in range(5):
+        renderer.render_sync(f"本文 {i}")
+    assert len(renderer._cache) == 2
+    assert renderer._cached(renderer.cache_key("本文 4")) == "<p>本文 4</p>"
+    assert renderer._cached(renderer.cache_key("本文 0")) is None
+
+@pytest.mark.asyncio
+async def test_render_runs_off_loop(loop_monitor):
+    """非同期変換がワーカースレッドで実行され、キャッシュされることのテスト"""
+    renderer = MarkdownRenderer()
+    calls = []
+    convert = renderer.convert
+
+    def tracking_convert(text):
+        import threading
+        calls.append(threading.current_thread().name)
+        return convert(text)
+
+    renderer.convert = tracking_convert
+    assert await renderer.render("**太字**") == "<p><strong>太字</strong></p>"
+    assert await renderer.render("**太字**") == "<p><strong>太字</strong></p>"
+    assert len(calls) == 1
+    assert calls[0].startswith("markdown")
+    renderer.shutdown()
@@ -0,0 +1,175 @@
+import asyncio
+import pytest
+from app.llm_gateway import LLMGateway, Priority
+from app.resilience import CircuitBreaker, CircuitOpenError, Hedger
+from app.stubs import StubChatModel
+
+async def fail():
+    raise RuntimeError("上流エラー")
+
+async def succeed():
+    return "ok"
+
+@pytest.mark.asyncio
+async def test_circuit_opens_after_consecutive_failures():
+    """連続した失敗でブレーカーが開き、上流を呼ばずに失敗することのテスト"""
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            await breaker.call(fail)
+    assert breaker.state == "open"
+
+    called = []
+    async def upstream():
+        called.append(True)
+        return "ok"
+    with pytest.raises(CircuitOpenError) as exc_info:
+        await breaker.call(upstream)
+    assert not called
+    assert "一時的に利用できません" in str(exc_info.value)
+    assert exc_info.value.retry_after_seconds >= 1
+
+@pytest.mark.asyncio
+async def test_circuit_half_open_trial():
+    """待機時間の経過後は試行1件で閉じるか再び開くかが決まることのテスト"""
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    with pytest.raises(RuntimeError):
+        await breaker.call(fail)
+    assert breaker.state == "half_open"
+    with pytest.raises(RuntimeError):
+        await breaker.call(fail)
+
+    assert await breaker.call(succeed) == "ok"
+    assert breaker.state == "closed"
+
+@pytest.mark.asyncio
+async def test_ignored_errors_do_not_open_circuit():
+    """ignore に指定した例外は障害として数えないことのテスト"""
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    with pytest.raises(RuntimeError):
+        await breaker.call(fail, ignore=(RuntimeError,))
+    assert breaker.state == "closed"
+
+@pytest.mark.asyncio
+async def test_hedge_takes_faster_response():
+    """応答が遅い場合に2本目を発行し、先に完了した結果を使うことのテスト"""
+    hedger = Hedger("test", enabled=True, initial_delay=0.05, budget=1.0)
+    delays = [1.0, 0.01]
+
+    async def call():
+        delay = delays.pop(0)
+        await asyncio.sleep(delay)
+        return delay
+
+    assert await hedger.run(call) == 0.01
+    assert delays == []
+
+@pytest.mark.asyncio
+async def test_hedge_budget_limits_extra_requests():
+    """予算を使い切るとヘッジを発行しないことのテスト"""
+    hedger = Hedger("test", enabled=True, initial_delay=0.01, budget=0.5)
+    calls = []
+
+    async def call():
+        calls.append(True)
+        await asyncio.sleep(0.03)
+        return "ok"
+
+    await hedger.run(call)
+    assert len(calls) == 1
+    await hedger.run(call)
+    assert len(calls) == 3
+
+def test_hedge_delay_uses_percentile():
+    """十分な計測値がある場合はパーセンタイルを待ち時間に使うことのテスト"""
+    hedger = Hedger("test", enabled=True, percentile=0.9, min_delay=0.0,
+                    initial_delay=9.0, min_samples=10)
+    assert hedger.delay() == 9.0
+    for i in range(1, 11):
+        hedger.latency.observe(i / 10)
+    assert hedger.delay() == 1.0
+
+class FirstCallSlowStub(StubChatModel):
+    """最初の呼び出しだけ遅いスタブLLM"""
+    def invoke(self, messages):
+        self.latency = self.slow_latency if self.calls == 0 else 0.01
+        return super().invoke(messages)
+
+@pytest.mark.asyncio
+async def test_gateway_hedges_slow_stub_backend(loop_monitor):
+    """スタブLLMの遅い応答がゲートウェイでヘッジされることのテスト"""
+    llm = FirstCallSlowStub(slow_latency=0.5)
+    hedger = Hedger("test", enabled=True, initial_delay=0.05, budget=1.0)
+    gateway = LLMGateway(concurrency=1, hedger=hedger)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    ai_msg = await gateway.submit(llm, [("human", "こんにちは")], Priority.TEXT, "a")
+    assert ai_msg.content == llm.reply
+    assert llm.calls == 2
+    assert loop.time() - started < 0.4
+
+@pytest.mark.asyncio
+async def test_transcribe_client_errors_do_not_open_circuit():
+    """Transcribeの4xxやクライアントの切断はブレーカーに数えず、5xxや接続エラーだけ数えることのテスト"""
+    from unittest.mock import AsyncMock, MagicMock, patch
+    from amazon_transcribe.exceptions import (BadRequestException,
+                                              ServiceUnavailableException,
+                                              UnknownServiceException)
+    from starlette.websockets import WebSocketDisconnect
+    from app.main import TranscribeHandler
+
+    async def failing_stream(error):
+        raise error
+        yield
+
+    async def run(error):
+        handler = TranscribeHandler(failing_stream(error), AsyncMock(), MagicMock())
+        await handler.handle_events()
+        assert not handler.websocket_open
+
+    breaker = CircuitBreaker("transcribe", failure_threshold=1, reset_timeout=60)
+    with patch("app.main.transcribe_breaker", breaker):
+        # 15秒間音声が届かなかった場合など
+        await run(BadRequestException("Your request timed out because no new audio was received"))
+        await run(UnknownServiceException(403, "AccessDenied", "forbidden"))
+        await run(WebSocketDisconnect(1001))
+        assert breaker.state == "closed"
+        await run(ServiceUnavailableException("Service unavailable"))
+        assert breaker.state == "open"
+
+    breaker = CircuitBreaker("transcribe", failure_threshold=1, reset_timeout=60)
+    with patch("app.main.transcribe_breaker", breaker):
+        await run(ConnectionResetError())
+        assert breaker.state == "open"
+
+@pytest.mark.asyncio
+async def test_bedrock_request_errors_do_not_open_circuit():
+    """Bedrockの ValidationException などリクエスト固有のエラーはブレーカーに数えないことのテスト"""
+    from unittest.mock import MagicMock, patch
+    from botocore.exceptions import ClientError, ReadTimeoutError
+    from app.main import invoke_llm
+
+    def client_error(code, status):
+        return ClientError({"Error": {"Code": code, "Message": code},
+                            "ResponseMetadata": {"HTTPStatusCode": status}}, "InvokeModel")
+
+    async def run(error):
+        llm = MagicMock()
+        llm.invoke = MagicMock(side_effect=error)
+        with pytest.raises(type(error)):
+            await invoke_llm(llm, [("human", "質問")], "chat")
+
+    breaker = CircuitBreaker("bedrock", failure_threshold=1, reset_timeout=60)
+    with patch("app.main.bedrock_breaker", breaker):
+        await run(client_error("ValidationException", 400))
+        await run(client_error("AccessDeniedException", 403))
+        await run(ValueError("応答を解析できません"))
+        assert breaker.state == "closed"
+        await run(client_error("ThrottlingException", 429))
+        assert breaker.state == "open"
+
+    breaker = CircuitBreaker("bedrock", failure_threshold=1, reset_timeout=60)
+    with patch("app.main.bedrock_breaker", breaker):
+        await run(ReadTimeoutError(endpoint_url="https://bedrock"))
+        assert breaker.state == "open"
@@ -0,0 +1,96 @@
+import json
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from app import metrics
+from app.routing import FAST, STANDARD, ModelRouter, RoutingRule
+
+def test_short_prompt_routes_to_fast_tier():
+    """短く単純な問い合わせが fast に振り分けられることのテスト"""
+    router = ModelRouter(enabled=True, short_chars=60, log_path="")
+    assert router.classify("こんにちは") == (FAST, "short")
+    assert router.classify("今日の天気は？") == (FAST, "short")
+
+def test_complex_prompt_routes_to_standard_tier():
+    """複雑な問い合わせが standard に振り分けられることのテスト"""
+    router = ModelRouter(enabled=True, short_chars=60, log_path="")
+    assert router.classify("TCPとUDPの違いは？") == (STANDARD, "keyword")
+    assert router.classify("これは何？あれは何？") == (STANDARD, "multi_question")
+    assert router.classify("```python\nprint(1)\n```") == (STANDARD, "structure")
+    assert router.classify("あ" * 61) == (STANDARD, "long")
+
+def test_rules_take_precedence():
+    """ルール表がヒューリスティックより優先されることのテスト"""
+    rules = [
+        RoutingRule(STANDARD, pattern="見積"),
+        RoutingRule(FAST, path="voice", max_chars=100),
+    ]
+    router = ModelRouter(rules=rules, enabled=True, short_chars=60, log_path="")
+    assert router.classify("見積") == (STANDARD, "rule:0")
+    assert router.classify("なぜ空は青いのか説明して", path="voice") == (FAST, "rule:1")
+    assert router.classify("なぜ空は青いのか説明して", path="chat") == (STANDARD, "keyword")
+
+def test_from_env_loads_rule_table(tmp_path, monkeypatch):
+    """ROUTING_RULES_PATH のルール表とティア設定が読み込まれることのテスト"""
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({
+        "short_chars": 5,
+        "tiers": {FAST: {"model_id": "custom-fast", "input_cost": 0.001}},
+        "rules": [{"tier": FAST, "pattern": "^ping$"}],
+    }), encoding="utf-8")
+    monkeypatch.setenv("ROUTING_RULES_PATH", str(path))
+    router = ModelRouter.from_env()
+    assert router.short_chars == 5
+    assert router.tiers[FAST].model_id == "custom-fast"
+    assert router.tiers[FAST].input_cost == 0.001
+    assert router.tiers[STANDARD].model_id.startswith("anthropic.claude-3-sonnet")
+    assert router.classify("ping") == (FAST, "rule:0")
+    assert router.classify("こんにちは。") == (STANDARD, "long")
+
+def test_llm_for_creates_client_per_tier():
+    """ティアごとにクライアントを1度だけ作成し、standard は既存のクライアントを使うことのテスト"""
+    created = []
+    def factory(tier):
+        created.append(tier.name)
+        return MagicMock(name=tier.name)
+    router = ModelRouter(factory, enabled=True, log_path="")
+    default_llm = MagicMock()
+    assert router.llm_for(STANDARD, default_llm) is default_llm
+    fast = router.llm_for(FAST, default_llm)
+    assert router.llm_for(FAST, default_llm) is fast
+    assert created == [FAST]
+
+def test_record_writes_decision_log(tmp_path):
+    """所要時間・トークン数・コストが記録されることのテスト"""
+    path = tmp_path / "routing.jsonl"
+    router = ModelRouter(enabled=True, log_path=str(path))
+    decision = router.route("こんにちは", "chat")
+    ai_msg = MagicMock(content="こんにちは！",
+                       usage_metadata={"input_tokens": 1000, "output_tokens": 1000})
+    cost_before = metrics.LLM_TIER_COST.value(tier=FAST)
+    router.record(decision, 0.2, [("human", "こんにちは")], ai_msg)
+    router.decision_log.stop()
+
+    record = json.loads(path.read_text(encoding="utf-8").strip())
+    assert record["tier"] == FAST
+    assert record["reason"] == "short"
+    assert record["input_tokens"] == 1000
+    assert record["cost_usd"] == pytest.approx(0.0015)
+    assert "こんにちは" not in json.dumps(record, ensure_ascii=False)
+    assert metrics.LLM_TIER_COST.value(tier=FAST) - cost_before == pytest.approx(0.0015)
+
+@pytest.mark.asyncio
+async def test_handler_uses_routed_llm():
+    """ルーターを渡したTranscribeHandlerが振り分け先のLLMを使うことのテスト"""
+    from app import main as server
+    fast_llm = MagicMock()
+    fast_llm.invoke = MagicMock(return_value=MagicMock(content="高速な応答"))
+    default_llm = MagicMock()
+    router = ModelRouter(lambda tier: fast_llm, enabled=True, log_path="")
+
+    websocket = AsyncMock()
+    handler = server.TranscribeHandler(AsyncMock(), websocket, default_llm, router=router)
+    await handler.process_with_llm("こんにちは")
+
+    fast_llm.invoke.assert_called_once()
+    default_llm.invoke.assert_not_called()
+    websocket.send_text.assert_called_with("応答: <p>高速な応答</p>")
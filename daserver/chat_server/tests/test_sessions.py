@@ -0,0 +1,173 @@
+import asyncio
+import json
+import time
+import pytest
+from unittest.mock import MagicMock, patch
+from app.sessions import SessionStore, estimate_tokens
+
+def test_estimate_tokens():
+    """日本語は1文字1トークン、ASCIIは4文字1トークンで概算することのテスト"""
+    assert estimate_tokens("こんにちは") == 5
+    assert estimate_tokens("hello world!") == 3
+    assert estimate_tokens("") == 0
+
+def test_context_window_stays_within_budget():
+    """会話が長くなってもプロンプトがトークン予算に収まることのテスト"""
+    store = SessionStore(token_budget=100, max_turns=1000)
+    conversation = store.get("s1")
+    for i in range(200):
+        store.record(conversation, f"質問{i:03d}" * 2, f"回答{i:03d}" * 2)
+
+    messages = store.build_messages(conversation, "システム", "最後の質問")
+    total = sum(estimate_tokens(content) for _, content in messages)
+    assert total <= 100
+    assert messages[0] == ("system", "システム")
+    assert messages[-1] == ("human", "最後の質問")
+    # 直近の発言から順に含まれる
+    assert messages[-2] == ("ai", "回答199回答199")
+    assert len(conversation.turns) == 400
+
+def test_max_turns_bounds_memory():
+    """保持する発言数が上限を超えないことのテスト"""
+    store = SessionStore(token_budget=100, max_turns=10)
+    conversation = store.get("s1")
+    for i in range(20):
+        store.record(conversation, f"質問{i}", f"回答{i}")
+    assert len(conversation.turns) == 10
+    assert conversation.turns[-1].content == "回答19"
+
+def test_lru_eviction():
+    """上限を超えると最も使われていないセッションから破棄されることのテスト"""
+    store = SessionStore(max_sessions=2, idle_timeout=3600)
+    store.get("a")
+    store.get("b")
+    store.get("a")
+    store.get("c")
+    assert len(store) == 2
+    assert "b" not in store._sessions
+    assert set(store._sessions) == {"a", "c"}
+
+def test_idle_sessions_are_evicted():
+    """未使用時間を超えたセッションが破棄されることのテスト"""
+    store = SessionStore(max_sessions=10, idle_timeout=0.01)
+    store.get("a")
+    time.sleep(0.02)
+    store.get("b")
+    assert set(store._sessions) == {"b"}
+
+@pytest.mark.asyncio
+async def test_background_summary_replaces_old_turns():
+    """予算を超えた古い発言がバックグラウンドで要約に置き換えられることのテスト"""
+    summarized = []
+
+    async def summarizer(previous, turns):
+        summarized.append([t.content for t in turns])
+        return "ユーザーの名前は田中。"
+
+    store = SessionStore(token_budget=40, max_turns=100, summarizer=summarizer)
+    conversation = store.get("s1")
+    store.record(conversation, "私の名前は田中です。覚えてください。", "はい、田中さんですね。覚えました。")
+    store.record(conversation, "好きな食べ物は寿司です。", "寿司がお好きなんですね。")
+    await store.wait_for_summaries()
+    conversation = store.get("s1")
+
+    assert summarized and summarized[0][0] == "私の名前は田中です。覚えてください。"
+    assert conversation.summary == "ユーザーの名前は田中。"
+    assert conversation.turns[0].content != "私の名前は田中です。覚えてください。"
+    messages = store.build_messages(conversation, "システム", "私の名前は？")
+    assert "ユーザーの名前は田中。" in messages[0][1]
+
+@pytest.mark.asyncio
+async def test_chat_continues_session(chat_client):
+    """/chat が session_id で前の会話をコンテキストに含めることのテスト"""
+    llm = MagicMock()
+    llm.invoke = MagicMock(side_effect=[
+        MagicMock(content="承知しました。"), MagicMock(content="田中さんです。"),
+    ])
+    with patch("app.main.llm", llm), patch("app.main.model_router.enabled", False):
+        first = await chat_client.post("/chat", json={"message": "私の名前は田中です。"})
+        session_id = first.json()["session_id"]
+        second = await chat_client.post("/chat", json={"message": "私の名前は？",
+                                                       "session_id": session_id})
+
+    assert second.status_code == 200
+    assert second.json()["session_id"] == session_id
+    messages = llm.invoke.call_args_list[1].args[0]
+    assert ("human", "私の名前は田中です。") in messages
+    assert ("ai", "承知しました。") in messages
+    assert messages[-1] == ("human", "私の名前は？")
+
+def test_sessions_shared_through_sqlite_store(tmp_path):
+    """SQLiteの状態ストアを共有する別々のSessionStoreが同じ会話を続けられることのテスト"""
+    from app.state_store import SQLiteStore
+    path = str(tmp_path / "state.db")
+    worker1 = SessionStore(state=SQLiteStore(path))
+    worker2 = SessionStore(state=SQLiteStore(path))
+
+    worker1.record(worker1.get("s1"), "私の名前は田中です。", "承知しました。")
+    conversation = worker2.get("s1")
+    worker2.record(conversation, "私の名前は？", "田中さんです。")
+
+    assert [t.content for t in worker1.get("s1").turns] == [
+        "私の名前は田中です。", "承知しました。", "私の名前は？", "田中さんです。"]
+    assert [t.index for t in conversation.turns] == [0, 1, 2, 3]
+
+@pytest.mark.asyncio
+async def test_summary_scheduled_from_worker_thread(tmp_path, loop_monitor):
+    """共有ストアでワーカースレッドから記録した場合も要約が行われることのテスト"""
+    from app.main import run_state
+    from app.state_store import SQLiteStore
+
+    async def summarizer(previous, turns):
+        return "ユーザーの名前は田中。"
+
+    state = SQLiteStore(str(tmp_path / "state.db"))
+    store = SessionStore(token_budget=40, max_turns=100, summarizer=summarizer, state=state)
+    loop = asyncio.get_running_loop()
+    with patch("app.state_store.store", state):
+        conversation = await run_state(store.get, "s1")
+        await run_state(store.record, conversation,
+                        "私の名前は田中です。覚えてください。", "はい、田中さんですね。覚えました。", loop)
+        await run_state(store.record, conversation,
+                        "好きな食べ物は寿司です。", "寿司がお好きなんですね。", loop)
+        await store.wait_for_summaries()
+        conversation = await run_state(store.get, "s1")
+    assert conversation.summary == "ユーザーの名前は田中。"
+
+def test_voice_continues_session_across_connections(monkeypatch):
+    """録音ごとに接続し直しても session_id で音声とテキストの会話が続くことのテスト"""
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.stubs import StubChatModel
+    monkeypatch.setenv("TRANSCRIBE_BACKEND", "stub")
+    monkeypatch.setenv("STUB_TRANSCRIBE_SCRIPT", "私の名前は田中です")
+    monkeypatch.setenv("STUB_TRANSCRIBE_UTTERANCE_SECONDS", "0.1")
+    monkeypatch.setenv("STUB_TRANSCRIBE_LATENCY", "0")
+    monkeypatch.setenv("STUB_TRANSCRIBE_OPEN_LATENCY", "0")
+    chunk = b"\x00\x00" * 800
+
+    def record(client, path):
+        with client.websocket_connect(path) as ws:
+            config = json.loads(ws.receive_text()[len("設定:"):])
+            ws.send_bytes(chunk)
+            while not ws.receive_text().startswith("応答:"):
+                pass
+            ws.send_text("submit_response")
+        return config["session_id"]
+
+    store = SessionStore()
+    llm = MagicMock()
+    llm.invoke = MagicMock(return_value=MagicMock(content="田中さんです。"))
+    client = TestClient(app)
+    with patch("app.main.conversations", store), \
+            patch("app.main.llm", StubChatModel(latency=0)), \
+            patch("app.main.model_router.enabled", False):
+        session_id = record(client, "/TranscribeStreaming")
+        assert record(client, f"/TranscribeStreaming?session_id={session_id}") == session_id
+        # 接続を閉じても会話は残り、テキストでも続けられる
+        assert len(store.get(session_id).turns) == 4
+        with patch("app.main.llm", llm):
+            response = client.post("/chat", json={"message": "私の名前は？",
+                                                  "session_id": session_id})
+    assert response.json()["session_id"] == session_id
+    assert ("human", "私の名前は田中です") in llm.invoke.call_args.args[0]
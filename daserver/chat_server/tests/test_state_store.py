@@ -0,0 +1,141 @@
+import multiprocessing
+import sqlite3
+import time
+import pytest
+from app import metrics
+from app.admission import AdmissionController, AdmissionRejected
+from app.rendering import MarkdownRenderer
+from app.state_store import InProcessStore, SQLiteStore, create_store
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return InProcessStore()
+    return SQLiteStore(str(tmp_path / "state.db"))
+
+def test_get_set_update_delete(store):
+    """基本的な読み書きと、update() で None を返すと削除されることのテスト"""
+    ns = store.namespace("test")
+    assert ns.get("a") is None
+    ns.set("a", {"count": 1, "names": ["x"]})
+    assert ns.get("a") == {"count": 1, "names": ["x"]}
+    assert ns.update("a", lambda v: {**v, "count": v["count"] + 1})["count"] == 2
+    assert ns.update("b", lambda v: (v or 0) + 1) == 1
+    assert set(ns) == {"a", "b"}
+    ns.update("a", lambda v: None)
+    ns.delete("b")
+    assert len(ns) == 0
+    # 名前空間が異なれば同じキーでも別の値
+    store.namespace("other").set("a", 1)
+    assert ns.get("a") is None
+
+def test_capacity_evicts_least_recently_used(store):
+    """上限を超えると最も古いものから破棄されることのテスト"""
+    evicted = []
+    ns = store.namespace("lru", max_entries=2, on_evict=lambda reason, n: evicted.append(reason))
+    for key in ("a", "b", "a", "c"):
+        if ns.get(key) is None:
+            ns.set(key, key)
+        time.sleep(0.001)
+    ns.set("c", "c")
+    assert set(ns) == {"a", "c"}
+    assert evicted == ["capacity"]
+
+def test_ttl_expires_idle_entries(store):
+    """ttl のあいだ使われなかった値が期限切れになることのテスト"""
+    ns = store.namespace("ttl", ttl=0.05)
+    ns.set("a", 1)
+    time.sleep(0.1)
+    assert ns.get("a") is None
+    assert len(ns) == 0
+
+def test_sqlite_reads_do_not_take_write_lock(tmp_path):
+    """SQLiteの読み込みが書き込みロックを取らず、期限が近い値だけその場で延長することのテスト"""
+    path = str(tmp_path / "state.db")
+    ns = SQLiteStore(path, busy_timeout=0.05).namespace("read", ttl=0.3)
+    ns.set("a", 1)
+    writer = sqlite3.connect(path, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")
+    try:
+        # 他の接続が書き込み中でも待たずに読める
+        assert ns.get("a") == 1
+    finally:
+        writer.execute("ROLLBACK")
+        writer.close()
+
+    time.sleep(0.2)
+    assert ns.get("a") == 1
+    time.sleep(0.2)
+    # 最後の読み込みで期限が延長されている
+    assert ns.get("a") == 1
+
+def _increment(path: str, n: int) -> None:
+    ns = SQLiteStore(path).namespace("counter")
+    for _ in range(n):
+        ns.update("hits", lambda v: (v or 0) + 1)
+
+def test_sqlite_update_is_atomic_across_processes(tmp_path):
+    """複数のプロセスからの update() が失われないことのテスト"""
+    path = str(tmp_path / "state.db")
+    SQLiteStore(path)
+    ctx = multiprocessing.get_context("spawn")
+    workers = [ctx.Process(target=_increment, args=(path, 50)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+    assert SQLiteStore(path).namespace("counter").get("hits") == 200
+
+def test_rate_limit_shared_between_workers(tmp_path):
+    """共有ストアを使う2つのワーカーが同じクライアントのレート制限を共有することのテスト"""
+    path = str(tmp_path / "state.db")
+    worker1 = AdmissionController(client_rate=0.001, client_burst=2, state=SQLiteStore(path))
+    worker2 = AdmissionController(client_rate=0.001, client_burst=2, state=SQLiteStore(path))
+    worker1.check_rate("10.0.0.1", "chat")
+    worker2.check_rate("10.0.0.1", "chat")
+    with pytest.raises(AdmissionRejected):
+        worker1.check_rate("10.0.0.1", "chat")
+    worker2.check_rate("10.0.0.2", "chat")
+
+def test_markdown_cache_shared_between_workers(tmp_path):
+    """共有ストアのMarkdownキャッシュを別のワーカーが利用できることのテスト"""
+    path = str(tmp_path / "state.db")
+    MarkdownRenderer(state=SQLiteStore(path)).render_sync("**共有**")
+    worker2 = MarkdownRenderer(state=SQLiteStore(path))
+    worker2.convert = lambda text: pytest.fail("キャッシュが使われていません")
+    assert worker2.render_sync("**共有**") == "<p><strong>共有</strong></p>"
+
+def test_registry_merges_worker_snapshots():
+    """他のワーカーのスナップショットが合算されて出力されることのテスト"""
+    registry = metrics.Registry()
+    requests = registry.counter("requests_total", "リクエスト数", ("path",))
+    state = registry.gauge("breaker_state", "状態", merge="max")
+    latency = registry.histogram("latency_seconds", "レイテンシ", buckets=(0.1, 1.0))
+    requests.inc(2, path="/chat")
+    state.set(0)
+    latency.observe(0.05)
+    peer = {
+        "cpu": 1.5,
+        "metrics": {
+            "requests_total": [[["/chat"], 3], [["/metrics"], 1]],
+            "breaker_state": [[[], 2]],
+            "latency_seconds": [[[], [[0, 1, 0], 0.5, 1]]],
+        },
+    }
+    output = registry.render([peer])
+    assert 'requests_total{path="/chat"} 5' in output
+    assert 'requests_total{path="/metrics"} 1' in output
+    assert "breaker_state 2" in output
+    assert 'latency_seconds_bucket{le="1"} 2' in output
+    assert "latency_seconds_count 2" in output
+    # スナップショットはそのまま合算できる形式
+    assert registry.render([registry.export()]).count('requests_total{path="/chat"} 4') == 1
+
+def test_create_store_from_env(tmp_path, monkeypatch):
+    """STATE_STORE で実装を切り替えられることのテスト"""
+    monkeypatch.setenv("STATE_STORE", "sqlite")
+    monkeypatch.setenv("STATE_STORE_PATH", str(tmp_path / "state.db"))
+    assert create_store().shared
+    assert not create_store("memory").shared
+    with pytest.raises(ValueError):
+        create_store("redis")
@@ -0,0 +1,124 @@
+import asyncio
+import time
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+from unittest.mock import patch
+from app.streaming import StreamingSession, StreamingSessions
+from app.stubs import StubChatModel
+
+# 8kHz・16ビットのPCMで0.1秒分
+CHUNK = b"\x00\x00" * 800
+
+@pytest.mark.asyncio
+async def test_tracked_tasks_record_cpu_time_and_count():
+    """タスクのCPU時間と実行中のタスク数がセッションに記録されることのテスト"""
+    session = StreamingSession("s1", "127.0.0.1")
+
+    async def busy():
+        deadline = time.thread_time() + 0.02
+        while time.thread_time() < deadline:
+            pass
+        await asyncio.sleep(0)
+
+    task = asyncio.create_task(session.track(busy()))
+    blocked = asyncio.create_task(session.track(asyncio.sleep(10)))
+    await asyncio.sleep(0)
+    assert session.tasks == 2
+    await task
+    blocked.cancel()
+    await asyncio.gather(blocked, return_exceptions=True)
+    assert session.tasks == 0
+    assert session.cpu_seconds >= 0.02
+
+def test_limits_and_report():
+    """推定メモリと接続時間の上限の判定、一覧の出力のテスト"""
+    sessions = StreamingSessions(max_memory=1000, max_duration=3600)
+    small = sessions.open("small", "10.0.0.1")
+    large = sessions.open("large", "10.0.0.2")
+    small.buffer_audio(100)
+    large.buffer_audio(800)
+    large.add_transcript("あ" * 100)
+    assert sessions.check(small) is None
+    assert sessions.check(large) == "memory_limit"
+    large.release_audio(800, dropped=True)
+    assert large.audio_dropped == 800 and large.audio_buffered_peak == 800
+
+    report = sessions.report()
+    assert [s["session_id"] for s in report["sessions"]] == ["large", "small"]
+    sessions.close(small)
+    assert len(sessions) == 1
+    assert StreamingSessions(max_duration=0).remaining(large) is None
+
+def test_session_over_memory_cap_is_closed(monkeypatch):
+    """溜まった音声と未応答の認識テキストが上限を超えたセッションが1008で閉じられ、
+    応答済みの認識テキストは数えないことのテスト"""
+    from app.main import app
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    monkeypatch.setenv("TRANSCRIBE_BACKEND", "stub")
+    monkeypatch.setenv("STUB_TRANSCRIBE_UTTERANCE_SECONDS", "0.1")
+    monkeypatch.setenv("STUB_TRANSCRIBE_PARTIAL_INTERVAL", "0")
+    monkeypatch.setenv("STUB_TRANSCRIBE_LATENCY", "0")
+    monkeypatch.setenv("STUB_TRANSCRIBE_OPEN_LATENCY", "0")
+    # 受信した音声1チャンクは収まり、未応答の認識テキストが加わると超える上限
+    sessions = StreamingSessions(max_memory=len(CHUNK) + 30, max_duration=3600)
+
+    def listed():
+        report = client.get("/admin/sessions", headers={"X-Admin-Token": "secret"}).json()
+        assert report["count"] == 1
+        return report["sessions"][0]
+
+    def recognized():
+        while not ws.receive_text().startswith("認識テキスト:"):
+            pass
+
+    client = TestClient(app)
+    with patch("app.main.streaming_sessions", sessions), \
+            patch("app.main.llm", StubChatModel(latency=0.3)), \
+            patch("app.main.model_router.enabled", False):
+        with client.websocket_connect("/TranscribeStreaming") as ws:
+            ws.receive_text()
+            ws.send_bytes(CHUNK)
+            recognized()
+            # 応答するまでは認識テキストを保持する
+            assert listed()["transcript_bytes"] > 30
+            while not ws.receive_text().startswith("応答:"):
+                pass
+            assert listed()["transcript_bytes"] == 0
+            # 応答済みの認識テキストは数えないため、次の発話の音声も受け付ける
+            ws.send_bytes(CHUNK)
+            recognized()
+            assert listed()["bytes_in"] == 2 * len(CHUNK)
+            # 応答待ちの認識テキストに音声が加わると上限を超える
+            ws.send_bytes(CHUNK)
+            with pytest.raises(WebSocketDisconnect) as closed:
+                ws.receive_text()
+            assert closed.value.code == 1008
+            assert closed.value.reason == "memory_limit"
+    assert len(sessions) == 0
+
+def test_session_over_duration_cap_is_closed(monkeypatch):
+    """接続時間の上限を超えたセッションが音声を送っていなくても閉じられることのテスト"""
+    from app.main import app
+    monkeypatch.setenv("TRANSCRIBE_BACKEND", "stub")
+    monkeypatch.setenv("STUB_TRANSCRIBE_OPEN_LATENCY", "0")
+    sessions = StreamingSessions(max_duration=0.2)
+    with patch("app.main.streaming_sessions", sessions):
+        with TestClient(app).websocket_connect("/TranscribeStreaming") as ws:
+            ws.receive_text()
+            with pytest.raises(WebSocketDisconnect) as closed:
+                ws.receive_text()
+            assert closed.value.code == 1008
+            assert closed.value.reason == "duration_limit"
+    assert len(sessions) == 0
+
+def test_admin_sessions_requires_token(monkeypatch):
+    """ADMIN_TOKEN が未設定なら公開せず、設定した場合はトークンが必要なことのテスト"""
+    from app.main import app
+    client = TestClient(app)
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    assert client.get("/admin/sessions").status_code == 404
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    assert client.get("/admin/sessions").status_code == 403
+    assert client.get("/admin/sessions", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get("/admin/sessions", headers={"X-Admin-Token": "secret"}).status_code == 200
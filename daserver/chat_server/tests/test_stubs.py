@@ -0,0 +1,68 @@
+import json
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+from app.stubs import StubChatModel, StubTranscribeClient
+
+# 8kHz・16ビットのPCMで0.1秒分
+CHUNK = b"\x00\x00" * 800
+
+async def collect(stream):
+    events = []
+    async for event in stream.output_stream:
+        result = event.transcript.results[0]
+        events.append((result.is_partial, result.alternatives[0].transcript))
+    return events
+
+@pytest.mark.asyncio
+async def test_stub_transcribe_emits_partial_and_final_results(loop_monitor):
+    """音声の長さに応じて部分結果と確定結果が台本どおりに返ることのテスト"""
+    client = StubTranscribeClient(script=["こんにちは", "さようなら"], utterance_seconds=1.0,
+                                  partial_interval=0.5, latency=0.01, open_latency=0)
+    stream = await client.start_stream_transcription(
+        language_code="ja-JP", media_sample_rate_hz=8000, media_encoding="pcm")
+    for _ in range(16):
+        await stream.input_stream.send_audio_event(audio_chunk=CHUNK)
+    await stream.input_stream.end_stream()
+
+    assert await collect(stream) == [
+        (True, "こん"), (False, "こんにちは"),
+        (True, "さよ"), (False, "さようなら"),
+    ]
+
+@pytest.mark.asyncio
+async def test_stub_transcribe_drops_short_tail(loop_monitor):
+    """部分結果の間隔に満たない残りの音声は確定させないことのテスト"""
+    client = StubTranscribeClient(script=["はい"], utterance_seconds=1.0,
+                                  partial_interval=0.5, latency=0, open_latency=0)
+    stream = await client.start_stream_transcription(media_sample_rate_hz=8000)
+    for _ in range(12):
+        await stream.input_stream.send_audio_event(audio_chunk=CHUNK)
+    await stream.input_stream.end_stream()
+    assert await collect(stream) == [(True, "は"), (False, "はい")]
+
+def test_voice_pipeline_runs_offline(monkeypatch):
+    """TRANSCRIBE_BACKEND=stub で音声セッション全体がAWSなしで動くことのテスト"""
+    from app.main import app
+    monkeypatch.setenv("TRANSCRIBE_BACKEND", "stub")
+    monkeypatch.setenv("STUB_TRANSCRIBE_SCRIPT", "今日の予定を教えてください")
+    monkeypatch.setenv("STUB_TRANSCRIBE_UTTERANCE_SECONDS", "1")
+    monkeypatch.setenv("STUB_TRANSCRIBE_LATENCY", "0")
+    monkeypatch.setenv("STUB_TRANSCRIBE_OPEN_LATENCY", "0")
+
+    received = []
+    with patch("app.main.llm", StubChatModel(latency=0)), \
+            patch("app.main.model_router.enabled", False):
+        with TestClient(app).websocket_connect("/TranscribeStreaming") as ws:
+            for _ in range(10):
+                ws.send_bytes(CHUNK)
+            # submit_response の時点でキューに残っている音声は送られないため、応答を待ってから終える
+            while not any(m.startswith("応答:") for m in received):
+                received.append(ws.receive_text())
+            ws.send_text("submit_response")
+
+    # 接続直後に音声形式が通知される
+    assert received[0].startswith("設定: ")
+    assert json.loads(received[0][len("設定: "):])["sample_rate"] == 8000
+    assert "認識テキスト: 今日の予定を教えてください" in received
+    assert "応答: <p>スタブの応答です。</p>" in received
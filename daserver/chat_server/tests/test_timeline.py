@@ -0,0 +1,73 @@
+import json
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from app.timeline import TimelineRecorder, UtteranceTimeline, main, summarize
+
+def make_record(**marks):
+    return {"session_id": "s", "utterance": 1, "started_at": 0, "marks_ms": marks}
+
+def test_recorder_writes_jsonl(tmp_path):
+    """タイムラインがJSONLファイルに書き出されることのテスト"""
+    path = tmp_path / "timeline.jsonl"
+    recorder = TimelineRecorder(str(path))
+    timeline = UtteranceTimeline("session-1", 1)
+    timeline.mark("first_audio")
+    timeline.mark("final_transcript")
+    timeline.mark("first_audio")  # 2回目は無視される
+    recorder.record(timeline)
+    recorder.stop()
+
+    records = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert len(records) == 1
+    assert records[0]["session_id"] == "session-1"
+    assert list(records[0]["marks_ms"]) == ["first_audio", "final_transcript"]
+
+def test_summarize_flags_slowest_stage():
+    """パーセンタイル集計と最も遅いステップの検出のテスト"""
+    records = [
+        make_record(first_audio=0, audio_sent=10, final_transcript=300,
+                    llm_request=301, first_token=2000, llm_complete=2000, reply_sent=2005)
+        for _ in range(10)
+    ]
+    summary = summarize(records)
+    assert summary["utterances"] == 10
+    assert summary["slowest_stage"] == "first_token"
+    assert summary["stages"]["final_transcript"]["p50"] == pytest.approx(290)
+    assert summary["stages"]["total"]["p99"] == pytest.approx(2005)
+
+def test_cli_json_output(tmp_path, capsys):
+    """CLIのJSON出力のテスト"""
+    path = tmp_path / "timeline.jsonl"
+    path.write_text(
+        json.dumps(make_record(first_audio=0, audio_sent=5, final_transcript=50)) + "\n",
+        encoding="utf-8",
+    )
+    assert main([str(path), "--json"]) == 0
+    summary = json.loads(capsys.readouterr().out)
+    assert summary["slowest_stage"] == "final_transcript"
+
+@pytest.mark.asyncio
+async def test_handler_records_timeline(monkeypatch):
+    """TranscribeHandlerが発話ごとのタイムラインを記録することのテスト"""
+    from app import main as server
+    recorded = []
+    monkeypatch.setattr(server.timeline_recorder, "record", recorded.append)
+
+    llm = MagicMock()
+    llm.invoke = MagicMock(return_value=MagicMock(content="テストレスポンス"))
+    handler = server.TranscribeHandler(AsyncMock(), AsyncMock(), llm)
+    handler.timeline.mark("first_audio")
+
+    alt = MagicMock()
+    alt.transcript = "こんにちは"
+    result = MagicMock(is_partial=False, alternatives=[alt])
+    event = MagicMock()
+    event.transcript.results = [result]
+    await handler.handle_transcript_event(event)
+
+    assert len(recorded) == 1
+    assert set(recorded[0].marks) == {
+        "first_audio", "final_transcript", "llm_request",
+        "first_token", "llm_complete", "reply_sent",
+    }
+    assert handler.timeline.index == 2
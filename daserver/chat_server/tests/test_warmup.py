@@ -0,0 +1,68 @@
+import asyncio
+import time
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+from app.warmup import Warmup
+
+@pytest.mark.asyncio
+async def test_components_warm_up_in_parallel(loop_monitor):
+    """コンポーネントが並列にウォームアップされ、所要時間が記録されることのテスト"""
+    warmup = Warmup(enabled=True, timeout=1, retry_interval=0.01)
+    for name in ("a", "b", "c"):
+        warmup.add(name, lambda: asyncio.sleep(0.1))
+    assert not warmup.ready
+
+    started = time.perf_counter()
+    await warmup.run()
+    assert time.perf_counter() - started < 0.25
+    assert warmup.ready
+    report = warmup.report()
+    assert report["status"] == "ready"
+    assert all(c["state"] == "ready" and c["duration_ms"] >= 100
+               for c in report["components"].values())
+
+@pytest.mark.asyncio
+async def test_failed_component_is_retried(loop_monitor):
+    """失敗・タイムアウトしたコンポーネントはやり直し、完了するまで準備完了にならないことのテスト"""
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RuntimeError("認証情報がまだありません")
+
+    warmup = Warmup(enabled=True, timeout=0.05, retry_interval=0.01, optional="slow")
+    warmup.add("flaky", flaky)
+    # 準備完了の判定に含めないコンポーネントは時間がかかっても待たない
+    warmup.add("slow", lambda: asyncio.sleep(10))
+    task = asyncio.create_task(warmup.run())
+    while not warmup.ready:
+        await asyncio.sleep(0.01)
+    assert len(attempts) == 3
+    report = warmup.report()["components"]
+    assert report["flaky"]["attempts"] == 3 and report["flaky"]["error"] is None
+    assert report["slow"]["state"] != "ready" and not report["slow"]["required"]
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+def test_readyz_reports_not_ready_until_warm():
+    """/readyz がウォームアップの完了まで503を返し、/healthz は常に200を返すことのテスト"""
+    from app.main import app
+    release = asyncio.Event()
+    warmup = Warmup(enabled=True, timeout=5, retry_interval=1)
+    warmup.add("backend", release.wait)
+
+    with patch("app.main.warmup", warmup), TestClient(app) as client:
+        response = client.get("/readyz")
+        assert response.status_code == 503
+        assert response.json()["components"]["backend"]["state"] == "warming"
+        assert client.get("/healthz").status_code == 200
+
+        client.portal.call(release.set)
+        deadline = time.monotonic() + 5
+        while client.get("/readyz").status_code != 200 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        response = client.get("/readyz")
+        assert response.status_code == 200
+        assert response.json()["status"] == "ready"
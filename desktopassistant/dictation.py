@@ -0,0 +1,267 @@
+import json
+import logging
+import os
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# サーバーの音声ストリーミングが想定するサンプリングレート
+SERVER_SAMPLE_RATE = 8000
+# フォールバック後、サーバーが接続を閉じるまで操作の依頼を待つ秒数
+DRAIN_TIMEOUT = 1.0
+
+
+def downsample_pcm16(data: bytes, factor: int = 2) -> bytes:
+    """16ビットリトルエンディアンPCMを factor 分の1に間引く（隣接サンプルの平均）"""
+    samples = array("h")
+    samples.frombytes(data[:len(data) - len(data) % 2])
+    out = array("h", (
+        sum(samples[i:i + factor]) // factor
+        for i in range(0, len(samples) - factor + 1, factor)
+    ))
+    return out.tobytes()
+
+
+def split_after_wake_word(result: dict, wake_word: str) -> Tuple[str, List[dict]]:
+    """Voskの認識結果からウェイクワード以降のテキストと単語情報を取り出す
+
+    Returns:
+        Tuple[str, List[dict]]: ウェイクワード以降のテキストと単語ごとの信頼度情報
+    """
+    words = result.get("result") or []
+    for index, word in enumerate(words):
+        if wake_word in word.get("word", ""):
+            rest = words[index + 1:]
+            return " ".join(w["word"] for w in rest), rest
+
+    # 単語情報がない場合はテキストのみで分割する
+    text = result.get("text", "")
+    _, _, rest_text = text.partition(wake_word)
+    return rest_text.strip(), []
+
+
+def mean_confidence(words: List[dict]) -> float:
+    """単語ごとの信頼度の平均（単語情報がない場合は0）"""
+    if not words:
+        return 0.0
+    return sum(w.get("conf", 0.0) for w in words) / len(words)
+
+
+class ChatClient:
+    """チャットサーバーとの通信クライアント"""
+
+    def __init__(self, base_url: Optional[str] = None, timeout: float = 30.0,
+                 transcript_timeout: Optional[float] = None):
+        """
+        Args:
+            base_url: サーバーのURL（省略時は CHAT_API_URL）
+            timeout: 応答を待つ秒数
+            transcript_timeout: フォールバック時に音声を送り終えてから認識テキストを
+                待つ秒数（DICTATION_FALLBACK_TIMEOUT、デフォルト5）。無音などで
+                認識されなかった場合はこの時間で諦める
+        """
+        self.base_url = (
+            base_url or os.getenv("CHAT_API_URL", "http://127.0.0.1:8000")
+        ).rstrip("/")
+        self.timeout = timeout
+        self.transcript_timeout = (
+            transcript_timeout if transcript_timeout is not None
+            else float(os.getenv("DICTATION_FALLBACK_TIMEOUT", "5"))
+        )
+        # サーバー側の会話セッション（続けて話しかけたときに文脈を保つ）
+        self.session_id: Optional[str] = None
+
+    def send_text(self, text: str) -> Tuple[str, Optional[str]]:
+        """確定したテキストを /chat に送信し、応答（HTML）と依頼された操作を返す"""
+        res = requests.post(
+            f"{self.base_url}/chat",
+            json={"message": text, "session_id": self.session_id},
+            timeout=self.timeout,
+        )
+        res.raise_for_status()
+        data = res.json()
+        self.session_id = data.get("session_id") or self.session_id
+        return data["response"], data.get("action")
+
+    def transcribe_audio(self, pcm_16k: bytes) -> Tuple[str, str, Optional[str]]:
+        """サーバー側の音声認識にフォールバックする
+
+        16kHzのPCMをサーバーが接続直後に通知するサンプリングレート（通常8kHz）に
+        変換して /TranscribeStreaming に送信し、認識テキストと応答、依頼された操作を返す。
+        transcript_timeout 秒以内に認識テキストが届かない場合は空の結果を返す。
+        """
+        import websocket  # websocket-client（フォールバック時のみ使用）
+
+        ws_url = self.base_url.replace("http", "ws", 1) + "/TranscribeStreaming"
+        if self.session_id:
+            # テキストで送った発話と同じ会話を続ける
+            ws_url += "?" + urlencode({"session_id": self.session_id})
+        transcript, reply, action = "", "", None
+        ws = websocket.create_connection(ws_url, timeout=self.timeout)
+        try:
+            sample_rate = SERVER_SAMPLE_RATE
+            message = ws.recv()
+            if isinstance(message, str) and message.startswith("設定:"):
+                config = json.loads(message[len("設定:"):])
+                sample_rate = config["sample_rate"]
+                self.session_id = config.get("session_id") or self.session_id
+            pcm = downsample_pcm16(pcm_16k, max(1, 16000 // sample_rate))
+            # 発話の終端を検出させるため末尾に1秒の無音を付加する
+            pcm += bytes(sample_rate * 2)
+            frame = sample_rate * 2 // 25  # 40ms
+            for i in range(0, len(pcm), frame):
+                ws.send_binary(pcm[i:i + frame])
+            # 認識テキストが届くまでは transcript_timeout、届いてからは timeout まで待つ
+            deadline = time.monotonic() + self.transcript_timeout
+            while not reply:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                ws.settimeout(remaining)
+                try:
+                    message = ws.recv()
+                except websocket.WebSocketTimeoutException:
+                    break
+                if not isinstance(message, str):
+                    continue
+                if message.startswith("認識テキスト:"):
+                    transcript = message[len("認識テキスト:"):].strip()
+                    deadline = time.monotonic() + self.timeout
+                elif message.startswith("応答:"):
+                    reply = message[len("応答:"):].strip()
+                elif message.startswith("操作:"):
+                    action = message[len("操作:"):].strip()
+                elif message.startswith(("LLM処理エラー:", "エラーが発生しました:")):
+                    reply = message
+            ws.send("submit_response")
+            # 操作の依頼は応答の直後に届くため、サーバーが接続を閉じるまで読む
+            ws.settimeout(DRAIN_TIMEOUT)
+            try:
+                while True:
+                    message = ws.recv()
+                    if not message:
+                        break
+                    if isinstance(message, str) and message.startswith("操作:"):
+                        action = message[len("操作:"):].strip()
+            except websocket.WebSocketException:
+                pass
+        finally:
+            ws.close()
+        return transcript, reply, action
+
+
+class Dictation:
+    """ウェイクワード後の発話をローカルで認識し、テキストだけをサーバーに送る
+
+    認識の信頼度が min_confidence 未満の場合は、録音した音声をサーバーへ
+    送信してサーバー側の音声認識にフォールバックする。
+    """
+
+    def __init__(
+        self,
+        client: Optional[ChatClient] = None,
+        min_confidence: Optional[float] = None,
+        timeout: Optional[float] = None,
+        on_partial: Optional[Callable[[str], None]] = None,
+        on_result: Optional[Callable[[str, str], None]] = None,
+        on_action: Optional[Callable[[str], None]] = None,
+    ):
+        """
+        Args:
+            client: サーバー通信クライアント
+            min_confidence: ローカル認識を採用する最小信頼度（DICTATION_MIN_CONFIDENCE）
+            timeout: ウェイクワード後に発話を待つ秒数（DICTATION_TIMEOUT）
+            on_partial: 部分認識結果のコールバック
+            on_result: (認識テキスト, 応答HTML) のコールバック
+            on_action: サーバーが依頼した操作（例: close_window）のコールバック
+        """
+        self.client = client or ChatClient()
+        self.min_confidence = (
+            min_confidence if min_confidence is not None
+            else float(os.getenv("DICTATION_MIN_CONFIDENCE", "0.75"))
+        )
+        self.timeout = (
+            timeout if timeout is not None
+            else float(os.getenv("DICTATION_TIMEOUT", "8"))
+        )
+        self.on_partial = on_partial
+        self.on_result = on_result
+        self.on_action = on_action
+        self._audio = bytearray()
+        self._started_at: Optional[float] = None
+        self._last_partial = ""
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    @property
+    def active(self) -> bool:
+        return self._started_at is not None
+
+    def begin(self) -> None:
+        """ウェイクワード検出後にディクテーションを開始"""
+        self._audio = bytearray()
+        self._last_partial = ""
+        self._started_at = time.monotonic()
+
+    def cancel(self) -> None:
+        self._started_at = None
+        self._audio = bytearray()
+
+    def timed_out(self) -> bool:
+        return (
+            self.active and not self._last_partial
+            and time.monotonic() - self._started_at > self.timeout
+        )
+
+    def add_audio(self, data: bytes) -> None:
+        """フォールバック用に発話中の音声を保持"""
+        self._audio.extend(data)
+
+    def update_partial(self, partial: str) -> None:
+        """部分認識結果を通知（変化があった場合のみ）"""
+        if partial and partial != self._last_partial:
+            self._last_partial = partial
+            if self.on_partial:
+                self.on_partial(partial)
+
+    def finish(self, text: str, words: List[dict],
+               audio: Optional[bytes] = None) -> None:
+        """発話の確定結果を受け取り、送信処理をバックグラウンドで実行
+
+        Args:
+            text: ローカルで認識したテキスト
+            words: 単語ごとの信頼度情報
+            audio: フォールバック用の音声（省略時は add_audio で保持した音声）
+        """
+        if audio is None:
+            audio = bytes(self._audio)
+        self.cancel()
+        # 何も認識されなかった場合（雑音やウェイクワード後の無音）は送信しない
+        if not text.strip():
+            return
+        self._executor.submit(self._dispatch, text.strip(), words, audio)
+
+    def _dispatch(self, text: str, words: List[dict], audio: bytes) -> None:
+        try:
+            # サーバー側の音声認識は、認識した単語の信頼度が低い場合だけ使う
+            if mean_confidence(words) >= self.min_confidence or not audio:
+                reply, action = self.client.send_text(text)
+            else:
+                text, reply, action = self.client.transcribe_audio(audio)
+                if not text:
+                    logger.info("サーバー側でも認識できなかったため破棄しました")
+                    return
+            if self.on_result:
+                self.on_result(text, reply)
+            if action and self.on_action:
+                self.on_action(action)
+        except Exception:
+            logger.exception("ディクテーションの送信に失敗しました")
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
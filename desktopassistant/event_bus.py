@@ -0,0 +1,197 @@
+import heapq
+import itertools
+import threading
+import time
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from enum import Enum
+from queue import Empty
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class EventType(str, Enum):
+    """イベントバス上で扱うイベントの種類"""
+    QUIT = "quit"
+    OPEN_CHAT = "open_chat"
+
+
+# 値が小さいほど優先度が高い（quitは他のすべてに優先する）
+DEFAULT_PRIORITIES: Dict[EventType, int] = {
+    EventType.QUIT: 0,
+    EventType.OPEN_CHAT: 10,
+}
+
+# 未処理のものが既にある場合に1つにまとめるイベント
+COALESCED_EVENTS = frozenset({EventType.OPEN_CHAT, EventType.QUIT})
+
+
+@dataclass
+class Event:
+    """イベントバスで受け渡されるイベント
+
+    created_at / handled_at は time.monotonic() の値で、
+    生成から処理までの遅延計測に使用する。
+    """
+    type: EventType
+    priority: int
+    source: str = ""
+    payload: Any = None
+    created_at: float = field(default_factory=time.monotonic)
+    handled_at: Optional[float] = None
+    coalesced: int = 0
+
+    def mark_handled(self) -> None:
+        """イベントを処理済みとして記録"""
+        if self.handled_at is None:
+            self.handled_at = time.monotonic()
+
+    @property
+    def latency(self) -> Optional[float]:
+        """生成から処理までの秒数（未処理の場合はNone）"""
+        if self.handled_at is None:
+            return None
+        return self.handled_at - self.created_at
+
+
+class LatencyHistogram:
+    """固定バケットのレイテンシヒストグラム（スレッドセーフ）"""
+
+    DEFAULT_BUCKETS: Tuple[float, ...] = (
+        0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+    )
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        """1件の観測値を追加"""
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += seconds
+            self._max = max(self._max, seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """バケット上限値による近似パーセンタイル（0 < q <= 1）"""
+        with self._lock:
+            if self._count == 0:
+                return None
+            target = q * self._count
+            running = 0
+            for upper, count in zip(self.buckets, self._counts):
+                running += count
+                if running >= target:
+                    return min(upper, self._max)
+            return self._max
+
+    def snapshot(self) -> Dict[str, Any]:
+        """現在の集計値を辞書で返す"""
+        with self._lock:
+            counts = list(self._counts)
+            count, total, maximum = self._count, self._sum, self._max
+        cumulative = list(itertools.accumulate(counts))
+        return {
+            "buckets": {
+                **{str(b): c for b, c in zip(self.buckets, cumulative)},
+                "+Inf": count,
+            },
+            "count": count,
+            "sum": total,
+            "max": maximum,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+        }
+
+
+class EventBus:
+    """トレイ・音声認識・UIループで共有する型付きイベントバス
+
+    - 同じ種類の未処理イベントは1つにまとめる（coalescing）
+    - 優先度の高いイベント（quit）を先に取り出す
+    - 生成から処理までの遅延をイベント種別ごとに集計する
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[int, int, Event]] = []
+        self._pending: Dict[EventType, Event] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.handling_latency: Dict[EventType, LatencyHistogram] = {
+            event_type: LatencyHistogram() for event_type in EventType
+        }
+        # ウェイクワード検出からウィンドウ表示までのエンドツーエンド遅延
+        self.wake_to_visible = LatencyHistogram()
+
+    def publish(
+        self,
+        event_type: EventType,
+        source: str = "",
+        payload: Any = None,
+        priority: Optional[int] = None,
+    ) -> Event:
+        """イベントを発行する
+
+        同じ種類の未処理イベントがある場合は新しく積まず、既存のイベントを返す。
+        既存イベントの created_at は最初の発行時刻のまま保持される。
+        """
+        event_type = EventType(event_type)
+        with self._cond:
+            pending = self._pending.get(event_type)
+            if pending is not None and event_type in COALESCED_EVENTS:
+                pending.coalesced += 1
+                return pending
+
+            if priority is None:
+                priority = DEFAULT_PRIORITIES.get(event_type, 100)
+            event = Event(event_type, priority, source=source, payload=payload)
+            heapq.heappush(self._heap, (priority, next(self._seq), event))
+            if event_type in COALESCED_EVENTS:
+                self._pending[event_type] = event
+            self._cond.notify()
+            return event
+
+    def get(self, timeout: Optional[float] = None) -> Event:
+        """最も優先度の高いイベントを取り出す
+
+        Raises:
+            queue.Empty: timeout 秒以内にイベントが届かなかった場合
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._heap, timeout=timeout):
+                raise Empty
+            _, _, event = heapq.heappop(self._heap)
+            if self._pending.get(event.type) is event:
+                del self._pending[event.type]
+            return event
+
+    def mark_handled(self, event: Event) -> None:
+        """イベントの処理完了を記録し、処理遅延を集計する"""
+        event.mark_handled()
+        self.handling_latency[event.type].observe(event.latency)
+
+    def record_window_visible(self, event: Event) -> None:
+        """ウィンドウ表示時刻を記録する（音声起動の場合のみ集計）"""
+        if event.source == "voice":
+            self.wake_to_visible.observe(time.monotonic() - event.created_at)
+
+    def qsize(self) -> int:
+        """未処理イベント数"""
+        with self._cond:
+            return len(self._heap)
+
+    def stats(self) -> Dict[str, Any]:
+        """遅延ヒストグラムのスナップショット"""
+        return {
+            "handling_latency": {
+                event_type.value: histogram.snapshot()
+                for event_type, histogram in self.handling_latency.items()
+            },
+            "wake_to_visible": self.wake_to_visible.snapshot(),
+        }
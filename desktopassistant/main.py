@@ -1,9 +1,28 @@
 import webview
 import threading
 from PIL import Image, ImageDraw
-from queue import Queue
+import json
+import logging
 import os
 
+from desktopassistant.dictation import Dictation
+from desktopassistant.event_bus import EventBus, EventType
+from desktopassistant.power import PowerScheduler
+from desktopassistant.voice_handler import VoiceHandler
+
+# Voskモデルのデフォルトパス（リポジトリ直下に同梱）
+DEFAULT_MODEL_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'vosk-model-small-ja-0.22', 'vosk-model-small-ja-0.22'
+)
+
+logger = logging.getLogger(__name__)
+
+# イベント遅延と省電力の統計をログに出力する間隔（秒、0で終了時のみ）
+STATS_LOG_INTERVAL = float(os.getenv('STATS_LOG_INTERVAL', '60'))
+# 操作の依頼でウィンドウを閉じるまでの秒数（応答を読めるように待つ）
+ACTION_DELAY = 0.8
+
 # Lazy import of pystray to improve testability
 def get_pystray():
     from pystray import Icon, Menu, MenuItem
@@ -18,11 +37,22 @@ def get_html_template():
 
 HTML_TEMPLATE = get_html_template()
 
+class WindowApi:
+    """チャット画面のJavaScriptから呼び出せる操作（window.pywebview.api）"""
+    def __init__(self, assistant):
+        self._assistant = assistant
+
+    def close_window(self):
+        """チャットウィンドウを閉じる"""
+        self._assistant.close_window()
+
 class DesktopAssistant:
     def __init__(self):
         self.window = None
-        self.event_queue = Queue()
+        self.event_bus = EventBus()
+        self.power = PowerScheduler()
         self.stop_event = threading.Event()
+        self.voice_handler = None
 
     def create_icon(self):
         """システムトレイアイコンの作成"""
@@ -36,14 +66,19 @@ class DesktopAssistant:
         Icon, Menu, MenuItem = get_pystray()
         
         def on_open(icon, item):
-            self.event_queue.put("open_chat")
+            self.event_bus.publish(EventType.OPEN_CHAT, source="tray")
+
+        def on_toggle_mute(icon, item):
+            self.power.toggle_muted()
 
         def on_quit(icon, item):
-            self.event_queue.put("quit")
+            self.event_bus.publish(EventType.QUIT, source="tray")
             icon.stop()
 
         menu = Menu(
             MenuItem("チャットを開く", on_open),
+            MenuItem("音声認識をミュート", on_toggle_mute,
+                     checked=lambda item: self.power.muted),
             MenuItem("終了", on_quit)
         )
         icon = Icon("DesktopAssistant", self.create_icon(), "デスクトップアシスタント", menu)
@@ -52,21 +87,89 @@ class DesktopAssistant:
     def manage_webview(self):
         """WebViewの管理"""
         while True:
-            event = self.event_queue.get()
-            if event == "open_chat":
+            event = self.event_bus.get()
+            if event.type == EventType.OPEN_CHAT:
+                self.event_bus.mark_handled(event)
                 if self.window is None:
                     self.window = webview.create_window(
                         'デスクトップアシスタント',
                         html=HTML_TEMPLATE,
                         width=400,
                         height=600,
-                        on_top=True
+                        on_top=True,
+                        js_api=WindowApi(self)
+                    )
+                    self.window.events.shown += (
+                        lambda: self.event_bus.record_window_visible(event)
                     )
+                    self.power.set_window_visible(True)
                     webview.start(gui='qt')
+                    self.power.set_window_visible(False)
                     self.window = None
-            elif event == "quit":
+            elif event.type == EventType.QUIT:
+                self.event_bus.mark_handled(event)
                 break
 
+    def close_window(self):
+        """チャットウィンドウを閉じる"""
+        if self.window is not None:
+            self.window.destroy()
+
+    def run_action(self, action):
+        """サーバーのインテント応答で依頼された操作を実行（ディクテーション経由）"""
+        if action == "close_window":
+            # 応答を読めるよう少し待ってから閉じる（チャット画面の runAction と同じ）
+            threading.Timer(ACTION_DELAY, self.close_window).start()
+        elif action == "open_window":
+            self.event_bus.publish(EventType.OPEN_CHAT, source="voice")
+        else:
+            logger.info("未対応の操作: %s", action)
+
+    def show_partial(self, text):
+        """ディクテーションの部分認識結果を入力欄に表示"""
+        if self.window is not None:
+            self.window.evaluate_js(f"input.value = {json.dumps(text)};")
+
+    def show_dictation_result(self, text, reply):
+        """ディクテーションの確定テキストと応答をチャット欄に表示"""
+        if self.window is not None:
+            self.window.evaluate_js(
+                f"input.value = ''; addMessage('You', {json.dumps(text)}, true);"
+                f" addMessage('Assistant', {json.dumps(reply)});"
+            )
+
+    def create_dictation(self):
+        """DICTATION_MODE=local の場合にローカルディクテーションを作成"""
+        if os.getenv('DICTATION_MODE', 'local') != 'local':
+            return None
+        return Dictation(
+            on_partial=self.show_partial,
+            on_result=self.show_dictation_result,
+            on_action=self.run_action
+        )
+
+    def log_stats(self):
+        """イベント遅延のヒストグラムと省電力の統計をログに出力"""
+        logger.info("イベント遅延: %s", json.dumps(self.event_bus.stats(), ensure_ascii=False))
+        logger.info("省電力: %s", json.dumps(self.power.stats(), ensure_ascii=False))
+
+    def log_stats_periodically(self, interval: float):
+        """終了するまで interval 秒ごとに統計をログに出力"""
+        while not self.stop_event.wait(interval):
+            self.log_stats()
+
+    def start_voice_handler(self):
+        """音声認識スレッドの開始（失敗してもアプリは継続）"""
+        model_path = os.getenv('VOSK_MODEL_PATH', DEFAULT_MODEL_PATH)
+        try:
+            self.voice_handler = VoiceHandler(
+                model_path, self.event_bus, self.power, self.create_dictation()
+            )
+            self.voice_handler.start_background()
+        except Exception as e:
+            print(f"Error starting voice recognition: {e}")
+            self.voice_handler = None
+
     def run(self):
         """アプリケーションの実行"""
         # システムトレイアイコンのスレッド開始
@@ -77,9 +180,29 @@ class DesktopAssistant:
         )
         tray_thread.start()
 
+        # 音声認識スレッドの開始
+        self.start_voice_handler()
+
+        if STATS_LOG_INTERVAL > 0:
+            threading.Thread(
+                target=self.log_stats_periodically,
+                args=(STATS_LOG_INTERVAL,),
+                daemon=True
+            ).start()
+
         # WebViewの管理（メインループ）
-        self.manage_webview()
+        try:
+            self.manage_webview()
+        finally:
+            self.stop_event.set()
+            if self.voice_handler:
+                self.voice_handler.stop()
+            self.log_stats()
 
 if __name__ == "__main__":
+    logging.basicConfig(
+        level=os.getenv('LOG_LEVEL', 'INFO'),
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
     app = DesktopAssistant()
     app.run()
@@ -0,0 +1,207 @@
+import ctypes
+import logging
+import os
+import sys
+import threading
+import time
+from enum import Enum
+from typing import Callable, FrozenSet, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class PauseReason(str, Enum):
+    """音声キャプチャを一時停止する理由"""
+    WINDOW_VISIBLE = "window"
+    SCREEN_LOCKED = "locked"
+    USER_IDLE = "idle"
+    MUTED = "muted"
+
+
+def _parse_reasons(value: str) -> FrozenSet[PauseReason]:
+    """カンマ区切りの設定値を PauseReason の集合に変換"""
+    return frozenset(
+        PauseReason(item.strip()) for item in value.split(",") if item.strip()
+    )
+
+
+def get_idle_seconds() -> float:
+    """最後のユーザー入力からの経過秒数（Windows以外では常に0）"""
+    if sys.platform != "win32":
+        return 0.0
+
+    class LASTINPUTINFO(ctypes.Structure):
+        _fields_ = [("cbSize", ctypes.c_uint), ("dwTime", ctypes.c_uint)]
+
+    info = LASTINPUTINFO()
+    info.cbSize = ctypes.sizeof(LASTINPUTINFO)
+    if not ctypes.windll.user32.GetLastInputInfo(ctypes.byref(info)):
+        return 0.0
+    millis = ctypes.windll.kernel32.GetTickCount() - info.dwTime
+    return max(millis, 0) / 1000.0
+
+
+def is_screen_locked() -> bool:
+    """画面がロックされているか（Windows以外では常にFalse）"""
+    if sys.platform != "win32":
+        return False
+    user32 = ctypes.windll.user32
+    # ロック中は入力デスクトップを開けない
+    desktop = user32.OpenInputDesktop(0, False, 0x0100)  # DESKTOP_SWITCHDESKTOP
+    if not desktop:
+        return True
+    try:
+        return not user32.SwitchDesktop(desktop)
+    finally:
+        user32.CloseDesktop(desktop)
+
+
+class PowerScheduler:
+    """状態に応じて音声キャプチャと認識を一時停止するスケジューラ
+
+    ウィンドウ表示中・画面ロック中・一定時間の無操作・トレイからのミュートの
+    うち、設定された状態のいずれかに該当する間はキャプチャを停止する。
+    再開までの遅延は poll_interval 秒以内に収まる（手動操作は即時）。
+    キャプチャ中に毎回呼ばれる should_capture() は、画面ロックと無操作の
+    確認（Win32 API呼び出し）の結果を probe_ttl 秒のあいだ使い回す。
+    """
+
+    def __init__(
+        self,
+        pause_when: Optional[Iterable[PauseReason]] = None,
+        idle_minutes: Optional[float] = None,
+        poll_interval: Optional[float] = None,
+        idle_probe: Callable[[], float] = get_idle_seconds,
+        lock_probe: Callable[[], bool] = is_screen_locked,
+        probe_ttl: Optional[float] = None,
+    ):
+        """
+        Args:
+            pause_when: 一時停止する状態（省略時は環境変数 POWER_PAUSE_STATES）
+            idle_minutes: 無操作とみなすまでの分数（省略時は POWER_IDLE_MINUTES）
+            poll_interval: 状態確認の間隔＝最大再開遅延（省略時は POWER_RESUME_LATENCY）
+            idle_probe: 無操作秒数を返す関数
+            lock_probe: 画面ロック状態を返す関数
+            probe_ttl: should_capture() が確認結果を使い回す秒数（省略時は POWER_PROBE_TTL）
+        """
+        if pause_when is None:
+            pause_when = _parse_reasons(
+                os.getenv("POWER_PAUSE_STATES", "window,locked,idle,muted")
+            )
+        self.pause_when: FrozenSet[PauseReason] = frozenset(pause_when)
+        self.idle_seconds = 60.0 * (
+            idle_minutes if idle_minutes is not None
+            else float(os.getenv("POWER_IDLE_MINUTES", "5"))
+        )
+        self.poll_interval = (
+            poll_interval if poll_interval is not None
+            else float(os.getenv("POWER_RESUME_LATENCY", "0.5"))
+        )
+        self.probe_ttl = (
+            probe_ttl if probe_ttl is not None
+            else float(os.getenv("POWER_PROBE_TTL", "1.0"))
+        )
+        self._idle_probe = idle_probe
+        self._lock_probe = lock_probe
+        # 画面ロックと無操作の確認結果と、その時刻
+        self._probed: Set[PauseReason] = set()
+        self._probed_at: Optional[float] = None
+        self._window_visible = False
+        self._muted = False
+        self._changed = threading.Event()
+        self._lock = threading.Lock()
+
+        # CPU使用量の統計
+        self._active_cpu = 0.0
+        self._active_wall = 0.0
+        self._paused_wall = 0.0
+
+    @property
+    def muted(self) -> bool:
+        return self._muted
+
+    def set_muted(self, muted: bool) -> None:
+        """トレイメニューからのミュート切り替え"""
+        self._muted = muted
+        self._changed.set()
+
+    def toggle_muted(self) -> None:
+        self.set_muted(not self._muted)
+
+    def set_window_visible(self, visible: bool) -> None:
+        """チャットウィンドウの表示状態を通知"""
+        self._window_visible = visible
+        self._changed.set()
+
+    def _probe(self) -> Set[PauseReason]:
+        """画面ロックと無操作を確認する（結果は should_capture() 用に保存）"""
+        reasons = set()
+        try:
+            if PauseReason.SCREEN_LOCKED in self.pause_when and self._lock_probe():
+                reasons.add(PauseReason.SCREEN_LOCKED)
+            if (PauseReason.USER_IDLE in self.pause_when
+                    and self._idle_probe() >= self.idle_seconds):
+                reasons.add(PauseReason.USER_IDLE)
+        except Exception:
+            logger.exception("画面ロック・無操作の確認に失敗しました")
+        self._probed, self._probed_at = reasons, time.monotonic()
+        return reasons
+
+    def _manual_reasons(self) -> Set[PauseReason]:
+        reasons = set()
+        if PauseReason.MUTED in self.pause_when and self._muted:
+            reasons.add(PauseReason.MUTED)
+        if PauseReason.WINDOW_VISIBLE in self.pause_when and self._window_visible:
+            reasons.add(PauseReason.WINDOW_VISIBLE)
+        return reasons
+
+    def pause_reasons(self) -> Set[PauseReason]:
+        """現在該当している一時停止理由（設定で有効なもののみ、毎回確認する）"""
+        return self._manual_reasons() | self._probe()
+
+    def should_capture(self) -> bool:
+        """キャプチャを続けてよいか（画面ロックと無操作は probe_ttl 秒ごとに確認）"""
+        if self._manual_reasons():
+            return False
+        probed_at = self._probed_at
+        if probed_at is None or time.monotonic() - probed_at >= self.probe_ttl:
+            return not self._probe()
+        return not self._probed
+
+    def wait_until_active(self, stop_event: threading.Event) -> None:
+        """キャプチャ再開可能になるか stop_event が立つまで待機する"""
+        started = time.monotonic()
+        try:
+            # 一時停止中は poll_interval ごとに確認し直し、再開を遅らせない
+            while not stop_event.is_set() and self.pause_reasons():
+                self._changed.wait(self.poll_interval)
+                self._changed.clear()
+        finally:
+            with self._lock:
+                self._paused_wall += time.monotonic() - started
+
+    def record_active(self, cpu_seconds: float, wall_seconds: float) -> None:
+        """キャプチャ・認識中に消費したCPU時間を記録する"""
+        with self._lock:
+            self._active_cpu += cpu_seconds
+            self._active_wall += wall_seconds
+
+    @property
+    def cpu_seconds_saved(self) -> float:
+        """一時停止によって節約したCPU秒数の推定値
+
+        稼働中の平均CPU使用率 × 一時停止していた時間で見積もる。
+        """
+        with self._lock:
+            if self._active_wall <= 0:
+                return 0.0
+            return self._paused_wall * (self._active_cpu / self._active_wall)
+
+    def stats(self) -> dict:
+        with self._lock:
+            paused, active_cpu = self._paused_wall, self._active_cpu
+        return {
+            "paused_seconds": paused,
+            "active_cpu_seconds": active_cpu,
+            "cpu_seconds_saved": self.cpu_seconds_saved,
+        }
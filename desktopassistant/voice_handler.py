@@ -2,20 +2,38 @@ from vosk import Model, KaldiRecognizer
 import pyaudio
 import json
 import threading
-from queue import Queue
+import time
 from typing import Optional
 
+from desktopassistant.dictation import Dictation, split_after_wake_word
+from desktopassistant.event_bus import EventBus, EventType
+from desktopassistant.power import PowerScheduler
+
+WAKE_WORD = "パスタ"
+# ウェイクワード判定用に保持する1発話分の音声の上限（16kHz・16ビットで30秒）
+MAX_UTTERANCE_BYTES = 16000 * 2 * 30
+
 class VoiceHandler:
-    def __init__(self, model_path: str, event_queue: Queue):
+    def __init__(self, model_path: str, event_bus: EventBus,
+                 power: Optional[PowerScheduler] = None,
+                 dictation: Optional[Dictation] = None):
         """音声認識ハンドラーの初期化
 
         Args:
             model_path (str): Voskモデルのパス
-            event_queue (Queue): イベントキュー（メインプロセスと共有）
+            event_bus (EventBus): イベントバス（メインプロセスと共有）
+            power (Optional[PowerScheduler]): キャプチャの一時停止を判断するスケジューラ
+            dictation (Optional[Dictation]): ウェイクワード後のローカルディクテーション
         """
         self.model = Model(model_path)
         self.recognizer = KaldiRecognizer(self.model, 16000)
-        self.event_queue = event_queue
+        self.event_bus = event_bus
+        self.power = power
+        self.dictation = dictation
+        self._utterance = bytearray()
+        if dictation:
+            # 信頼度判定のため単語ごとの結果を有効化
+            self.recognizer.SetWords(True)
         self.stop_event = threading.Event()
         self._stream: Optional[pyaudio.Stream] = None
         self._audio: Optional[pyaudio.PyAudio] = None
@@ -34,21 +52,77 @@ class VoiceHandler:
 
         while not self.stop_event.is_set():
             try:
+                dictating = self.dictation and self.dictation.active
+                if self.power and not dictating and not self.power.should_capture():
+                    self._pause()
+                    continue
+
+                started_cpu = time.thread_time()
+                started_wall = time.monotonic()
                 data = self._stream.read(4096, exception_on_overflow=False)
-                if self.recognizer.AcceptWaveform(data):
-                    result = json.loads(self.recognizer.Result())
-                    text = result.get("text", "")
-                    if "パスタ" in text:
-                        self.event_queue.put("open_chat")
+                if dictating:
+                    self._dictate(data)
+                else:
+                    if self.dictation:
+                        self._utterance.extend(data)
+                        if len(self._utterance) > MAX_UTTERANCE_BYTES:
+                            del self._utterance[:len(data)]
+                    if self.recognizer.AcceptWaveform(data):
+                        result = json.loads(self.recognizer.Result())
+                        text = result.get("text", "")
+                        if WAKE_WORD in text:
+                            self.event_bus.publish(EventType.OPEN_CHAT, source="voice")
+                            self._on_wake_word(result)
+                        self._utterance.clear()
+                if self.power:
+                    self.power.record_active(
+                        time.thread_time() - started_cpu,
+                        time.monotonic() - started_wall
+                    )
             except Exception as e:
                 print(f"Error during voice recognition: {e}")
                 break
 
         self.stop()
 
+    def _on_wake_word(self, result: dict):
+        """ウェイクワード検出時にディクテーションを開始する
+
+        ウェイクワードに続けて発話された内容があれば、それをそのまま送信する。
+        """
+        if not self.dictation:
+            return
+        text, words = split_after_wake_word(result, WAKE_WORD)
+        if text:
+            self.dictation.finish(text, words, bytes(self._utterance))
+        else:
+            self.dictation.begin()
+
+    def _dictate(self, data: bytes):
+        """ディクテーション中の音声を認識する（部分結果をストリーミング）"""
+        self.dictation.add_audio(data)
+        if self.recognizer.AcceptWaveform(data):
+            result = json.loads(self.recognizer.Result())
+            self.dictation.finish(result.get("text", ""), result.get("result") or [])
+        else:
+            partial = json.loads(self.recognizer.PartialResult())
+            self.dictation.update_partial(partial.get("partial", ""))
+            if self.dictation.timed_out():
+                self.dictation.cancel()
+
+    def _pause(self):
+        """キャプチャと認識を一時停止し、再開可能になるまで待機"""
+        self._stream.stop_stream()
+        self.recognizer.Reset()
+        self.power.wait_until_active(self.stop_event)
+        if not self.stop_event.is_set():
+            self._stream.start_stream()
+
     def stop(self):
         """音声認識の停止とリソースのクリーンアップ"""
         self.stop_event.set()
+        if self.dictation:
+            self.dictation.cancel()
         if self._stream:
             self._stream.stop_stream()
             self._stream.close()
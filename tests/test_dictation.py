@@ -0,0 +1,150 @@
+import unittest
+import sys
+import os
+from array import array
+from unittest.mock import MagicMock, patch
+
+# メインアプリケーションのパスを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from desktopassistant.dictation import (
+    ChatClient, Dictation, downsample_pcm16, mean_confidence, split_after_wake_word
+)
+
+
+class TestDictation(unittest.TestCase):
+    def make_dictation(self, **kwargs):
+        client = MagicMock()
+        client.send_text.return_value = ("<p>応答</p>", None)
+        client.transcribe_audio.return_value = ("サーバー認識", "<p>サーバー応答</p>", None)
+        on_result = MagicMock()
+        dictation = Dictation(
+            client=client, min_confidence=0.8, timeout=1.0,
+            on_result=on_result, **kwargs
+        )
+        return dictation, client, on_result
+
+    def finish_and_wait(self, dictation, *args):
+        dictation.finish(*args)
+        dictation._executor.shutdown(wait=True)
+
+    def test_high_confidence_sends_text(self):
+        """信頼度が高い場合はテキストのみを送信することのテスト"""
+        dictation, client, on_result = self.make_dictation()
+        dictation.begin()
+        dictation.add_audio(b"\x00\x00" * 10)
+        words = [{"word": "天気", "conf": 0.9}, {"word": "は", "conf": 1.0}]
+        self.finish_and_wait(dictation, "天気 は", words)
+
+        client.send_text.assert_called_once_with("天気 は")
+        client.transcribe_audio.assert_not_called()
+        on_result.assert_called_once_with("天気 は", "<p>応答</p>")
+        self.assertFalse(dictation.active)
+
+    def test_low_confidence_falls_back_to_server(self):
+        """信頼度が低い場合はサーバー側の音声認識にフォールバックすることのテスト"""
+        dictation, client, on_result = self.make_dictation()
+        dictation.begin()
+        dictation.add_audio(b"\x01\x00" * 10)
+        self.finish_and_wait(dictation, "天気", [{"word": "天気", "conf": 0.3}])
+
+        client.send_text.assert_not_called()
+        client.transcribe_audio.assert_called_once_with(b"\x01\x00" * 10)
+        on_result.assert_called_once_with("サーバー認識", "<p>サーバー応答</p>")
+
+    def test_empty_result_is_not_uploaded(self):
+        """ローカルで何も認識されなかった発話（雑音・無音）はサーバーに送らないことのテスト"""
+        dictation, client, on_result = self.make_dictation()
+        dictation.begin()
+        dictation.add_audio(b"\x01\x00" * 10)
+        self.finish_and_wait(dictation, "", [])
+
+        client.send_text.assert_not_called()
+        client.transcribe_audio.assert_not_called()
+        on_result.assert_not_called()
+
+    def test_unrecognized_fallback_is_dropped(self):
+        """サーバー側でも認識テキストが得られなかった場合は結果を通知しないことのテスト"""
+        dictation, client, on_result = self.make_dictation()
+        client.transcribe_audio.return_value = ("", "", None)
+        dictation.begin()
+        dictation.add_audio(b"\x01\x00" * 10)
+        self.finish_and_wait(dictation, "天気", [{"word": "天気", "conf": 0.3}])
+
+        client.transcribe_audio.assert_called_once()
+        on_result.assert_not_called()
+
+    def test_send_errors_are_logged(self):
+        """送信時の例外がログに記録され、後続の処理を止めないことのテスト"""
+        dictation, client, on_result = self.make_dictation()
+        client.send_text.side_effect = ConnectionError("接続できません")
+        with self.assertLogs("desktopassistant.dictation", level="ERROR") as logs:
+            self.finish_and_wait(dictation, "天気", [{"word": "天気", "conf": 0.9}])
+        self.assertIn("接続できません", logs.output[0])
+        on_result.assert_not_called()
+
+    def test_requested_action_is_dispatched(self):
+        """サーバーが依頼した操作が応答の表示後に on_action に渡されることのテスト"""
+        calls = []
+        dictation, client, on_result = self.make_dictation(
+            on_action=lambda action: calls.append(("action", action)))
+        on_result.side_effect = lambda text, reply: calls.append(("result", reply))
+        client.send_text.return_value = ("<p>ウィンドウを閉じます。</p>", "close_window")
+        self.finish_and_wait(dictation, "チャット を 閉じて", [{"word": "閉じて", "conf": 0.9}])
+        self.assertEqual(calls, [("result", "<p>ウィンドウを閉じます。</p>"),
+                                 ("action", "close_window")])
+
+    def test_send_text_returns_action_and_session(self):
+        """/chat の応答から操作とセッションIDを受け取ることのテスト"""
+        client = ChatClient(base_url="http://server")
+        response = MagicMock()
+        response.json.return_value = {
+            "response": "<p>ウィンドウを閉じます。</p>", "action": "close_window",
+            "session_id": "abc",
+        }
+        with patch("desktopassistant.dictation.requests.post", return_value=response) as post:
+            self.assertEqual(client.send_text("チャットを閉じて"),
+                             ("<p>ウィンドウを閉じます。</p>", "close_window"))
+            response.json.return_value = {"response": "<p>はい</p>", "session_id": "abc"}
+            self.assertEqual(client.send_text("こんにちは"), ("<p>はい</p>", None))
+        self.assertEqual(post.call_args.kwargs["json"]["session_id"], "abc")
+
+    def test_partial_results_are_streamed(self):
+        """部分認識結果が変化した時のみ通知されることのテスト"""
+        on_partial = MagicMock()
+        dictation, _, _ = self.make_dictation(on_partial=on_partial)
+        dictation.begin()
+        dictation.update_partial("今日")
+        dictation.update_partial("今日")
+        dictation.update_partial("今日の")
+        self.assertEqual(on_partial.call_count, 2)
+
+    def test_split_after_wake_word(self):
+        """ウェイクワード以降のテキスト抽出のテスト"""
+        result = {
+            "text": "パスタ 今日 の 天気",
+            "result": [
+                {"word": "パスタ", "conf": 1.0},
+                {"word": "今日", "conf": 0.9},
+                {"word": "の", "conf": 0.7},
+                {"word": "天気", "conf": 0.8},
+            ],
+        }
+        text, words = split_after_wake_word(result, "パスタ")
+        self.assertEqual(text, "今日 の 天気")
+        self.assertAlmostEqual(mean_confidence(words), 0.8)
+
+        text, words = split_after_wake_word({"text": "パスタ"}, "パスタ")
+        self.assertEqual(text, "")
+        self.assertEqual(mean_confidence(words), 0.0)
+
+    def test_downsample_pcm16(self):
+        """16kHzから8kHzへの変換のテスト"""
+        pcm = array("h", [100, 200, -100, -300, 7]).tobytes()
+        out = array("h")
+        out.frombytes(downsample_pcm16(pcm, 2))
+        self.assertEqual(list(out), [150, -200])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import sys
+import os
+import threading
+from queue import Empty
+
+# メインアプリケーションのパスを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from desktopassistant.event_bus import EventBus, EventType
+
+
+class TestEventBus(unittest.TestCase):
+    def test_coalesces_pending_events(self):
+        """未処理の同種イベントが1つにまとめられることのテスト"""
+        bus = EventBus()
+        first = bus.publish(EventType.OPEN_CHAT, source="voice")
+        second = bus.publish(EventType.OPEN_CHAT, source="voice")
+
+        self.assertIs(first, second)
+        self.assertEqual(first.coalesced, 1)
+        self.assertEqual(bus.qsize(), 1)
+
+        # 取り出した後は新しいイベントとして積まれる
+        bus.get()
+        third = bus.publish(EventType.OPEN_CHAT)
+        self.assertIsNot(first, third)
+
+    def test_quit_preempts_other_events(self):
+        """quitが先に発行されたイベントより優先されることのテスト"""
+        bus = EventBus()
+        bus.publish(EventType.OPEN_CHAT)
+        bus.publish(EventType.QUIT)
+
+        self.assertEqual(bus.get().type, EventType.QUIT)
+        self.assertEqual(bus.get().type, EventType.OPEN_CHAT)
+
+    def test_get_timeout(self):
+        """イベントがない場合にタイムアウトすることのテスト"""
+        bus = EventBus()
+        with self.assertRaises(Empty):
+            bus.get(timeout=0.01)
+
+    def test_get_from_other_thread(self):
+        """別スレッドから発行されたイベントを受け取れることのテスト"""
+        bus = EventBus()
+        timer = threading.Timer(0.01, bus.publish, args=(EventType.OPEN_CHAT,))
+        timer.start()
+        event = bus.get(timeout=1.0)
+        timer.join()
+        self.assertEqual(event.type, EventType.OPEN_CHAT)
+
+    def test_latency_is_recorded(self):
+        """処理遅延とウェイクワードからの表示遅延が集計されることのテスト"""
+        bus = EventBus()
+        bus.publish(EventType.OPEN_CHAT, source="voice")
+        event = bus.get()
+        bus.mark_handled(event)
+        bus.record_window_visible(event)
+
+        self.assertIsNotNone(event.latency)
+        stats = bus.stats()
+        self.assertEqual(stats["handling_latency"]["open_chat"]["count"], 1)
+        self.assertEqual(stats["wake_to_visible"]["count"], 1)
+
+        # トレイからの起動はウェイクワード遅延に含めない
+        bus.publish(EventType.OPEN_CHAT, source="tray")
+        bus.record_window_visible(bus.get())
+        self.assertEqual(bus.stats()["wake_to_visible"]["count"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+import sys
+import os
+import threading
+import time
+
+# メインアプリケーションのパスを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from desktopassistant.power import PauseReason, PowerScheduler
+
+
+class TestPowerScheduler(unittest.TestCase):
+    def make_scheduler(self, idle=0.0, locked=False, **kwargs):
+        state = {"idle": idle, "locked": locked}
+        scheduler = PowerScheduler(
+            idle_minutes=kwargs.pop("idle_minutes", 1.0),
+            poll_interval=kwargs.pop("poll_interval", 0.01),
+            idle_probe=lambda: state["idle"],
+            lock_probe=lambda: state["locked"],
+            **kwargs
+        )
+        return scheduler, state
+
+    def test_pause_reasons(self):
+        """各状態で一時停止理由が検出されることのテスト"""
+        scheduler, state = self.make_scheduler()
+        self.assertTrue(scheduler.should_capture())
+
+        scheduler.set_window_visible(True)
+        self.assertEqual(scheduler.pause_reasons(), {PauseReason.WINDOW_VISIBLE})
+        scheduler.set_window_visible(False)
+
+        state["locked"] = True
+        state["idle"] = 120.0
+        scheduler.set_muted(True)
+        self.assertEqual(
+            scheduler.pause_reasons(),
+            {PauseReason.SCREEN_LOCKED, PauseReason.USER_IDLE, PauseReason.MUTED},
+        )
+
+    def test_disabled_states_are_ignored(self):
+        """設定で無効な状態では一時停止しないことのテスト"""
+        scheduler, _ = self.make_scheduler(pause_when=[PauseReason.MUTED])
+        scheduler.set_window_visible(True)
+        self.assertTrue(scheduler.should_capture())
+
+    def test_should_capture_reuses_probe_results(self):
+        """should_capture() が probe_ttl のあいだ確認結果を使い回すことのテスト"""
+        calls = []
+        state = {"locked": False}
+
+        def lock_probe():
+            calls.append(1)
+            return state["locked"]
+
+        scheduler = PowerScheduler(idle_minutes=1.0, idle_probe=lambda: 0.0,
+                                   lock_probe=lock_probe, probe_ttl=0.1)
+        for _ in range(100):
+            self.assertTrue(scheduler.should_capture())
+        self.assertEqual(len(calls), 1)
+
+        # 手動操作は確認結果を待たずに即時反映される
+        scheduler.set_muted(True)
+        self.assertFalse(scheduler.should_capture())
+        scheduler.set_muted(False)
+
+        state["locked"] = True
+        self.assertTrue(scheduler.should_capture())
+        time.sleep(0.12)
+        self.assertFalse(scheduler.should_capture())
+        self.assertEqual(len(calls), 2)
+
+    def test_resume_after_unmute(self):
+        """ミュート解除で待機が解除されることのテスト"""
+        scheduler, _ = self.make_scheduler(poll_interval=5.0)
+        scheduler.set_muted(True)
+        threading.Timer(0.05, scheduler.set_muted, args=(False,)).start()
+
+        started = time.monotonic()
+        scheduler.wait_until_active(threading.Event())
+        # ポーリング間隔を待たずに即時再開する
+        self.assertLess(time.monotonic() - started, 1.0)
+
+    def test_cpu_seconds_saved(self):
+        """節約したCPU秒数が推定されることのテスト"""
+        scheduler, state = self.make_scheduler()
+        scheduler.record_active(cpu_seconds=0.5, wall_seconds=1.0)
+        state["locked"] = True
+        threading.Timer(0.1, state.update, args=({"locked": False},)).start()
+        scheduler.wait_until_active(threading.Event())
+
+        stats = scheduler.stats()
+        self.assertGreater(stats["paused_seconds"], 0.05)
+        self.assertAlmostEqual(
+            stats["cpu_seconds_saved"], stats["paused_seconds"] * 0.5
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,7 +11,7 @@ class TestSystemTray(unittest.TestCase):
     @patch('desktopassistant.main.get_pystray')
     @patch('desktopassistant.main.VoiceHandler')
     def test_event_queue(self, mock_voice_handler, mock_get_pystray):
-        """イベントキューのテスト"""
+        """イベントバスのテスト"""
         # モックpystrayコンポーネントの設定
         mock_icon = MagicMock()
         mock_menu = MagicMock()
@@ -26,17 +26,17 @@ class TestSystemTray(unittest.TestCase):
         
         app = DesktopAssistant()
         
-        # イベントキューにチャットウィンドウを開くイベントを送信
-        app.event_queue.put("open_chat")
+        # イベントバスにチャットウィンドウを開くイベントを送信
+        app.event_bus.publish("open_chat")
         
-        # キューにイベントが正しく追加されたことを確認
-        event = app.event_queue.get()
-        self.assertEqual(event, "open_chat")
+        # バスにイベントが正しく追加されたことを確認
+        event = app.event_bus.get()
+        self.assertEqual(event.type, "open_chat")
         
         # 終了イベントを送信
-        app.event_queue.put("quit")
-        event = app.event_queue.get()
-        self.assertEqual(event, "quit")
+        app.event_bus.publish("quit")
+        event = app.event_bus.get()
+        self.assertEqual(event.type, "quit")
 
 if __name__ == '__main__':
     unittest.main()